@@ -11,6 +11,7 @@ from selfdrive.controls.lib.drive_helpers import V_CRUISE_MAX
 from selfdrive.controls.lib.events import Events
 from selfdrive.controls.lib.vehicle_model import VehicleModel
 from common.params import Params
+from opendbc.can.parser import CANParserGroup
 
 GearShifter = car.CarState.GearShifter
 EventName = car.CarEvent.EventName
@@ -41,11 +42,21 @@ class CarInterfaceBase():
       self.cp = self.CS.get_can_parser(CP)
       self.cp_cam = self.CS.get_cam_can_parser(CP)
       self.cp_body = self.CS.get_body_can_parser(CP)
+      # feeds all parsers from one pass over each can event
+      can_parsers = [self.cp, self.cp_cam, self.cp_body] + self.get_extra_can_parsers()
+      self.can_parsers = CANParserGroup([cp for cp in can_parsers if cp is not None])
 
     self.CC = None
     if CarController is not None:
       self.CC = CarController(self.cp.dbc_name, CP, self.VM)
 
+  def get_extra_can_parsers(self):
+    """Parsers of the car beyond cp, cp_cam and cp_body, they are updated with the others.
+
+       Subclasses create them before calling CarInterfaceBase.__init__.
+    """
+    return []
+
   @staticmethod
   def get_pid_accel_limits(current_speed, cruise_speed):
     return ACCEL_MIN, ACCEL_MAX
@@ -6,8 +6,11 @@ from selfdrive.car.interfaces import CarInterfaceBase
 
 class CarInterface(CarInterfaceBase):
   def __init__(self, CP, CarController, CarState):
+    self.cp_adas = CarState.get_adas_can_parser(CP)
     super().__init__(CP, CarController, CarState)
-    self.cp_adas = self.CS.get_adas_can_parser(CP)
+
+  def get_extra_can_parsers(self):
+    return [self.cp_adas]
 
   @staticmethod
   def get_params(candidate, fingerprint=gen_empty_fingerprint(), car_fw=None):
@@ -57,9 +60,7 @@ class CarInterface(CarInterfaceBase):
 
   # returns a car.CarState
   def update(self, c, can_strings):
-    self.cp.update_strings(can_strings)
-    self.cp_cam.update_strings(can_strings)
-    self.cp_adas.update_strings(can_strings)
+    self.can_parsers.update_strings(can_strings)
 
     ret = self.CS.update(self.cp, self.cp_adas, self.cp_cam)
 
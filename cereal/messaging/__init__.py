@@ -2,10 +2,11 @@
 from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disable=no-name-in-module, import-error
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
 import os
+import struct
 import capnp
 
-from typing import Optional, List, Union
-from collections import deque
+from typing import Callable, Dict, Optional, List, Tuple, Union
+from collections.abc import Mapping
 
 from cereal import log
 from cereal.services import service_list
@@ -30,6 +31,40 @@ context = Context()
 def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
   return log.Event.from_bytes(dat, traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
 
+# Where Event keeps which(), logMonoTime and valid in its data section
+_EVENT = log.Event.schema.node.struct
+_EVENT_DATA_WORDS = _EVENT.dataWordCount
+_EVENT_WHICH_OFFSET = _EVENT.discriminantOffset * 2
+_EVENT_LOG_MONO_TIME_OFFSET = log.Event.schema.fields['logMonoTime'].proto.slot.offset * 8
+_EVENT_VALID_BIT = log.Event.schema.fields['valid'].proto.slot.offset
+_EVENT_WHICH = {f.proto.discriminantValue: name for name, f in log.Event.schema.fields.items()
+                if f.proto.discriminantValue != 0xffff}  # fields outside the union have no discriminant
+
+def event_header(dat: bytes) -> Optional[Tuple[str, int, bool]]:
+  """Returns which(), logMonoTime and valid of a serialized Event without decoding it.
+
+     Returns None when the message isn't laid out as expected, it then needs a full decode.
+  """
+  n_segments = struct.unpack_from("<I", dat)[0] + 1
+  root = (4 + 4 * n_segments + 7) & ~7
+  ptr = struct.unpack_from("<Q", dat, root)[0]
+  if ptr & 3 != 0 or (ptr >> 32) & 0xffff < _EVENT_DATA_WORDS:
+    # far pointer or a struct from an older schema, where some fields take their defaults
+    return None
+
+  offset = (ptr >> 2) & 0x3fffffff
+  if offset & 0x20000000:
+    offset -= 0x40000000
+  start = root + 8 + offset * 8
+
+  which = _EVENT_WHICH.get(struct.unpack_from("<H", dat, start + _EVENT_WHICH_OFFSET)[0])
+  if which is None:
+    return None
+  log_mono_time = struct.unpack_from("<Q", dat, start + _EVENT_LOG_MONO_TIME_OFFSET)[0]
+  # bools are stored xor'd with their default, valid defaults to true
+  valid = not (dat[start + _EVENT_VALID_BIT // 8] >> (_EVENT_VALID_BIT % 8)) & 1
+  return which, log_mono_time, valid
+
 def new_message(service: Optional[str] = None, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
   dat = log.Event.new_message()
   dat.logMonoTime = int(sec_since_boot() * 1e9)
@@ -133,21 +168,53 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
     if dat is not None:
       return log_from_bytes(dat)
 
+class ServiceView(Mapping):
+  """Read-only dict-like view of one of SubMaster's per-service lists."""
+  def __init__(self, idx: Dict[str, int], values: list):
+    self._idx = idx
+    self._values = values
+
+  def __getitem__(self, s: str):
+    return self._values[self._idx[s]]
+
+  def __iter__(self):
+    return iter(self._idx)
+
+  def __len__(self) -> int:
+    return len(self._idx)
+
+
+class ServiceFlags(Mapping):
+  """Read-only dict-like view of one of SubMaster's bitsets, with a bit per service."""
+  def __init__(self, idx: Dict[str, int], get_bits: Callable[[], int]):
+    self._idx = idx
+    self._get_bits = get_bits
+
+  def __getitem__(self, s: str) -> bool:
+    return bool(self._get_bits() >> self._idx[s] & 1)
+
+  def __iter__(self):
+    return iter(self._idx)
+
+  def __len__(self) -> int:
+    return len(self._idx)
+
+
 class SubMaster():
+  """Per-service state is kept in lists indexed by service and in bitsets, updated, alive, freq_ok and valid
+     are read-only dict-like views of them. alive and freq_ok are only recomputed when they're read.
+
+     Messages received as bytes are only decoded when first read with sm[s].
+  """
   def __init__(self, services: List[str], poll: Optional[List[str]] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
                addr: str = "127.0.0.1"):
     self.frame = -1
-    self.updated = {s: False for s in services}
-    self.rcv_time = {s: 0. for s in services}
-    self.rcv_frame = {s: 0 for s in services}
-    self.alive = {s: False for s in services}
-    self.recv_dts = {s: deque([0.0] * AVG_FREQ_HISTORY, maxlen=AVG_FREQ_HISTORY) for s in services}
+    self.services = list(services)
     self.sock = {}
     self.freq = {}
     self.data = {}
-    self.valid = {}
-    self.logMonoTime = {}
+    self._raw: Dict[str, bytes] = {}  # received, not yet decoded
 
     self.poller = Poller()
     self.non_polled_services = [s for s in services if poll is not None and
@@ -156,7 +223,29 @@ class SubMaster():
     self.ignore_average_freq = [] if ignore_avg_freq is None else ignore_avg_freq
     self.ignore_alive = [] if ignore_alive is None else ignore_alive
 
-    for s in services:
+    n = len(self.services)
+    self._idx = {s: i for i, s in enumerate(self.services)}
+    self._rcv_time = [0.] * n
+    self._rcv_frame = [0] * n
+    self._log_mono_time = [0] * n
+    self._recv_dts = [[0.] * AVG_FREQ_HISTORY for _ in range(n)]
+    self._dt_pos = [0] * n
+    self._dt_sum = [0.] * n
+    self._track_freq = [False] * n
+    self._max_delay = [0.] * n
+    self._max_dt_sum = [0.] * n
+
+    self._all_mask = (1 << n) - 1
+    self._check_alive_mask = 0  # services not in ignore_alive
+    self._freq_mask = 0  # services with a frequency, others are always alive
+    self._updated = 0
+    self._valid = 0
+    self._alive = 0
+    self._freq_ok = 0
+    self._checked_frame = -1
+    self._cur_time = 0.
+
+    for i, s in enumerate(self.services):
       if addr is not None:
         p = self.poller if s not in self.non_polled_services else None
         self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
@@ -168,74 +257,176 @@ class SubMaster():
         data = new_message(s, 0) # lists
 
       self.data[s] = getattr(data, s)
-      self.logMonoTime[s] = 0
-      self.valid[s] = data.valid
+      self._valid |= data.valid << i
+
+      if s not in self.ignore_alive:
+        self._check_alive_mask |= 1 << i
+
+      # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
+      if self.freq[s] > 1e-5:
+        self._freq_mask |= 1 << i
+        self._track_freq[i] = s not in self.non_polled_services and s not in self.ignore_average_freq
+        # alive if delay is within 10x the expected frequency
+        self._max_delay[i] = 10. / self.freq[s]
+        # alive if average frequency is higher than 90% of expected frequency
+        self._max_dt_sum[i] = AVG_FREQ_HISTORY / (self.freq[s] * 0.90)
+
+    self.updated = ServiceFlags(self._idx, lambda: self._updated)
+    self.valid = ServiceFlags(self._idx, lambda: self._valid)
+    self.alive = ServiceFlags(self._idx, self._get_alive)
+    self.freq_ok = ServiceFlags(self._idx, self._get_freq_ok)
+    self.rcv_time = ServiceView(self._idx, self._rcv_time)
+    self.rcv_frame = ServiceView(self._idx, self._rcv_frame)
+    self.logMonoTime = ServiceView(self._idx, self._log_mono_time)
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if s in self._raw:
+      self.data[s] = getattr(log_from_bytes(self._raw.pop(s)), s)
     return self.data[s]
 
   def update(self, timeout: int = 1000) -> None:
     msgs = []
     for sock in self.poller.poll(timeout):
-      msgs.append(recv_one_or_none(sock))
+      msgs.append(sock.receive(non_blocking=True))
 
     # non-blocking receive for non-polled sockets
     for s in self.non_polled_services:
-      msgs.append(recv_one_or_none(self.sock[s]))
+      msgs.append(self.sock[s].receive(non_blocking=True))
     self.update_msgs(sec_since_boot(), msgs)
 
-  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+  def update_msgs(self, cur_time: float, msgs: List[Union[None, bytes, capnp.lib.capnp._DynamicStructReader]]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    updated = 0
+    valid = self._valid
     for msg in msgs:
       if msg is None:
         continue
 
-      s = msg.which()
-      self.updated[s] = True
-
-      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
-        and (s not in self.ignore_average_freq):
-        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+      header = event_header(msg) if isinstance(msg, bytes) else None
+      if header is not None:
+        s, log_mono_time, msg_valid = header
+        self._raw[s] = msg
+      else:
+        if isinstance(msg, bytes):
+          msg = log_from_bytes(msg)
+        s, log_mono_time, msg_valid = msg.which(), msg.logMonoTime, msg.valid
+        self._raw.pop(s, None)
+        self.data[s] = getattr(msg, s)
+
+      i = self._idx[s]
+      bit = 1 << i
+      updated |= bit
+
+      if self._track_freq[i] and self._rcv_time[i] > 1e-5:
+        # running sum over the last AVG_FREQ_HISTORY receive intervals
+        dt = cur_time - self._rcv_time[i]
+        pos = self._dt_pos[i]
+        hist = self._recv_dts[i]
+        self._dt_sum[i] += dt - hist[pos]
+        hist[pos] = dt
+        pos += 1
+        if pos == AVG_FREQ_HISTORY:
+          pos = 0
+          self._dt_sum[i] = sum(hist)  # drop the accumulated rounding error
+        self._dt_pos[i] = pos
+
+      self._rcv_time[i] = cur_time
+      self._rcv_frame[i] = self.frame
+      self._log_mono_time[i] = log_mono_time
+      if msg_valid:
+        valid |= bit
+      else:
+        valid &= ~bit
+
+    self._updated = updated
+    self._valid = valid
+    self._cur_time = cur_time
+    if SIMULATION:
+      self._alive |= updated
+
+  def _check_alive(self) -> None:
+    if self._checked_frame == self.frame:
+      return
+
+    # services without a frequency are always alive
+    freq_ok = alive = self._all_mask & ~self._freq_mask
+    freq_mask = self._freq_mask
+    i = 0
+    while freq_mask:
+      if freq_mask & 1 and self._dt_sum[i] < self._max_dt_sum[i]:
+        freq_ok |= 1 << i
+        if (self._cur_time - self._rcv_time[i]) < self._max_delay[i]:
+          alive |= 1 << i
+      freq_mask >>= 1
+      i += 1
+
+    self._freq_ok = freq_ok
+    if not SIMULATION:
+      self._alive = alive
+    self._checked_frame = self.frame
 
-      self.rcv_time[s] = cur_time
-      self.rcv_frame[s] = self.frame
-      self.data[s] = getattr(msg, s)
-      self.logMonoTime[s] = msg.logMonoTime
-      self.valid[s] = msg.valid
+  def _get_alive(self) -> int:
+    self._check_alive()
+    return self._alive
 
-      if SIMULATION:
-        self.alive[s] = True
+  def _get_freq_ok(self) -> int:
+    self._check_alive()
+    return self._freq_ok
 
-    if not SIMULATION:
-      for s in self.data:
-        # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
-        if self.freq[s] > 1e-5:
-          # alive if delay is within 10x the expected frequency
-          self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s])
-
-          # alive if average frequency is higher than 90% of expected frequency
-          avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
-          expected_dt = 1 / (self.freq[s] * 0.90)
-          self.alive[s] = self.alive[s] and (avg_dt < expected_dt)
-        else:
-          self.alive[s] = True
+  def _mask(self, service_list) -> int:
+    mask = 0
+    for s in service_list:
+      mask |= 1 << self._idx[s]
+    return mask
 
   def all_alive(self, service_list=None) -> bool:
-    if service_list is None:  # check all
-      service_list = self.alive.keys()
-    return all(self.alive[s] for s in service_list if s not in self.ignore_alive)
+    mask = self._all_mask if service_list is None else self._mask(service_list)  # check all
+    mask &= self._check_alive_mask
+    return self._get_alive() & mask == mask
 
   def all_valid(self, service_list=None) -> bool:
-    if service_list is None:  # check all
-      service_list = self.valid.keys()
-    return all(self.valid[s] for s in service_list)
+    mask = self._all_mask if service_list is None else self._mask(service_list)  # check all
+    return self._valid & mask == mask
 
   def all_alive_and_valid(self, service_list=None) -> bool:
-    if service_list is None:  # check all
-      service_list = self.alive.keys()
     return self.all_alive(service_list=service_list) and self.all_valid(service_list=service_list)
 
+class BuilderPool():
+  """Hands out one reused builder per service and list size, instead of a new message each cycle.
+
+     Only for messages that are refilled in place: scalar fields, structs set from dicts and elements of
+     lists created by get(). Setting text, data or list fields allocates again in the message, a builder
+     found to have grown past its first fill is replaced by a new one.
+  """
+  CHECK_INTERVAL = 100  # gets between checks of the builder size, which copies the message
+
+  def __init__(self):
+    self.builders: Dict[Tuple[str, Optional[int]], capnp.lib.capnp._DynamicStructBuilder] = {}
+    self.sizes: Dict[Tuple[str, Optional[int]], int] = {}
+    self.gets: Dict[Tuple[str, Optional[int]], int] = {}
+
+  def get(self, service: str, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
+    key = (service, size)
+    dat = self.builders.get(key)
+    if dat is not None:
+      # the last send wrote the message, to_segments would warn about writing it again
+      dat.clear_write_flag()
+      gets = self.gets[key] = self.gets[key] + 1
+      if gets == 1 or gets % self.CHECK_INTERVAL == 0:
+        used = sum(len(segment) for segment in dat.to_segments())
+        if self.sizes.setdefault(key, used) < used:
+          dat = None
+
+    if dat is None:
+      dat = self.builders[key] = new_message(service, size)
+      self.sizes.pop(key, None)
+      self.gets[key] = 0
+    else:
+      dat.logMonoTime = int(sec_since_boot() * 1e9)
+      dat.valid = True
+    return dat
+
+
 class PubMaster():
   def __init__(self, services: List[str]):
     self.sock = {}
@@ -247,5 +438,11 @@ class PubMaster():
       dat = dat.to_bytes()
     self.sock[s].send(dat)
 
+  def send_many(self, msgs: List[Tuple[str, Union[bytes, capnp.lib.capnp._DynamicStructBuilder]]]) -> None:
+    """Sends (service, message) pairs in order, all are serialized before the first one goes out."""
+    dats = [(s, dat if isinstance(dat, bytes) else dat.to_bytes()) for s, dat in msgs]
+    for s, dat in dats:
+      self.sock[s].send(dat)
+
   def all_readers_updated(self, s: str) -> bool:
     return self.sock[s].all_readers_updated()
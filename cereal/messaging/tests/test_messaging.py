@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+import capnp
+import cereal.messaging as messaging
+from cereal import log
+
+
+def make_event(s, log_mono_time, valid=True, first_segment_words=None):
+  kwargs = {} if first_segment_words is None else {'num_first_segment_words': first_segment_words}
+  msg = log.Event.new_message(**kwargs)
+  msg.logMonoTime = log_mono_time
+  msg.valid = valid
+  if s == "logMessage":
+    msg.logMessage = "x" * 100
+  elif s in ("can", "sendcan"):
+    for i, c in enumerate(msg.init(s, 4)):
+      c.address, c.dat = i, bytes(8)
+  else:
+    msg.init(s)
+  if s == "carState":
+    msg.carState.vEgo = 12.5
+  return msg
+
+
+class TestEventHeader(unittest.TestCase):
+  def test_matches_full_decode(self):
+    n_segments = set()
+    for s in ("carState", "can", "sendcan", "logMessage", "deviceState", "controlsState", "liveCalibration"):
+      for valid in (True, False):
+        # small first segments spread the message over several segments
+        for words in (None, 4, 8, 64):
+          msg = make_event(s, 2**40 + 7, valid, words)
+          n_segments.add(len(msg.to_segments()))
+          dat = msg.to_bytes()
+
+          ev = messaging.log_from_bytes(dat)
+          self.assertEqual(messaging.event_header(dat), (ev.which(), ev.logMonoTime, ev.valid), (s, valid, words))
+          self.assertEqual(messaging.event_header(dat), (s, 2**40 + 7, valid))
+    self.assertTrue(max(n_segments) > 1)
+
+  def test_far_pointer(self):
+    # with a one word first segment the root struct lands in another segment behind a far pointer
+    msg = make_event("carState", 123, False, 1)
+    self.assertGreater(len(msg.to_segments()), 1)
+    self.assertIsNone(messaging.event_header(msg.to_bytes()))
+
+  def test_default_event(self):
+    # nothing set, valid reads back as its default
+    dat = log.Event.new_message().to_bytes()
+    ev = messaging.log_from_bytes(dat)
+    self.assertEqual(messaging.event_header(dat), (ev.which(), ev.logMonoTime, ev.valid))
+    self.assertTrue(ev.valid)
+
+
+class TestLazyDecode(unittest.TestCase):
+  def setUp(self):
+    self.sm = messaging.SubMaster(["carState", "deviceState"], addr=None)
+
+  def test_decode_on_first_access(self):
+    with mock.patch.object(messaging, "log_from_bytes", wraps=messaging.log_from_bytes) as decode:
+      self.sm.update_msgs(1., [make_event("carState", 1, False).to_bytes()])
+      decode.assert_not_called()
+      self.assertTrue(self.sm.updated["carState"])
+      self.assertFalse(self.sm.valid["carState"])
+      self.assertEqual(self.sm.logMonoTime["carState"], 1)
+
+      self.assertEqual(self.sm["carState"].vEgo, 12.5)
+      self.assertEqual(decode.call_count, 1)
+      self.sm["carState"]
+      self.assertEqual(decode.call_count, 1)
+
+      # a new message invalidates the decoded one
+      msg = make_event("carState", 2)
+      msg.carState.vEgo = 20.
+      self.sm.update_msgs(2., [msg.to_bytes()])
+      self.assertEqual(decode.call_count, 1)
+      self.assertEqual(self.sm["carState"].vEgo, 20.)
+      self.assertEqual(decode.call_count, 2)
+
+      # messages that aren't read are never decoded
+      for i in range(10):
+        self.sm.update_msgs(3. + i, [make_event("deviceState", i).to_bytes()])
+      self.assertEqual(decode.call_count, 2)
+      self.assertEqual(self.sm.logMonoTime["deviceState"], 9)
+
+  def test_decoded_message_replaces_raw(self):
+    self.sm.update_msgs(1., [make_event("carState", 1).to_bytes()])
+    msg = make_event("carState", 2)
+    msg.carState.vEgo = 30.
+    self.sm.update_msgs(2., [messaging.log_from_bytes(msg.to_bytes())])
+    self.assertEqual(self.sm["carState"].vEgo, 30.)
+
+  def test_far_pointer_decodes_on_update(self):
+    msg = make_event("carState", 5, False, 1)
+    with mock.patch.object(messaging, "log_from_bytes", wraps=messaging.log_from_bytes) as decode:
+      self.sm.update_msgs(1., [msg.to_bytes()])
+      self.assertEqual(decode.call_count, 1)
+    self.assertFalse(self.sm.valid["carState"])
+    self.assertEqual(self.sm.logMonoTime["carState"], 5)
+    self.assertEqual(self.sm["carState"].vEgo, 12.5)
+    self.assertIsInstance(self.sm["carState"], capnp.lib.capnp._DynamicStructReader)
+
+
+if __name__ == "__main__":
+  unittest.main()
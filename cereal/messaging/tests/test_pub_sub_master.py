@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import random
+import unittest
+import warnings
+from collections import deque
+from unittest import mock
+
+import cereal.messaging as messaging
+from cereal.services import service_list
+
+AVG_FREQ_HISTORY = messaging.AVG_FREQ_HISTORY
+
+SERVICES = ["carState", "controlsState", "deviceState", "liveCalibration", "radarState", "androidLog"]
+POLL = ["carState", "deviceState", "liveCalibration", "radarState", "androidLog"]  # controlsState isn't polled
+IGNORE_ALIVE = ["liveCalibration"]
+IGNORE_AVG_FREQ = ["radarState"]
+
+
+def make_msg(s, log_mono_time, valid=True):
+  msg = messaging.new_message(s)
+  msg.logMonoTime = log_mono_time
+  msg.valid = valid
+  return msg.to_bytes()
+
+
+class ReferenceSubMaster():
+  """The dict based SubMaster state the per-service lists and bitsets replaced."""
+  def __init__(self, services, poll, ignore_alive, ignore_avg_freq):
+    self.frame = -1
+    self.updated = {s: False for s in services}
+    self.rcv_time = {s: 0. for s in services}
+    self.rcv_frame = {s: 0 for s in services}
+    self.alive = {s: False for s in services}
+    self.freq_ok = {s: False for s in services}
+    self.recv_dts = {s: deque([0.0] * AVG_FREQ_HISTORY, maxlen=AVG_FREQ_HISTORY) for s in services}
+    self.freq = {s: service_list[s].frequency for s in services}
+    self.valid = {s: True for s in services}
+    self.logMonoTime = {s: 0 for s in services}
+    self.non_polled_services = [s for s in services if s not in poll]
+    self.ignore_alive = ignore_alive
+    self.ignore_average_freq = ignore_avg_freq
+
+  def update_msgs(self, cur_time, msgs):
+    self.frame += 1
+    self.updated = dict.fromkeys(self.updated, False)
+    for msg in msgs:
+      s = msg.which()
+      self.updated[s] = True
+      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
+        and (s not in self.ignore_average_freq):
+        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+      self.rcv_time[s] = cur_time
+      self.rcv_frame[s] = self.frame
+      self.logMonoTime[s] = msg.logMonoTime
+      self.valid[s] = msg.valid
+
+    for s in self.updated:
+      if self.freq[s] > 1e-5:
+        avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
+        self.freq_ok[s] = avg_dt < 1 / (self.freq[s] * 0.90)
+        self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s]) and self.freq_ok[s]
+      else:
+        self.freq_ok[s] = self.alive[s] = True
+
+  def all_alive(self, service_list=None):
+    service_list = self.alive.keys() if service_list is None else service_list
+    return all(self.alive[s] for s in service_list if s not in self.ignore_alive)
+
+  def all_valid(self, service_list=None):
+    service_list = self.valid.keys() if service_list is None else service_list
+    return all(self.valid[s] for s in service_list)
+
+
+class TestSubMaster(unittest.TestCase):
+  def test_init(self):
+    sm = messaging.SubMaster(SERVICES, addr=None)
+    self.assertEqual(sm.frame, -1)
+    self.assertFalse(any(sm.updated.values()))
+    self.assertFalse(any(sm.alive.values()))
+    self.assertTrue(all(sm.valid.values()))
+    self.assertEqual(set(sm.rcv_frame), set(SERVICES))
+    self.assertEqual(dict(sm.logMonoTime), dict.fromkeys(SERVICES, 0))
+
+  def test_matches_reference(self):
+    random.seed(0)
+    sm = messaging.SubMaster(SERVICES, poll=POLL, ignore_alive=IGNORE_ALIVE, ignore_avg_freq=IGNORE_AVG_FREQ, addr=None)
+    ref = ReferenceSubMaster(SERVICES, POLL, IGNORE_ALIVE, IGNORE_AVG_FREQ)
+
+    t = 0.
+    not_ok = set()
+    # long enough for the dt history to wrap several times, with stretches where services drop out or slow down
+    for frame in range(3000):
+      t += 0.01
+      phase = frame // 500
+      msgs = []
+      for s in SERVICES:
+        freq = service_list[s].frequency or 1.
+        if phase == 2 and s in ("carState", "liveCalibration"):
+          continue  # stops sending
+        if phase == 4:
+          freq *= 0.8  # too slow for freq_ok
+        if random.random() < freq * 0.01 * (0.95 if phase != 3 else 1.):
+          msgs.append(make_msg(s, frame * 1000 + len(msgs), valid=random.random() > 0.1))
+      random.shuffle(msgs)
+
+      # decoded and raw messages take different paths
+      readers = [messaging.log_from_bytes(m) for m in msgs]
+      sm.update_msgs(t, [m if i % 2 else r for i, (m, r) in enumerate(zip(msgs, readers))] + [None])
+      ref.update_msgs(t, readers)
+
+      self.assertEqual(sm.frame, ref.frame)
+      for attr in ("updated", "valid", "rcv_frame", "rcv_time", "logMonoTime"):
+        self.assertEqual(dict(getattr(sm, attr)), getattr(ref, attr), (frame, attr))
+      # alive is computed lazily, check it on some frames only
+      if frame % 7 == 0 or frame % 500 > 490:
+        self.assertEqual(dict(sm.alive), ref.alive, frame)
+        self.assertEqual(dict(sm.freq_ok), ref.freq_ok, frame)
+        not_ok |= {("alive", s) for s in SERVICES if not sm.alive[s]}
+        not_ok |= {("freq_ok", s) for s in SERVICES if not sm.freq_ok[s]}
+        for services in (None, ["carState", "liveCalibration"], ["deviceState", "androidLog"]):
+          self.assertEqual(sm.all_alive(services), ref.all_alive(services), (frame, services))
+          self.assertEqual(sm.all_valid(services), ref.all_valid(services), (frame, services))
+          self.assertEqual(sm.all_alive_and_valid(services),
+                           ref.all_alive(services) and ref.all_valid(services), (frame, services))
+
+    # services dropped out and ran slow along the way, except those without a frequency or its check
+    self.assertTrue({("alive", "carState"), ("alive", "liveCalibration"), ("freq_ok", "carState")} <= not_ok)
+    for s in ("androidLog", "radarState", "controlsState"):
+      self.assertNotIn(("freq_ok", s), not_ok)
+    self.assertNotIn(("alive", "androidLog"), not_ok)
+
+  def test_ignore_alive(self):
+    sm = messaging.SubMaster(["carState", "liveCalibration"], ignore_alive=["liveCalibration"], addr=None)
+    # liveCalibration is never received, it's dead after 10 of its 4 Hz periods
+    for i in range(300):
+      sm.update_msgs(i * 0.01, [make_msg("carState", i)])
+    self.assertTrue(sm.alive["carState"])
+    self.assertFalse(sm.alive["liveCalibration"])
+    self.assertTrue(sm.all_alive())
+    self.assertTrue(sm.all_alive_and_valid())
+
+
+def fill_car_state(msg, i):
+  msg.logMonoTime = 1000 + i
+  cs = msg.carState
+  cs.vEgo = float(i)
+  cs.aEgo = -float(i)
+  cs.gas = i / 10.
+  cs.brakePressed = i % 2 == 0
+  cs.cruiseState.speed = 2. * i
+  cs.cruiseState.enabled = i % 3 == 0
+
+
+def fill_can(msg, i):
+  msg.logMonoTime = 1000 + i
+  for j, c in enumerate(msg.can):
+    c.address = i + j
+    c.busTime = i
+    c.src = j
+
+
+class TestBuilderPool(unittest.TestCase):
+  def test_reuse_matches_new_message(self):
+    pool = messaging.BuilderPool()
+    for service, size, fill in (("carState", None, fill_car_state), ("can", 3, fill_can)):
+      first = pool.get(service, size)
+      fill(first, 0)
+      first.valid = False
+      first.to_bytes()
+      for i in range(10):
+        # no written-twice warnings from the reused builder either
+        with warnings.catch_warnings():
+          warnings.simplefilter("error", UserWarning)
+          msg = pool.get(service, size)
+          self.assertIs(msg, first)
+          # the previous send left valid false, get resets it
+          self.assertTrue(msg.valid)
+          fill(msg, i)
+          msg.valid = i % 2 == 0
+          dat = msg.to_bytes()
+
+        expected = messaging.new_message(service, size)
+        fill(expected, i)
+        expected.valid = i % 2 == 0
+        self.assertEqual(dat, expected.to_bytes(), (service, i))
+
+  def test_grown_builder_is_replaced(self):
+    pool = messaging.BuilderPool()
+    with mock.patch.object(messaging.BuilderPool, "CHECK_INTERVAL", 5):
+      first = pool.get("controlsState")
+      first.controlsState.alertText1 = "a"
+      first.to_bytes()
+      for i in range(1, 5):
+        msg = pool.get("controlsState")
+        self.assertIs(msg, first, i)
+        # text fields allocate again on every fill
+        msg.controlsState.alertText1 = "b" * 100
+        msg.to_bytes()
+
+      # the size check on the 5th reuse replaces it
+      msg = pool.get("controlsState")
+      self.assertIsNot(msg, first)
+      self.assertEqual(msg.controlsState.alertText1, "")
+      self.assertIs(pool.get("controlsState"), msg)
+
+  def test_unchanged_builder_is_kept(self):
+    pool = messaging.BuilderPool()
+    with mock.patch.object(messaging.BuilderPool, "CHECK_INTERVAL", 5):
+      first = pool.get("carState")
+      fill_car_state(first, 0)
+      first.to_bytes()
+      for i in range(20):
+        msg = pool.get("carState")
+        self.assertIs(msg, first)
+        fill_car_state(msg, i)
+        msg.to_bytes()
+
+
+class TestPubMaster(unittest.TestCase):
+  def test_send_many_matches_send(self):
+    services = ["carState", "controlsState", "can"]
+    msgs = []
+    for i in range(3):
+      cs = messaging.new_message("carState")
+      fill_car_state(cs, i)
+      can = messaging.new_message("can", 2)
+      fill_can(can, i)
+      msgs += [("carState", cs), ("can", can.to_bytes()), ("controlsState", messaging.new_message("controlsState"))]
+
+    calls = []
+    for send_many in (False, True):
+      pm = messaging.PubMaster(services)
+      socks = mock.Mock()
+      pm.sock = {s: getattr(socks, s) for s in services}
+      if send_many:
+        pm.send_many(msgs)
+      else:
+        for s, dat in msgs:
+          pm.send(s, dat)
+      for _, dat in msgs:
+        if not isinstance(dat, bytes):
+          dat.clear_write_flag()
+      calls.append(socks.mock_calls)
+
+    self.assertEqual(len(calls[0]), len(msgs))
+    self.assertEqual(calls[0], calls[1])
+    for call in calls[1]:
+      self.assertIsInstance(call.args[0], bytes)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -61,6 +61,7 @@ services = {
   "modelV2": (True, 20., 40),
   "managerState": (True, 2., 1),
   "uploaderState": (True, 0., 1),
+  "controlsProfile": (True, 1., 1),
 
   # debug
   "testJoystick": (False, 0.),
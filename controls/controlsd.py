@@ -4,11 +4,11 @@ import math
 from cereal import car, log
 from common.numpy_fast import clip
 from common.realtime import sec_since_boot, config_realtime_process, Priority, Ratekeeper, DT_CTRL
-from common.profiler import Profiler
 from common.params import Params, put_nonblocking
 import cereal.messaging as messaging
 from selfdrive.config import Conversions as CV
 from selfdrive.swaglog import cloudlog
+from selfdrive.profiler import SectionProfiler
 from selfdrive.boardd.boardd import can_list_to_can_capnp
 from selfdrive.car.car_helpers import get_car, get_startup_event, get_one_can
 from selfdrive.controls.lib.lane_planner import CAMERA_OFFSET
@@ -62,7 +62,7 @@ class Controls:
     self.pm = pm
     if self.pm is None:
       self.pm = messaging.PubMaster(['sendcan', 'controlsState', 'carState',
-                                     'carControl', 'carEvents', 'carParams'])
+                                     'carControl', 'carEvents', 'carParams', 'controlsProfile'])
 
     self.camera_packets = ["roadCameraState", "driverCameraState"]
     if TICI:
@@ -175,7 +175,7 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    self.prof = SectionProfiler('controlsProfile', DT_CTRL)
 
   def update_events(self, CS):
     """Compute carEvents from carState"""
@@ -726,7 +726,7 @@ class Controls:
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
+      self.prof.end_frame(self.pm)
 
 def main(sm=None, pm=None, logcan=None):
   controls = Controls(sm, pm, logcan)
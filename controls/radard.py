@@ -194,6 +194,7 @@ def radard_thread(sm=None, pm=None, can_sock=None):
     pm = messaging.PubMaster(['radarState', 'liveTracks'])
 
   RI = RadarInterface(CP)
+  builders = messaging.BuilderPool()
 
   rk = Ratekeeper(1.0 / CP.radarTimeStep, print_delay_threshold=None)
   RD = RadarD(CP.radarTimeStep, RI.delay)
@@ -213,20 +214,18 @@ def radard_thread(sm=None, pm=None, can_sock=None):
     dat = RD.update(sm, rr, enable_lead)
     dat.radarState.cumLagMs = -rk.remaining*1000.
 
-    pm.send('radarState', dat)
-
     # *** publish tracks for UI debugging (keep last) ***
     tracks = RD.tracks
-    dat = messaging.new_message('liveTracks', len(tracks))
+    tracks_dat = builders.get('liveTracks', len(tracks))
 
     for cnt, ids in enumerate(sorted(tracks.keys())):
-      dat.liveTracks[cnt] = {
+      tracks_dat.liveTracks[cnt] = {
         "trackId": ids,
         "dRel": float(tracks[ids].dRel),
         "yRel": float(tracks[ids].yRel),
         "vRel": float(tracks[ids].vRel),
       }
-    pm.send('liveTracks', dat)
+    pm.send_many([('radarState', dat), ('liveTracks', tracks_dat)])
 
     rk.monitor_time()
 
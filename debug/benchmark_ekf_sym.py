@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from selfdrive.locationd.models.car_kf import CarKalman, ObservationKind
+from selfdrive.locationd.models.constants import GENERATED_DIR
+
+DT = 0.01  # paramsd gets carState at 100 Hz
+YAW_RATE_STD = 0.01  # rad/s
+
+
+def make_observations(n_frames, out_of_order, max_delay):
+  """paramsd like observations, out_of_order of them arrive up to max_delay seconds late."""
+  obs = []
+  for f in range(n_frames):
+    t = f * DT
+    speed = 20. + math.sin(t / 10.)
+    angle = math.radians(5. * math.sin(t / 3.))
+    obs.append((t, ObservationKind.STEER_ANGLE, np.array([[angle]])))
+    obs.append((t, ObservationKind.ROAD_FRAME_X_SPEED, np.array([[speed]])))
+    if f % 5 == 0:
+      obs.append((t, ObservationKind.ROAD_FRAME_YAW_RATE, np.array([[speed * angle / 15. / 2.7]])))
+
+  arrival = [o[0] + (random.uniform(DT, max_delay) if random.random() < out_of_order else 0.) for o in obs]
+  return [o for _, o in sorted(zip(arrival, obs), key=lambda x: x[0])]
+
+
+def run(kf, obs):
+  R = {kind: kf.get_R(kind, 1) for kind in kf.obs_noise}
+  R[ObservationKind.ROAD_FRAME_YAW_RATE] = np.atleast_2d(YAW_RATE_STD**2)[None]
+
+  start = time.perf_counter()
+  for t, kind, z in obs:
+    kf.filter.predict_and_update_batch(t, kind, z, R[kind])
+  return time.perf_counter() - start
+
+
+def make_filter(generated_dir, python=False):
+  kf = CarKalman(generated_dir)
+  if python:
+    from rednose.helpers.ekf_sym import EKF_sym
+    dim = kf.initial_x.shape[0]
+    kf.filter = EKF_sym(generated_dir, kf.name, kf.Q, kf.initial_x, kf.P_initial, dim, dim, global_vars=kf.global_vars)
+  for name, val in [("mass", 1500.), ("rotational_inertia", 2500.), ("center_to_front", 1.2), ("center_to_rear", 1.5),
+                    ("stiffness_front", 1e5), ("stiffness_rear", 1e5)]:
+    kf.filter.set_global(name, val)
+  return kf
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measures predict_and_update_batch throughput of the car kalman filter")
+  parser.add_argument("--frames", type=int, default=30000)
+  parser.add_argument("--out-of-order", type=float, default=0.1, help="Fraction of observations that arrive late")
+  parser.add_argument("--max-delay", type=float, default=0.2, help="Seconds an observation can arrive late")
+  parser.add_argument("--generated-dir", type=str, default=GENERATED_DIR)
+  parser.add_argument("--python", action="store_true", help="Use the python EKF_sym instead of the C++ one")
+  args = parser.parse_args()
+
+  random.seed(0)
+  for name, fraction in [("in order", 0.), ("out of order", args.out_of_order)]:
+    obs = make_observations(args.frames, fraction, args.max_delay)
+    dt = run(make_filter(args.generated_dir, args.python), obs)
+    print(f"{name:13} {len(obs) / dt:10.0f} obs/s  {dt / len(obs) * 1e6:6.2f} us/obs")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import capnp
+import cereal.messaging as messaging
+
+# controlsd's SubMaster plus a few more
+SERVICES = ['deviceState', 'pandaState', 'modelV2', 'liveCalibration', 'driverMonitoringState', 'longitudinalPlan',
+            'lateralPlan', 'liveLocationKalman', 'managerState', 'liveParameters', 'radarState', 'roadCameraState',
+            'driverCameraState', 'carState', 'testJoystick', 'procLog']
+
+
+def make_frames(sm, n):
+  """n frames at 100 Hz, each holding the messages of the services due in that frame."""
+  msgs = {}
+  for s in sm.services:
+    try:
+      dat = messaging.new_message(s)
+    except capnp.lib.capnp.KjException:  # pylint: disable=c-extension-no-member
+      dat = messaging.new_message(s, 0)
+    msgs[s] = messaging.log_from_bytes(dat.to_bytes())
+
+  frames = []
+  for f in range(n):
+    frames.append([msgs[s] for s in sm.services if sm.freq[s] > 0 and f % max(int(100 / sm.freq[s]), 1) == 0])
+  return frames
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measures the per frame cost of SubMaster.update_msgs")
+  parser.add_argument("--frames", type=int, default=10000)
+  args = parser.parse_args()
+
+  sm = messaging.SubMaster(SERVICES, ignore_alive=['driverCameraState'], ignore_avg_freq=['radarState', 'longitudinalPlan'], addr=None)
+  frames = make_frames(sm, args.frames)
+  n_msgs = sum(len(f) for f in frames)
+
+  t = 1.
+  start = time.perf_counter()
+  for msgs in frames:
+    t += 0.01
+    sm.update_msgs(t, msgs)
+  update_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for msgs in frames:
+    t += 0.01
+    sm.update_msgs(t, msgs)
+    sm.all_alive_and_valid()
+  checked_time = time.perf_counter() - start
+
+  print(f"{len(SERVICES)} services, {n_msgs / args.frames:.1f} msgs per frame")
+  print(f"update_msgs:                       {update_time / args.frames * 1e6:.2f} us/frame")
+  print(f"update_msgs + all_alive_and_valid: {checked_time / args.frames * 1e6:.2f} us/frame")
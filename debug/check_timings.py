@@ -7,9 +7,18 @@ from collections import defaultdict, deque
 
 import cereal.messaging as messaging
 
+PROFILE_SERVICES = ['controlsProfile']
+
 socks = {s: messaging.sub_sock(s, conflate=False) for s in sys.argv[1:]}
 ts = defaultdict(lambda: deque(maxlen=100))
 
+
+def print_profile(s, profile):
+  print(f"{s}: {profile.overBudget}/{profile.frames} frames over {profile.budgetMs:.1f} ms")
+  for sec in profile.sections:
+    print(f"  {sec.name:17} p50 {sec.p50Ms:6.2f} p99 {sec.p99Ms:6.2f} max {sec.maxMs:6.2f} mean {sec.meanMs:6.2f}")
+
+
 if __name__ == "__main__":
   while True:
     print()
@@ -18,7 +27,10 @@ if __name__ == "__main__":
       for m in msgs:
         ts[s].append(m.logMonoTime / 1e6)
 
-      if len(ts[s]) == ts[s].maxlen:
+      if s in PROFILE_SERVICES:
+        if len(msgs):
+          print_profile(s, getattr(msgs[-1], s))
+      elif len(ts[s]) == ts[s].maxlen:
         d = np.diff(ts[s])
         print(f"{s:17} {np.mean(d):.2f} {np.std(d):.2f} {np.max(d):.2f} {np.min(d):.2f}")
     time.sleep(1)
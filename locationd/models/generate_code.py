@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import subprocess
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+from common.basedir import BASEDIR
+from selfdrive.locationd.models.constants import GENERATED_DIR
+
+# target: generating script, same as rednose_config in SConstruct
+MODELS = {
+  'live': 'selfdrive/locationd/models/live_kf.py',
+  'car': 'selfdrive/locationd/models/car_kf.py',
+  'gnss': 'selfdrive/locationd/models/gnss_kf.py',
+  'loc_4': 'selfdrive/locationd/models/loc_kf.py',
+  'pos_computer_4': 'rednose/helpers/lst_sq_computer.py',
+  'pos_computer_5': 'rednose/helpers/lst_sq_computer.py',
+  'feature_handler_5': 'rednose/helpers/feature_handler.py',
+}
+
+
+def generate(target, generated_dir):
+  """Runs the generator of target in its own process, sympy holds the GIL."""
+  start = time.monotonic()
+  script = os.path.join(BASEDIR, MODELS[target])
+  proc = subprocess.run([sys.executable, script, target, generated_dir], stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT, encoding='utf8', check=False)
+  return target, proc.returncode, proc.stdout, time.monotonic() - start
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Generates the code of the kalman filters in parallel, unchanged models come from the rednose cache")
+  parser.add_argument("targets", nargs="*", help="Models to generate, all of them by default")
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+  parser.add_argument("--generated-dir", type=str, default=GENERATED_DIR)
+  args = parser.parse_args()
+
+  targets = args.targets or [t for t, script in MODELS.items() if os.path.isfile(os.path.join(BASEDIR, script))]
+  for t in targets:
+    if t not in MODELS:
+      parser.error(f"unknown model {t}, known models: {', '.join(MODELS)}")
+
+  start = time.monotonic()
+  failed = []
+  with ThreadPool(args.jobs) as pool:
+    for target, returncode, output, dt in pool.imap_unordered(lambda t: generate(t, args.generated_dir), targets):
+      print(f"{target:20} {dt:6.2f} s" + ("" if returncode == 0 else "  FAILED"))
+      if returncode != 0:
+        failed.append(target)
+        print(output)
+
+  print(f"generated {len(targets) - len(failed)}/{len(targets)} models in {time.monotonic() - start:.2f} s")
+  sys.exit(1 if failed else 0)
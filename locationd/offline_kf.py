@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from common.transformations.coordinates import LocalCoord
+from common.transformations.orientation import ecef_euler_from_ned, euler2quat, ned_euler_from_ecef, quat2euler, rot_from_euler
+from rednose.helpers.ekf_sym import EKF_sym as EKF_sym_python
+from rednose.helpers.ekf_sym_pyx import EKF_sym  # pylint: disable=no-name-in-module, import-error
+from selfdrive.locationd.models.car_kf import CarKalman
+from selfdrive.locationd.models.constants import GENERATED_DIR, ObservationKind
+from selfdrive.locationd.models.live_kf import LiveKalman, States
+from selfdrive.locationd.paramsd import ParamsLearner
+from tools.lib.logreader import LogReader
+
+# same as locationd.cc
+ACCEL_SANITY_CHECK = 100.0  # m/s^2
+ROTATION_SANITY_CHECK = 10.0  # rad/s
+TRANS_SANITY_CHECK = 200.0  # m/s
+CALIB_RPY_SANITY_CHECK = 0.5  # rad (+- 30 deg)
+ALTITUDE_SANITY_CHECK = 10000  # m
+MIN_STD_SANITY_CHECK = 1e-5  # m or rad
+
+SENSOR_ACCELEROMETER = 1
+SENSOR_GYRO_UNCALIBRATED = 5
+SENSOR_TYPE_ACCELEROMETER = 1
+SENSOR_TYPE_GYROSCOPE_UNCALIBRATED = 16
+
+
+class EstimateRecorder():
+  """Wraps a kalman filter and records the estimate of every update, in runs that are split where the filter is reset."""
+  def __init__(self, kf):
+    self.kf = kf
+    self.runs = [[]]
+
+  def __getattr__(self, name):
+    return getattr(self.kf, name)
+
+  def new_run(self):
+    if len(self.runs[-1]):
+      self.runs.append([])
+
+  def predict_and_update_batch(self, *args, **kwargs):
+    ret = self.kf.predict_and_update_batch(*args, **kwargs)
+    if ret is not None:
+      self.runs[-1].append(ret)
+    return ret
+
+  def init_state(self, state, covs, filter_time):
+    self.new_run()
+    self.kf.init_state(state, covs, filter_time)
+
+  def set_filter_time(self, t):
+    # the filter doesn't predict over the skipped time, so neither may the smoother
+    if t != self.kf.get_filter_time():
+      self.new_run()
+    self.kf.set_filter_time(t)
+
+
+class OfflineLocalizer():
+  """Feeds the live kalman filter the way locationd does."""
+  def __init__(self, kf):
+    self.kf = kf
+    self.device_from_calib = np.eye(3)
+
+  def observe(self, t, kind, z, R=None):
+    if R is None:
+      R = np.diag(LiveKalman.obs_noise_diag[kind])
+    self.kf.predict_and_update_batch(t, kind, np.atleast_2d(z), R[None])
+
+  def reset_kalman(self, t, orientation=None, pos=None):
+    x = LiveKalman.initial_x.copy()
+    if orientation is not None:
+      x[States.ECEF_ORIENTATION] = orientation
+      x[States.ECEF_POS] = pos
+    self.kf.init_state(x, np.diag(LiveKalman.initial_P_diag), t)
+
+  def handle_sensors(self, t, events):
+    for e in events:
+      # Ignore empty readings (e.g. in case the magnetometer had no data ready)
+      if e.timestamp == 0:
+        continue
+
+      sensor_time = 1e-9 * e.timestamp
+      if abs(t - sensor_time) > 0.1:
+        return
+      if e.source == 'bmx055':
+        continue
+
+      if e.sensor == SENSOR_GYRO_UNCALIBRATED and e.type == SENSOR_TYPE_GYROSCOPE_UNCALIBRATED:
+        v = e.gyroUncalibrated.v
+        meas = np.array([-v[2], -v[1], -v[0]])
+        if np.linalg.norm(meas) < ROTATION_SANITY_CHECK:
+          self.observe(sensor_time, ObservationKind.PHONE_GYRO, meas)
+
+      if e.sensor == SENSOR_ACCELEROMETER and e.type == SENSOR_TYPE_ACCELEROMETER:
+        v = e.acceleration.v
+        meas = np.array([-v[2], -v[1], -v[0]])
+        if np.linalg.norm(meas) < ACCEL_SANITY_CHECK:
+          self.observe(sensor_time, ObservationKind.PHONE_ACCEL, meas)
+
+  def handle_gps(self, t, gps):
+    if gps.flags % 2 == 0:
+      return
+    if gps.verticalAccuracy <= 0 or gps.speedAccuracy <= 0 or gps.bearingAccuracyDeg <= 0:
+      return
+    if abs(gps.latitude) > 90 or abs(gps.longitude) > 180 or abs(gps.altitude) > ALTITUDE_SANITY_CHECK:
+      return
+    if np.linalg.norm(gps.vNED) > TRANS_SANITY_CHECK:
+      return
+
+    converter = LocalCoord.from_geodetic([gps.latitude, gps.longitude, gps.altitude])
+    ecef_pos = converter.ned2ecef([0, 0, 0])
+    ecef_vel = converter.ned2ecef(list(gps.vNED)) - ecef_pos
+    ecef_pos_R = np.diag([(3 * gps.verticalAccuracy)**2] * 3)
+    ecef_vel_R = np.diag([gps.speedAccuracy**2] * 3)
+
+    x = self.kf.state()
+    orientation_ned = ned_euler_from_ecef(ecef_pos, quat2euler(x[States.ECEF_ORIENTATION]))
+    orientation_ned_gps = np.array([0, 0, math.radians(gps.bearingDeg)])
+    orientation_error = np.mod(orientation_ned - orientation_ned_gps - np.pi, 2 * np.pi) - np.pi
+    initial_pose_ecef_quat = euler2quat(ecef_euler_from_ned(ecef_pos, orientation_ned_gps))
+
+    if np.linalg.norm(ecef_vel) > 5 and np.linalg.norm(orientation_error) > 1:
+      self.reset_kalman(math.nan, initial_pose_ecef_quat, ecef_pos)
+      self.observe(t, ObservationKind.ECEF_ORIENTATION_FROM_GPS, initial_pose_ecef_quat)
+    elif np.linalg.norm(x[States.ECEF_POS] - ecef_pos) > 100:
+      self.reset_kalman(math.nan, initial_pose_ecef_quat, ecef_pos)
+
+    self.observe(t, ObservationKind.ECEF_POS, ecef_pos, ecef_pos_R)
+    self.observe(t, ObservationKind.ECEF_VEL, ecef_vel, ecef_vel_R)
+
+  def handle_car_state(self, t, car_state):
+    if car_state.standstill:
+      self.observe(t, ObservationKind.NO_ROT, np.zeros(3))
+
+  def handle_cam_odo(self, t, cam_odo):
+    rot_device = self.device_from_calib.dot(cam_odo.rot)
+    trans_device = self.device_from_calib.dot(cam_odo.trans)
+    if np.linalg.norm(rot_device) > ROTATION_SANITY_CHECK or np.linalg.norm(trans_device) > TRANS_SANITY_CHECK:
+      return
+
+    rot_calib_std = np.array(cam_odo.rotStd)
+    trans_calib_std = np.array(cam_odo.transStd)
+    if rot_calib_std.min() <= MIN_STD_SANITY_CHECK or trans_calib_std.min() <= MIN_STD_SANITY_CHECK:
+      return
+    if np.linalg.norm(rot_calib_std) > 10 * ROTATION_SANITY_CHECK or np.linalg.norm(trans_calib_std) > 10 * TRANS_SANITY_CHECK:
+      return
+
+    # Multiply by 10 to avoid to high certainty in kalman filter because of temporally correlated noise,
+    # stds are rotated through their covariances
+    rot_device_cov = self.device_from_calib.dot(np.diag((10 * rot_calib_std)**2)).dot(self.device_from_calib.T)
+    trans_device_cov = self.device_from_calib.dot(np.diag((10 * trans_calib_std)**2)).dot(self.device_from_calib.T)
+    self.observe(t, ObservationKind.CAMERA_ODO_ROTATION, rot_device, np.diag(np.diag(rot_device_cov)))
+    self.observe(t, ObservationKind.CAMERA_ODO_TRANSLATION, trans_device, np.diag(np.diag(trans_device_cov)))
+
+  def handle_live_calib(self, t, calib):
+    if len(calib.rpyCalib) > 0:
+      rpy = np.array(calib.rpyCalib)
+      if rpy.min() < -CALIB_RPY_SANITY_CHECK or rpy.max() > CALIB_RPY_SANITY_CHECK:
+        return
+      self.device_from_calib = rot_from_euler(rpy)
+
+  def handle_msg(self, msg):
+    t = msg.logMonoTime * 1e-9
+    filter_time = self.kf.get_filter_time()
+    if not math.isnan(filter_time) and t - filter_time > 10:
+      self.reset_kalman(t)
+
+    which = msg.which()
+    if which == 'sensorEvents':
+      self.handle_sensors(t, msg.sensorEvents)
+    elif which == 'gpsLocationExternal':
+      self.handle_gps(t, msg.gpsLocationExternal)
+    elif which == 'carState':
+      self.handle_car_state(t, msg.carState)
+    elif which == 'cameraOdometry':
+      self.handle_cam_odo(t, msg.cameraOdometry)
+    elif which == 'liveCalibration':
+      self.handle_live_calib(t, msg.liveCalibration)
+
+    if not (np.isfinite(self.kf.state()).all() and np.isfinite(self.kf.covs()).all()):
+      self.reset_kalman(t)
+
+
+def run_car(msgs):
+  """Runs paramsd's car kalman filter, returns its estimates and a python filter to smooth them with."""
+  CP = next(m.carParams for m in msgs if m.which() == 'carParams')
+  learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+  recorder = learner.kf.filter = EstimateRecorder(learner.kf.filter)
+  for m in msgs:
+    if m.which() in ('liveLocationKalman', 'carState'):
+      learner.handle_log(m.logMonoTime * 1e-9, m.which(), getattr(m, m.which()))
+
+  dim = CarKalman.initial_x.shape[0]
+  smoother = EKF_sym_python(GENERATED_DIR, CarKalman.name, CarKalman.Q, CarKalman.initial_x, CarKalman.P_initial,
+                            dim, dim, global_vars=CarKalman.global_vars)
+  smoother.set_global("mass", CP.mass)
+  smoother.set_global("rotational_inertia", CP.rotationalInertia)
+  smoother.set_global("center_to_front", CP.centerToFront)
+  smoother.set_global("center_to_rear", CP.wheelbase - CP.centerToFront)
+  smoother.set_global("stiffness_front", CP.tireStiffnessFront)
+  smoother.set_global("stiffness_rear", CP.tireStiffnessRear)
+  return recorder.runs, smoother
+
+
+def run_live(msgs):
+  """Runs locationd's live kalman filter, returns its estimates and a python filter to smooth them with."""
+  args = (GENERATED_DIR, LiveKalman.name, np.diag(LiveKalman.Q_diag), LiveKalman.initial_x, np.diag(LiveKalman.initial_P_diag),
+          LiveKalman.initial_x.shape[0], LiveKalman.initial_P_diag.shape[0])
+  recorder = EstimateRecorder(EKF_sym(*args, quaternion_idxs=[3], max_rewind_age=0.2))
+  localizer = OfflineLocalizer(recorder)
+  for m in msgs:
+    localizer.handle_msg(m)
+  return recorder.runs, EKF_sym_python(*args, quaternion_idxs=[3], max_rewind_age=0.2)
+
+
+# name: (runner, normalize quaternions when smoothing)
+MODELS = {
+  'car': (run_car, False),
+  'live': (run_live, True),
+}
+
+
+def smooth_runs(smoother, runs, norm_quats=False):
+  """Smooths every run of estimates separately and concatenates the results."""
+  t, x, x_smooth, std_smooth = [], [], [], []
+  for run in runs:
+    if len(run) < 2:
+      continue
+    states, covs = smoother.rts_smooth(run, norm_quats=norm_quats)
+    t.append(np.array([e[4] for e in run]))
+    x.append(np.array([e[1] for e in run]))
+    x_smooth.append(states)
+    std_smooth.append(np.sqrt(np.diagonal(covs, axis1=1, axis2=2)))
+
+  if not len(t):
+    return None
+  return {
+    't': np.concatenate(t),
+    'run': np.concatenate([np.full(len(ti), i) for i, ti in enumerate(t)]),
+    'x': np.concatenate(x),
+    'x_smooth': np.concatenate(x_smooth),
+    'std_smooth': np.concatenate(std_smooth),
+  }
+
+
+def output_fn(out_dir, segment, model):
+  return os.path.join(out_dir, "%s_%s.npz" % (re.sub(r'[^\w.-]', '_', segment), model))
+
+
+def process_segment(args):
+  """Filters and smooths one segment with one model, errors are returned in the result instead of raised."""
+  segment, model, out_dir = args
+  result = {"segment": segment, "model": model, "status": "error"}
+  try:
+    start_time = time.monotonic()
+    msgs = sorted(LogReader(segment), key=lambda m: m.logMonoTime)
+    read_time = time.monotonic()
+
+    run, norm_quats = MODELS[model]
+    runs, smoother = run(msgs)
+    filter_time = time.monotonic()
+
+    smoothed = smooth_runs(smoother, runs, norm_quats)
+    smooth_time = time.monotonic()
+
+    result.update(status="empty", read_time=read_time - start_time, filter_time=filter_time - read_time,
+                  smooth_time=smooth_time - filter_time, log_duration=(msgs[-1].logMonoTime - msgs[0].logMonoTime) * 1e-9)
+    if smoothed is not None:
+      np.savez(output_fn(out_dir, segment, model), **smoothed)
+      result.update(status="done", n_estimates=len(smoothed['t']), n_runs=len(runs))
+  except Exception:
+    result["error"] = traceback.format_exc()
+  return result
+
+
+def process_segments(segments, models, out_dir, jobs=None):
+  """Runs every (segment, model) pair on a pool of workers and returns the list of results."""
+  os.makedirs(out_dir, exist_ok=True)
+  work = [(segment, model, out_dir) for segment in segments for model in models]
+  with multiprocessing.Pool(jobs) as pool:
+    return list(pool.imap_unordered(process_segment, work))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Runs the locationd kalman filters over logs and rts smooths their estimates")
+  parser.add_argument("segments", type=str, nargs="*", help="rlogs, paths or urls")
+  parser.add_argument("--segment-list", type=str, action="append", default=[],
+                      help="Text file listing rlogs one per line, can be given several times")
+  parser.add_argument("--models", type=str, nargs="*", default=list(MODELS.keys()), choices=list(MODELS.keys()))
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes, defaults to the cpu count")
+  parser.add_argument("--out-dir", type=str, default="smoothed")
+  args = parser.parse_args()
+
+  segments = list(args.segments)
+  for fn in args.segment_list:
+    with open(fn) as f:
+      segments += [line.strip() for line in f if line.strip()]
+  if not segments:
+    parser.error("no segments given")
+
+  start_time = time.monotonic()
+  results = process_segments(segments, args.models, args.out_dir, args.jobs)
+  total_time = time.monotonic() - start_time
+
+  log_duration = 0.
+  for r in sorted(results, key=lambda r: (r["segment"], r["model"])):
+    if r["status"] == "error":
+      print(f"{r['segment']} {r['model']}: error\n{r['error']}")
+      continue
+    log_duration += r["log_duration"]
+    print(f"{r['segment']} {r['model']}: {r['status']}, {r.get('n_estimates', 0)} estimates, "
+          f"read {r['read_time']:.1f} s, filter {r['filter_time']:.1f} s, smooth {r['smooth_time']:.1f} s")
+  print(f"{log_duration:.0f} s of logs in {total_time:.0f} s, {log_duration / total_time:.1f}x real time")
+
+  sys.exit(int(any(r["status"] == "error" for r in results)))
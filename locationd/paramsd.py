@@ -128,6 +128,7 @@ def main(sm=None, pm=None):
 
   angle_offset_average = params['angleOffsetAverageDeg']
   angle_offset = angle_offset_average
+  builders = messaging.BuilderPool()
 
   while True:
     sm.update()
@@ -147,7 +148,7 @@ def main(sm=None, pm=None):
       angle_offset_average = clip(math.degrees(x[States.ANGLE_OFFSET]), angle_offset_average - MAX_ANGLE_OFFSET_DELTA, angle_offset_average + MAX_ANGLE_OFFSET_DELTA)
       angle_offset = clip(math.degrees(x[States.ANGLE_OFFSET] + x[States.ANGLE_OFFSET_FAST]), angle_offset - MAX_ANGLE_OFFSET_DELTA, angle_offset + MAX_ANGLE_OFFSET_DELTA)
 
-      msg = messaging.new_message('liveParameters')
+      msg = builders.get('liveParameters')
       msg.logMonoTime = sm.logMonoTime['carState']
 
       msg.liveParameters.posenetValid = True
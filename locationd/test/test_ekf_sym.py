@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import copy
+import unittest
+
+import numpy as np
+
+from rednose.helpers import ekf_sym
+from rednose.helpers.chi2_lookup import chi2_ppf
+from selfdrive.locationd.models.car_kf import CarKalman, ObservationKind, States
+from selfdrive.locationd.models.constants import GENERATED_DIR
+
+GLOBALS = [("mass", 1500.), ("rotational_inertia", 2500.), ("center_to_front", 1.2), ("center_to_rear", 1.5),
+           ("stiffness_front", 1e5), ("stiffness_rear", 1e5)]
+
+
+def make_filter():
+  kf = CarKalman(GENERATED_DIR)
+  for name, val in GLOBALS:
+    kf.filter.set_global(name, val)
+  return kf.filter
+
+
+class TestPredictAndUpdateBatch(unittest.TestCase):
+  def test_batched_matches_per_observation(self):
+    batched, single = make_filter(), make_filter()
+    kind = ObservationKind.ROAD_FRAME_XY_SPEED
+    rng = np.random.RandomState(0)
+    for i, n in enumerate([1, 3, 8, 1]):
+      z = 10 + rng.rand(n, 2)
+      R = np.tile(np.eye(2) * 0.01, (n, 1, 1))
+      t = (i + 1) * 0.05
+
+      res = batched.predict_and_update_batch(t, kind, z, R, [[]] * n)
+      # ragged observations take the per observation path
+      res_single = single._predict_and_update_lists(t, kind, list(z), list(R), [[]] * n, False)
+
+      for a, b in zip(res[:4], res_single[:4]):
+        np.testing.assert_allclose(a, b, rtol=1e-9, atol=1e-12)
+      self.assertEqual(res[4:6], res_single[4:6])
+      for y in (res[6], res_single[6]):
+        self.assertIsInstance(y, list)
+        self.assertEqual(len(y), n)
+      for a, b in zip(res[6], res_single[6]):
+        np.testing.assert_allclose(a, b, rtol=1e-9, atol=1e-12)
+
+    np.testing.assert_allclose(batched.state(), single.state(), rtol=1e-9)
+    np.testing.assert_allclose(batched.covs(), single.covs(), rtol=1e-9, atol=1e-15)
+
+
+def inv_distance(kf, x, P, kind, z, R):
+  """Mahalanobis distance of one observation through the inverse of S, as maha_test used to compute it."""
+  z = z.reshape((-1, 1))
+  h = np.zeros(z.shape)
+  H = np.zeros((z.shape[0], kf.dim_x))
+  kf.hs[kind](x, np.zeros(0), h)
+  kf.Hs[kind](x, np.zeros(0), H)
+  H_mod = np.zeros((x.shape[0], P.shape[0]))
+  kf.H_mod(x, H_mod)
+  H = H.dot(H_mod)
+  y = z - h
+  return y.T.dot(np.linalg.inv(H.dot(P).dot(H.T) + R)).dot(y)[0, 0]
+
+
+class TestMahaTest(unittest.TestCase):
+  def test_maha_distances(self):
+    rng = np.random.RandomState(0)
+    for n in (1, 20):
+      A = rng.randn(n, 3, 3)
+      S = np.matmul(A, A.transpose(0, 2, 1)) + np.eye(3)
+      y = rng.randn(n, 3)
+      expected = [y[i].dot(np.linalg.inv(S[i])).dot(y[i]) for i in range(n)]
+      np.testing.assert_allclose(ekf_sym.maha_distances(y, S), expected, rtol=1e-9)
+
+  def test_maha_test_batch(self):
+    dim = CarKalman.initial_x.shape[0]
+    kf = ekf_sym.EKF_sym(GENERATED_DIR, CarKalman.name, CarKalman.Q, CarKalman.initial_x, CarKalman.P_initial, dim, dim,
+                         global_vars=CarKalman.global_vars)
+    for name, val in GLOBALS:
+      kf.set_global(name, val)
+    x, P = kf.x.copy(), kf.P.copy()
+    kind = ObservationKind.ROAD_FRAME_XY_SPEED
+
+    rng = np.random.RandomState(0)
+    for n in (1, 50):
+      # a mix of observations well inside and far outside the gate
+      z = x[States.VELOCITY, 0][None] + rng.randn(n, 2) * np.sqrt(np.diag(P)[States.VELOCITY]) * rng.choice([0.5, 5.], (n, 1))
+      R = np.tile(np.eye(2) * 0.01, (n, 1, 1))
+
+      expected = np.array([inv_distance(kf, x, P, kind, z[i], R[i]) <= chi2_ppf(0.95, 2) for i in range(n)])
+      mask = kf.maha_test_batch(x, P, kind, z, R)
+      self.assertEqual(mask.dtype, np.bool_)
+      np.testing.assert_equal(mask, expected)
+      np.testing.assert_equal([kf.maha_test(x, P, kind, z[i], R[i]) for i in range(n)], expected)
+      if n > 1:
+        self.assertTrue(0 < expected.sum() < n)
+
+
+def rts_smooth_per_step(kf, estimates):
+  """The smoother one step at a time, as rts_smooth was before it solved for all gains at once."""
+  xk_n = estimates[-1][0]
+  Pk_n = estimates[-1][2]
+  Fk_1 = np.zeros(Pk_n.shape, dtype=np.float64)
+  d1, d2 = kf.dim_main, kf.dim_main_err
+
+  states_smoothed = [xk_n]
+  covs_smoothed = [Pk_n]
+  for k in range(len(estimates) - 2, -1, -1):
+    xk1_n, Pk1_n = xk_n, Pk_n
+    xk1_k, _, Pk1_k, _, t2, _, _, _, _ = estimates[k + 1]
+    _, xk_k, _, Pk_k, t1, _, _, _, _ = estimates[k]
+    kf.F(xk_k, t2 - t1, Fk_1)
+
+    Ck = np.linalg.solve(Pk1_k[:d2, :d2], Fk_1[:d2, :d2].dot(Pk_k[:d2, :d2].T)).T
+    delta_x = np.zeros((Pk_n.shape[0], 1), dtype=np.float64)
+    kf.inv_err_function(xk1_k, xk1_n, delta_x)
+    delta_x[:d2] = Ck.dot(delta_x[:d2])
+    x_new = np.zeros((xk_k.shape[0], 1), dtype=np.float64)
+    kf.err_function(xk_k, delta_x, x_new)
+    xk_n = xk_k.copy()
+    xk_n[:d1] = x_new[:d1, 0]
+    Pk_n = Pk_k.copy()
+    Pk_n[:d2, :d2] = Pk_k[:d2, :d2] + Ck.dot(Pk1_n[:d2, :d2] - Pk1_k[:d2, :d2]).dot(Ck.T)
+    states_smoothed.append(xk_n)
+    covs_smoothed.append(Pk_n)
+
+  return np.flipud(np.vstack(states_smoothed)), np.stack(covs_smoothed, 0)[::-1]
+
+
+class TestRTSSmooth(unittest.TestCase):
+  def test_matches_per_step(self):
+    dim = CarKalman.initial_x.shape[0]
+    kf = ekf_sym.EKF_sym(GENERATED_DIR, CarKalman.name, CarKalman.Q, CarKalman.initial_x, CarKalman.P_initial, dim, dim,
+                         global_vars=CarKalman.global_vars)
+    for name, val in GLOBALS:
+      kf.set_global(name, val)
+
+    rng = np.random.RandomState(0)
+    estimates = []
+    for i in range(50):
+      t = i * 0.01
+      speed = 20. + rng.randn() * 0.1
+      estimates.append(kf.predict_and_update_batch(t, ObservationKind.ROAD_FRAME_XY_SPEED, np.array([[speed, 0.]]),
+                                                   np.array([np.eye(2) * 0.01])))
+      estimates.append(kf.predict_and_update_batch(t + 0.005, ObservationKind.STEER_ANGLE, np.array([[0.05 * np.sin(t)]]),
+                                                   np.array([[[1e-4]]])))
+    # the estimates are filtered states as 1-D arrays
+    estimates = [(e[0].flatten(), e[1].flatten(), *e[2:]) for e in estimates]
+
+    expected_x, expected_P = rts_smooth_per_step(kf, copy.deepcopy(estimates))
+    x, P = kf.rts_smooth(copy.deepcopy(estimates))
+    self.assertEqual(x.shape, (len(estimates), dim))
+    np.testing.assert_allclose(x, expected_x, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(P, expected_P, rtol=1e-9, atol=1e-15)
+    # the last estimate is the predicted one, as before
+    np.testing.assert_equal(x[-1], estimates[-1][0])
+
+
+if __name__ == "__main__":
+  unittest.main()
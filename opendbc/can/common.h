@@ -14,6 +14,21 @@
 
 #define MAX_BAD_COUNTER 5
 
+// Position of a signal in CANParser::signal_values
+struct SignalIndex {
+  uint32_t address;
+  const char* name;
+  size_t idx;
+};
+
+// Every update of one signal, recorded by the batch parsing API
+struct SignalHistory {
+  uint32_t address;
+  const char* name;
+  std::vector<uint64_t> ts;
+  std::vector<double> values;
+};
+
 // Helper functions
 unsigned int honda_checksum(unsigned int address, uint64_t d, int l);
 unsigned int toyota_checksum(unsigned int address, uint64_t d, int l);
@@ -43,11 +58,19 @@ public:
   bool ignore_checksum = false;
   bool ignore_counter = false;
 
+  size_t history_idx = 0;  // index of the first signal's SignalHistory in a batch parse
+
+  // where the parser publishes the values of the last frame that passed the checks
+  double *out_vals = NULL;
+  uint16_t *out_ts = NULL;
+
   bool parse(uint64_t sec, uint16_t ts_, uint8_t * dat);
   bool update_counter_generic(int64_t v, int cnt_size);
 };
 
 class CANParser {
+  friend class CANParserGroup;
+
 private:
   const int bus;
   kj::Array<capnp::word> aligned_buf;
@@ -55,10 +78,20 @@ private:
   const DBC *dbc = NULL;
   std::unordered_map<uint32_t, MessageState> message_states;
 
+  std::vector<SignalHistory> init_history();
+  void init_signal_values();
+  void parse_frame_history(uint64_t sec, uint32_t address, uint8_t src, uint16_t bus_time,
+                           const uint8_t *dat, size_t dat_len, std::vector<SignalHistory> &history);
+
 public:
   bool can_valid = false;
   uint64_t last_sec = 0;
 
+  // Latest value and bus time of every parsed signal, allocated once so readers can keep pointers into them
+  std::vector<double> signal_values;
+  std::vector<uint16_t> signal_ts;
+  std::vector<SignalIndex> signal_index;
+
   CANParser(int abus, const std::string& dbc_name,
             const std::vector<MessageParseOptions> &options,
             const std::vector<SignalParseOptions> &sigoptions);
@@ -70,6 +103,30 @@ public:
   void UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cans);
   void UpdateValid(uint64_t sec);
   std::vector<SignalValue> query_latest();
+  // Addresses of the messages seen in the events from sec up to last_sec
+  std::vector<uint32_t> query_updated(uint64_t sec);
+
+  // Offline decoding of many frames at once, returns every successful update of each tracked signal
+  std::vector<SignalHistory> parse_frames(size_t n, const uint64_t *sec, const uint32_t *address, const uint8_t *src,
+                                          const uint16_t *bus_time, const uint8_t *dat, const uint64_t *dat_offset);
+  #ifndef DYNAMIC_CAPNP
+  std::vector<SignalHistory> parse_strings(const std::vector<std::string> &data, bool sendcan);
+  #endif
+};
+
+// Deserializes each can event once and feeds its frames to every parser listening on that bus and address
+class CANParserGroup {
+private:
+  std::vector<CANParser*> parsers;
+  std::unordered_map<uint64_t, std::vector<MessageState*>> routes;
+  kj::Array<capnp::word> aligned_buf;
+
+public:
+  CANParserGroup(const std::vector<CANParser*> &parsers);
+  #ifndef DYNAMIC_CAPNP
+  // Returns the logMonoTime of the event, valid gets can_valid of each parser after it
+  uint64_t update_string(const char *data, size_t size, bool sendcan, std::vector<bool> &valid);
+  #endif
 };
 
 class CANPacker {
@@ -77,9 +134,20 @@ private:
   const DBC *dbc = NULL;
   std::map<std::pair<uint32_t, std::string>, Signal> signal_lookup;
   std::map<uint32_t, Msg> message_lookup;
+  std::unordered_map<uint32_t, const Signal*> counter_lookup;
+  std::unordered_map<uint32_t, const Signal*> checksum_lookup;
+
+  uint64_t finish(uint32_t address, uint64_t ret, int counter);
 
 public:
   CANPacker(const std::string& dbc_name);
   uint64_t pack(uint32_t address, const std::vector<SignalPackValue> &values, int counter);
+
+  // Packing with signals resolved once up front, a NULL signal is skipped
+  const Signal* lookup_signal(uint32_t address, const std::string &name);
+  uint64_t pack_signals(uint32_t address, size_t n, const Signal * const *sigs, const double *values, int counter);
+  // Packs n_rows messages of the same address, values is row major n_rows x n_sigs. Output is in wire byte order.
+  void pack_rows(uint32_t address, size_t n_sigs, const Signal * const *sigs,
+                 size_t n_rows, const double *values, const int *counters, uint64_t *out);
   Msg* lookup_message(uint32_t address);
 };
@@ -1,7 +1,7 @@
 # distutils: language = c++
 #cython: language_level=3
 
-from libc.stdint cimport uint32_t, uint64_t, uint16_t
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, uint16_t
 from libcpp.vector cimport vector
 from libcpp.map cimport map
 from libcpp.string cimport string
@@ -73,12 +73,37 @@ cdef extern from "common_dbc.h":
 cdef extern from "common.h":
   cdef const DBC* dbc_lookup(const string);
 
+  cdef struct SignalIndex:
+    uint32_t address
+    const char* name
+    size_t idx
+
+  cdef struct SignalHistory:
+    uint32_t address
+    const char* name
+    vector[uint64_t] ts
+    vector[double] values
+
   cdef cppclass CANParser:
     bool can_valid
+    uint64_t last_sec
     CANParser(int, string, vector[MessageParseOptions], vector[SignalParseOptions])
     void update_string(string, bool)
     vector[SignalValue] query_latest()
+    vector[SignalHistory] parse_frames(size_t, const uint64_t*, const uint32_t*, const uint8_t*, const uint16_t*, const uint8_t*, const uint64_t*)
+    vector[SignalHistory] parse_strings(vector[string], bool)
+    vector[uint32_t] query_updated(uint64_t)
+    vector[double] signal_values
+    vector[uint16_t] signal_ts
+    vector[SignalIndex] signal_index
+
+  cdef cppclass CANParserGroup:
+    CANParserGroup(vector[CANParser*])
+    uint64_t update_string(const char*, size_t, bool, vector[bool]&)
 
   cdef cppclass CANPacker:
    CANPacker(string)
    uint64_t pack(uint32_t, vector[SignalPackValue], int counter)
+   const Signal* lookup_signal(uint32_t, string)
+   uint64_t pack_signals(uint32_t, size_t, const Signal**, const double*, int counter)
+   void pack_rows(uint32_t, size_t, const Signal**, size_t, const double*, const int*, uint64_t*)
@@ -1,7 +1,9 @@
 import re
 import os
+import mmap
 import struct
 import sys
+import hashlib
 import numbers
 from collections import namedtuple, defaultdict
 
@@ -17,20 +19,31 @@ DBCSignal = namedtuple(
   "DBCSignal", ["name", "start_bit", "size", "is_little_endian", "is_signed",
                 "factor", "offset", "tmin", "tmax", "units"])
 
+# Parsed DBCs are cached in a binary form that loads without any text parsing.
+# Layout: header, msgs, signals, value definitions, value table entries, then all strings NUL separated.
+DBC_CACHE_DIR = os.getenv("DBC_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbc_cache"))
+DBC_CACHE_MAGIC = b"DBCC"
+DBC_CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<4sIQqIIIIIQ")  # magic, version, source size, source mtime_ns, counts, strings size
+CACHE_MSG = struct.Struct("<IIIII")  # address, name, size, first signal, number of signals
+CACHE_SIG = struct.Struct("<IHHBBBxddddI")  # name, start_bit, size, little endian, signed, int fields, 4 numbers, units
+CACHE_VAL = struct.Struct("<IIIII")  # address, signal name, def_vals string, first entry, number of entries
+CACHE_VAL_ENTRY = struct.Struct("<qI")  # value, name
+# bit i of the int fields byte is set if the field is an int, which is stored as a string to keep big ints exact
+INT_FIELDS = ("factor", "offset", "tmin", "tmax")
+
+
+def dbc_cache_path(fn):
+  fn = os.path.realpath(fn)
+  name, _ = os.path.splitext(os.path.basename(fn))
+  return os.path.join(DBC_CACHE_DIR, "%s-%s.dbcc" % (name, hashlib.sha1(fn.encode()).hexdigest()[:8]))
+
 
 class dbc():
-  def __init__(self, fn):
+  def __init__(self, fn, cache=True):
     self.name, _ = os.path.splitext(os.path.basename(fn))
-    with open(fn, encoding="ascii") as f:
-      self.txt = f.readlines()
     self._warned_addresses = set()
 
-    # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
-    bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
-    sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
-
     # A dictionary which maps message ids to tuples ((name, size), signals).
     #   name is the ASCII name of the message.
     #   size is the size of the message in bytes.
@@ -41,10 +54,35 @@ class dbc():
     # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
     self.def_vals = defaultdict(list)
 
+    # Maps message ids to a list of tuples (signal name, {value: definition}), like def_vals but parsed
+    self.value_tables = defaultdict(list)
+
     # lookup to bit reverse each byte
     self.bits_index = [(i & ~0b111) + ((-i - 1) & 0b111) for i in range(64)]
 
-    for l in self.txt:
+    st = os.stat(fn)
+    cache_fn = dbc_cache_path(fn)
+    if not (cache and self._load_cache(cache_fn, st)):
+      self._parse(fn)
+      if cache:
+        self._save_cache(cache_fn, st)
+
+    self.msg_name_to_address = {}
+    for address, m in self.msgs.items():
+      name = m[0][0]
+      self.msg_name_to_address[name] = address
+
+  def _parse(self, fn):
+    with open(fn, encoding="ascii") as f:
+      txt = f.readlines()
+
+    # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
+    bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
+    sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+    sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+    val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
+
+    for l in txt:
       l = l.strip()
 
       if l.startswith("BO_ "):
@@ -104,17 +142,103 @@ class dbc():
 
         # convert strings to UPPER_CASE_WITH_UNDERSCORES
         defvals[1::2] = [d.strip().upper().replace(" ", "_") for d in defvals[1::2]]
+        table = {int(v): d.replace(r"\?", "?") for v, d in zip(defvals[::2], defvals[1::2])}
         defvals = '"' + "".join(str(i) for i in defvals) + '"'
 
         self.def_vals[ids].append((sgname, defvals))
+        self.value_tables[ids].append((sgname, table))
 
     for msg in self.msgs.values():
       msg[1].sort(key=lambda x: x.start_bit)
 
-    self.msg_name_to_address = {}
-    for address, m in self.msgs.items():
-      name = m[0][0]
-      self.msg_name_to_address[name] = address
+  def _load_cache(self, cache_fn, st):
+    try:
+      with open(cache_fn, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, version, src_size, src_mtime, n_msgs, n_sigs, n_vals, n_entries, n_strings, strings_size = CACHE_HEADER.unpack_from(mm)
+        if magic != DBC_CACHE_MAGIC or version != DBC_CACHE_VERSION or src_size != st.st_size or src_mtime != st.st_mtime_ns:
+          return False
+
+        pos = CACHE_HEADER.size
+        msgs = list(CACHE_MSG.iter_unpack(mm[pos:pos + n_msgs * CACHE_MSG.size]))
+        pos += n_msgs * CACHE_MSG.size
+        sigs = list(CACHE_SIG.iter_unpack(mm[pos:pos + n_sigs * CACHE_SIG.size]))
+        pos += n_sigs * CACHE_SIG.size
+        vals = list(CACHE_VAL.iter_unpack(mm[pos:pos + n_vals * CACHE_VAL.size]))
+        pos += n_vals * CACHE_VAL.size
+        entries = list(CACHE_VAL_ENTRY.iter_unpack(mm[pos:pos + n_entries * CACHE_VAL_ENTRY.size]))
+        pos += n_entries * CACHE_VAL_ENTRY.size
+        strings = mm[pos:pos + strings_size].decode().split("\0")
+    except (OSError, ValueError, struct.error):
+      return False
+
+    if len(strings) != n_strings:
+      return False
+
+    signals = []
+    for name, start_bit, size, is_little_endian, is_signed, int_fields, factor, offset, tmin, tmax, units in sigs:
+      if int_fields & 1:
+        factor = int(strings[int(factor)])
+      if int_fields & 2:
+        offset = int(strings[int(offset)])
+      if int_fields & 4:
+        tmin = int(strings[int(tmin)])
+      if int_fields & 8:
+        tmax = int(strings[int(tmax)])
+      signals.append(DBCSignal(strings[name], start_bit, size, is_little_endian == 1, is_signed == 1,
+                               factor, offset, tmin, tmax, strings[units]))
+
+    for address, name, size, first_sig, num_sigs in msgs:
+      self.msgs[address] = ((strings[name], size), signals[first_sig:first_sig + num_sigs])
+    for address, sgname, defvals, first_entry, num_entries in vals:
+      self.def_vals[address].append((strings[sgname], strings[defvals]))
+      table = {v: strings[d] for v, d in entries[first_entry:first_entry + num_entries]}
+      self.value_tables[address].append((strings[sgname], table))
+    return True
+
+  def _save_cache(self, cache_fn, st):
+    strings = {}
+    def string_id(s):
+      return strings.setdefault(s, len(strings))
+
+    msgs, sigs, vals, entries = [], [], [], []
+    for address, ((name, size), msg_sigs) in self.msgs.items():
+      msgs.append(CACHE_MSG.pack(address, string_id(name), size, len(sigs), len(msg_sigs)))
+      for s in msg_sigs:
+        nums = [getattr(s, f) for f in INT_FIELDS]
+        int_fields = sum(1 << i for i, v in enumerate(nums) if isinstance(v, int))
+        nums = [string_id(str(v)) if isinstance(v, int) else v for v in nums]
+        sigs.append(CACHE_SIG.pack(string_id(s.name), s.start_bit, s.size, s.is_little_endian, s.is_signed, int_fields,
+                                   *nums, string_id(s.units)))
+    for address, defs in self.def_vals.items():
+      for (sgname, defvals), (_, table) in zip(defs, self.value_tables[address]):
+        vals.append(CACHE_VAL.pack(address, string_id(sgname), string_id(defvals), len(entries), len(table)))
+        entries += [CACHE_VAL_ENTRY.pack(v, string_id(d)) for v, d in table.items()]
+
+    strings_dat = "\0".join(strings).encode()
+    header = CACHE_HEADER.pack(DBC_CACHE_MAGIC, DBC_CACHE_VERSION, st.st_size, st.st_mtime_ns,
+                               len(msgs), len(sigs), len(vals), len(entries), len(strings), len(strings_dat))
+    tmp_fn = "%s.%d.tmp" % (cache_fn, os.getpid())
+    try:
+      os.makedirs(DBC_CACHE_DIR, exist_ok=True)
+      with open(tmp_fn, "wb") as f:
+        f.write(b"".join([header] + msgs + sigs + vals + entries + [strings_dat]))
+      os.replace(tmp_fn, cache_fn)
+    except OSError:
+      pass  # the cache is optional, e.g. on a read only install
+
+  @property
+  def dv(self):
+    """Value definitions keyed by message address and name, then signal name, like CANDefine.dv."""
+    dv = {}
+    for address, tables in self.value_tables.items():
+      if address not in self.msgs:
+        continue
+      msg_name = self.msgs[address][0][0]
+      dv.setdefault(address, {})
+      for sgname, table in tables:
+        dv[address][sgname] = table
+      dv[msg_name] = dv[address]
+    return dv
 
   def lookup_msg_id(self, msg_id):
     if not isinstance(msg_id, numbers.Number):
@@ -45,9 +45,26 @@ CANPacker::CANPacker(const std::string& dbc_name) {
       signal_lookup[std::make_pair(msg->address, std::string(sig->name))] = *sig;
     }
   }
+
+  // map values don't move, so the counter and checksum of each message can be found without a string lookup
+  for (const auto& kv : signal_lookup) {
+    if (kv.first.second == "COUNTER") {
+      counter_lookup[kv.first.first] = &kv.second;
+    } else if (kv.first.second == "CHECKSUM") {
+      checksum_lookup[kv.first.first] = &kv.second;
+    }
+  }
   init_crc_lookup_tables();
 }
 
+static uint64_t set_signal_value(uint64_t ret, const Signal& sig, double value) {
+  int64_t ival = (int64_t)(round((value - sig.offset) / sig.factor));
+  if (ival < 0) {
+    ival = (1ULL << sig.b2) + ival;
+  }
+  return set_value(ret, sig, ival);
+}
+
 uint64_t CANPacker::pack(uint32_t address, const std::vector<SignalPackValue> &signals, int counter) {
   uint64_t ret = 0;
   for (const auto& sigval : signals) {
@@ -59,23 +76,46 @@ uint64_t CANPacker::pack(uint32_t address, const std::vector<SignalPackValue> &s
       WARN("undefined signal %s - %d\n", name.c_str(), address);
       continue;
     }
-    const auto& sig = sig_it->second;
+    ret = set_signal_value(ret, sig_it->second, value);
+  }
+
+  return finish(address, ret, counter);
+}
 
-    int64_t ival = (int64_t)(round((value - sig.offset) / sig.factor));
-    if (ival < 0) {
-      ival = (1ULL << sig.b2) + ival;
+const Signal* CANPacker::lookup_signal(uint32_t address, const std::string &name) {
+  auto sig_it = signal_lookup.find(std::make_pair(address, name));
+  if (sig_it == signal_lookup.end()) {
+    WARN("undefined signal %s - %d\n", name.c_str(), address);
+    return NULL;
+  }
+  return &sig_it->second;
+}
+
+uint64_t CANPacker::pack_signals(uint32_t address, size_t n, const Signal * const *sigs, const double *values, int counter) {
+  uint64_t ret = 0;
+  for (size_t i = 0; i < n; i++) {
+    if (sigs[i] != NULL) {
+      ret = set_signal_value(ret, *sigs[i], values[i]);
     }
+  }
+  return finish(address, ret, counter);
+}
 
-    ret = set_value(ret, sig, ival);
+void CANPacker::pack_rows(uint32_t address, size_t n_sigs, const Signal * const *sigs,
+                          size_t n_rows, const double *values, const int *counters, uint64_t *out) {
+  for (size_t i = 0; i < n_rows; i++) {
+    out[i] = ReverseBytes(pack_signals(address, n_sigs, sigs, values + i * n_sigs, counters[i]));
   }
+}
 
+uint64_t CANPacker::finish(uint32_t address, uint64_t ret, int counter) {
   if (counter >= 0){
-    auto sig_it = signal_lookup.find(std::make_pair(address, "COUNTER"));
-    if (sig_it == signal_lookup.end()) {
+    auto sig_it = counter_lookup.find(address);
+    if (sig_it == counter_lookup.end()) {
       WARN("COUNTER not defined\n");
       return ret;
     }
-    const auto& sig = sig_it->second;
+    const auto& sig = *sig_it->second;
 
     if ((sig.type != SignalType::HONDA_COUNTER) && (sig.type != SignalType::VOLKSWAGEN_COUNTER)) {
       WARN("COUNTER signal type not valid\n");
@@ -84,9 +124,9 @@ uint64_t CANPacker::pack(uint32_t address, const std::vector<SignalPackValue> &s
     ret = set_value(ret, sig, counter);
   }
 
-  auto sig_it_checksum = signal_lookup.find(std::make_pair(address, "CHECKSUM"));
-  if (sig_it_checksum != signal_lookup.end()) {
-    const auto& sig = sig_it_checksum->second;
+  auto sig_it_checksum = checksum_lookup.find(address);
+  if (sig_it_checksum != checksum_lookup.end()) {
+    const auto& sig = *sig_it_checksum->second;
     if (sig.type == SignalType::HONDA_CHECKSUM) {
       unsigned int chksm = honda_checksum(address, ret, message_lookup[address].size);
       ret = set_value(ret, sig, chksm);
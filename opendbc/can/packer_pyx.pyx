@@ -9,7 +9,72 @@ from libcpp cimport bool
 from posix.dlfcn cimport dlopen, dlsym, RTLD_LAZY
 
 from .common cimport CANPacker as cpp_CANPacker
-from .common cimport dbc_lookup, SignalPackValue, DBC
+from .common cimport dbc_lookup, SignalPackValue, Signal, DBC
+
+import numpy as np
+
+# templates cached by make_can_msg, the oldest is dropped when callers pack more signal combinations
+MAX_TEMPLATES = 256
+
+
+cdef inline uint64_t ReverseBytes(uint64_t x):
+  return (((x & 0xff00000000000000ull) >> 56) |
+         ((x & 0x00ff000000000000ull) >> 40) |
+         ((x & 0x0000ff0000000000ull) >> 24) |
+         ((x & 0x000000ff00000000ull) >> 8) |
+         ((x & 0x00000000ff000000ull) << 8) |
+         ((x & 0x0000000000ff0000ull) << 24) |
+         ((x & 0x000000000000ff00ull) << 40) |
+         ((x & 0x00000000000000ffull) << 56))
+
+
+cdef class CANMessageTemplate:
+  """A message with its signals resolved once, values are then passed in signal_names order."""
+  cdef:
+    cpp_CANPacker *packer
+    object owner  # keeps the packer alive
+    vector[const Signal*] sigs
+    readonly uint32_t address
+    readonly int size
+    readonly tuple signal_names
+
+  cdef uint64_t pack(self, values, int counter) except? 0:
+    cdef vector[double] vals
+    for v in values:
+      vals.push_back(v)
+    if vals.size() != self.sigs.size():
+      raise ValueError(f"expected {self.sigs.size()} values, got {vals.size()}")
+    return ReverseBytes(self.packer.pack_signals(self.address, vals.size(), self.sigs.data(), vals.data(), counter))
+
+  cpdef make_can_msg(self, bus, values, counter=-1):
+    cdef uint64_t val = self.pack(values, counter)
+    return [self.address, 0, (<char *>&val)[:self.size], bus]
+
+  def pack_array(self, values, counter=None):
+    """Packs one message per row of values, an array of shape (n, len(signal_names)).
+
+       For a single signal values can also have shape (n,), otherwise a 1-D array is one row.
+       counter is None, a single counter or one per row. Returns a uint8 array of shape (n, size).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1 and self.sigs.size() == 1:
+      values = values.reshape(-1, 1)
+    cdef const double[:, ::1] values_v = np.ascontiguousarray(np.atleast_2d(values))
+    cdef size_t n = values_v.shape[0]
+    if <size_t>values_v.shape[1] != self.sigs.size():
+      raise ValueError(f"expected {self.sigs.size()} columns, got {values_v.shape[1]}")
+
+    counters = np.broadcast_to(np.asarray(-1 if counter is None else counter, dtype=np.intc), (n,))
+    cdef const int[::1] counters_v = np.ascontiguousarray(counters)
+    out = np.empty(n, dtype=np.uint64)
+    cdef uint64_t[::1] out_v = out
+    cdef double empty = 0
+    cdef const double *values_ptr = &empty  # messages without signals have no values
+    if n > 0:
+      if values_v.shape[1] > 0:
+        values_ptr = &values_v[0, 0]
+      self.packer.pack_rows(self.address, self.sigs.size(), self.sigs.data(), n, values_ptr, &counters_v[0], &out_v[0])
+    return out.view(np.uint8).reshape(n, 8)[:, :self.size]
 
 
 cdef class CANPacker:
@@ -19,51 +84,50 @@ cdef class CANPacker:
     map[string, (int, int)] name_to_address_and_size
     map[int, int] address_to_size
 
+  cdef readonly dict templates
+
   def __init__(self, dbc_name):
     self.dbc = dbc_lookup(dbc_name)
     if not self.dbc:
       raise RuntimeError(f"Can't lookup {dbc_name}")
 
     self.packer = new cpp_CANPacker(dbc_name)
+    self.templates = {}
     num_msgs = self.dbc[0].num_msgs
     for i in range(num_msgs):
       msg = self.dbc[0].msgs[i]
       self.name_to_address_and_size[string(msg.name)] = (msg.address, msg.size)
       self.address_to_size[msg.address] = msg.size
 
-  cdef uint64_t pack(self, addr, values, counter):
-    cdef vector[SignalPackValue] values_thing
-    cdef SignalPackValue spv
-
-    names = []
-
-    for name, value in values.iteritems():
-      n = name.encode('utf8')
-      names.append(n) # TODO: find better way to keep reference to temp string around
-
-      spv.name = n
-      spv.value = value
-      values_thing.push_back(spv)
-
-    return self.packer.pack(addr, values_thing, counter)
-
-  cdef inline uint64_t ReverseBytes(self, uint64_t x):
-    return (((x & 0xff00000000000000ull) >> 56) |
-           ((x & 0x00ff000000000000ull) >> 40) |
-           ((x & 0x0000ff0000000000ull) >> 24) |
-           ((x & 0x000000ff00000000ull) >> 8) |
-           ((x & 0x00000000ff000000ull) << 8) |
-           ((x & 0x0000000000ff0000ull) << 24) |
-           ((x & 0x000000000000ff00ull) << 40) |
-           ((x & 0x00000000000000ffull) << 56))
-
-  cpdef make_can_msg(self, name_or_addr, bus, values, counter=-1):
+  cpdef CANMessageTemplate template(self, name_or_addr, signal_names):
+    """Compiles a message and list of signals, for packing the same message many times."""
     cdef int addr, size
     if type(name_or_addr) == int:
       addr = name_or_addr
       size = self.address_to_size[name_or_addr]
     else:
       addr, size = self.name_to_address_and_size[name_or_addr.encode('utf8')]
-    cdef uint64_t val = self.pack(addr, values, counter)
-    val = self.ReverseBytes(val)
-    return [addr, 0, (<char *>&val)[:size], bus]
+
+    cdef CANMessageTemplate t = CANMessageTemplate.__new__(CANMessageTemplate)
+    t.packer = self.packer
+    t.owner = self
+    t.address = addr
+    t.size = size
+    t.signal_names = tuple(signal_names)
+    for name in t.signal_names:
+      t.sigs.push_back(self.packer.lookup_signal(addr, name.encode('utf8')))
+    return t
+
+  cpdef make_can_msg(self, name_or_addr, bus, values, counter=-1):
+    # templates are cached by message and signal names, the same dict layout is packed every frame
+    key = (name_or_addr, tuple(values))
+    t = self.templates.get(key)
+    if t is None:
+      if len(self.templates) >= MAX_TEMPLATES:
+        del self.templates[next(iter(self.templates))]
+      t = self.templates[key] = self.template(name_or_addr, key[1])
+    return (<CANMessageTemplate>t).make_can_msg(bus, values.values(), counter)
+
+  def make_can_msgs(self, msgs):
+    """Packs a list of (name_or_addr, bus, values, counter) in one call."""
+    return [self.make_can_msg(name_or_addr, bus, values, counter) for name_or_addr, bus, values, counter in msgs]
@@ -87,6 +87,11 @@ bool MessageState::parse(uint64_t sec, uint16_t ts_, uint8_t * dat) {
   ts = ts_;
   seen = sec;
 
+  if (out_vals != NULL) {
+    std::copy(vals.begin(), vals.end(), out_vals);
+    std::fill(out_ts, out_ts + vals.size(), ts);
+  }
+
   return true;
 }
 
@@ -166,6 +171,7 @@ CANParser::CANParser(int abus, const std::string& dbc_name,
       }
     }
   }
+  init_signal_values();
 }
 
 CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter)
@@ -193,19 +199,47 @@ CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum
 
     message_states[state.address] = state;
   }
+  init_signal_values();
+}
+
+void CANParser::init_signal_values() {
+  for (const auto& kv : message_states) {
+    const auto& state = kv.second;
+    for (int i = 0; i < state.parse_sigs.size(); i++) {
+      signal_index.push_back({state.address, state.parse_sigs[i].name, signal_values.size()});
+      signal_values.push_back(state.vals[i]);
+      signal_ts.push_back(0);
+    }
+  }
+
+  // only hand out pointers once the arrays won't be reallocated
+  size_t idx = 0;
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    state.out_vals = signal_values.data() + idx;
+    state.out_ts = signal_ts.data() + idx;
+    idx += state.parse_sigs.size();
+  }
 }
 
 #ifndef DYNAMIC_CAPNP
-void CANParser::update_string(const std::string &data, bool sendcan) {
-  // format for board, make copy due to alignment issues.
-  const size_t buf_size = (data.length() / sizeof(capnp::word)) + 1;
-  if (aligned_buf.size() < buf_size) {
-    aligned_buf = kj::heapArray<capnp::word>(buf_size);
+// Serialized events can be read in place if they are word aligned, otherwise they are copied into buf
+static kj::ArrayPtr<const capnp::word> aligned_event(const char *data, size_t size, kj::Array<capnp::word> &buf) {
+  if (reinterpret_cast<uintptr_t>(data) % alignof(capnp::word) == 0 && size % sizeof(capnp::word) == 0) {
+    return kj::arrayPtr(reinterpret_cast<const capnp::word*>(data), size / sizeof(capnp::word));
   }
-  memcpy(aligned_buf.begin(), data.data(), data.length());
 
+  const size_t buf_size = (size / sizeof(capnp::word)) + 1;
+  if (buf.size() < buf_size) {
+    buf = kj::heapArray<capnp::word>(buf_size);
+  }
+  memcpy(buf.begin(), data, size);
+  return buf.slice(0, buf_size);
+}
+
+void CANParser::update_string(const std::string &data, bool sendcan) {
   // extract the messages
-  capnp::FlatArrayMessageReader cmsg(aligned_buf.slice(0, buf_size));
+  capnp::FlatArrayMessageReader cmsg(aligned_event(data.data(), data.length(), aligned_buf));
   cereal::Event::Reader event = cmsg.getRoot<cereal::Event>();
 
   last_sec = event.getLogMonoTime();
@@ -280,6 +314,73 @@ void CANParser::UpdateValid(uint64_t sec) {
   }
 }
 
+std::vector<SignalHistory> CANParser::init_history() {
+  std::vector<SignalHistory> history;
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    state.history_idx = history.size();
+    for (const auto& sig : state.parse_sigs) {
+      history.push_back({state.address, sig.name, {}, {}});
+    }
+  }
+  return history;
+}
+
+void CANParser::parse_frame_history(uint64_t sec, uint32_t address, uint8_t src, uint16_t bus_time,
+                                    const uint8_t *dat, size_t dat_len, std::vector<SignalHistory> &history) {
+  if (src != bus || dat_len > 8) return;
+
+  auto state_it = message_states.find(address);
+  if (state_it == message_states.end()) return;
+
+  uint8_t data[8] = {0};
+  memcpy(data, dat, dat_len);
+
+  auto& state = state_it->second;
+  if (!state.parse(sec, bus_time, data)) return;
+
+  for (int i = 0; i < state.vals.size(); i++) {
+    auto& h = history[state.history_idx + i];
+    h.ts.push_back(sec);
+    h.values.push_back(state.vals[i]);
+  }
+}
+
+std::vector<SignalHistory> CANParser::parse_frames(size_t n, const uint64_t *sec, const uint32_t *address, const uint8_t *src,
+                                                   const uint16_t *bus_time, const uint8_t *dat, const uint64_t *dat_offset) {
+  // frame i has payload dat[dat_offset[i]:dat_offset[i+1]]
+  std::vector<SignalHistory> history = init_history();
+  for (size_t i = 0; i < n; i++) {
+    assert(dat_offset[i] <= dat_offset[i+1]);  // the caller checks the offsets are in dat and non-decreasing
+    parse_frame_history(sec[i], address[i], src[i], bus_time[i], dat + dat_offset[i], dat_offset[i+1] - dat_offset[i], history);
+  }
+  if (n > 0) {
+    last_sec = sec[n-1];
+    UpdateValid(last_sec);
+  }
+  return history;
+}
+
+#ifndef DYNAMIC_CAPNP
+std::vector<SignalHistory> CANParser::parse_strings(const std::vector<std::string> &data, bool sendcan) {
+  std::vector<SignalHistory> history = init_history();
+  for (const auto &d : data) {
+    capnp::FlatArrayMessageReader cmsg(aligned_event(d.data(), d.length(), aligned_buf));
+    cereal::Event::Reader event = cmsg.getRoot<cereal::Event>();
+    last_sec = event.getLogMonoTime();
+
+    auto cans = sendcan? event.getSendcan() : event.getCan();
+    for (int i = 0; i < cans.size(); i++) {
+      auto frame = cans[i];
+      auto dat = frame.getDat();
+      parse_frame_history(last_sec, frame.getAddress(), frame.getSrc(), frame.getBusTime(), dat.begin(), dat.size(), history);
+    }
+  }
+  UpdateValid(last_sec);
+  return history;
+}
+#endif
+
 std::vector<SignalValue> CANParser::query_latest() {
   std::vector<SignalValue> ret;
 
@@ -300,3 +401,54 @@ std::vector<SignalValue> CANParser::query_latest() {
 
   return ret;
 }
+
+std::vector<uint32_t> CANParser::query_updated(uint64_t sec) {
+  std::vector<uint32_t> ret;
+  for (const auto& kv : message_states) {
+    const auto& state = kv.second;
+    if (last_sec == 0 || (state.seen >= sec && state.seen <= last_sec)) {
+      ret.push_back(state.address);
+    }
+  }
+  return ret;
+}
+
+CANParserGroup::CANParserGroup(const std::vector<CANParser*> &aparsers) : parsers(aparsers) {
+  for (auto p : parsers) {
+    for (auto& kv : p->message_states) {
+      routes[((uint64_t)p->bus << 32) | kv.first].push_back(&kv.second);
+    }
+  }
+}
+
+#ifndef DYNAMIC_CAPNP
+uint64_t CANParserGroup::update_string(const char *data, size_t size, bool sendcan, std::vector<bool> &valid) {
+  capnp::FlatArrayMessageReader cmsg(aligned_event(data, size, aligned_buf));
+  cereal::Event::Reader event = cmsg.getRoot<cereal::Event>();
+  uint64_t sec = event.getLogMonoTime();
+
+  auto cans = sendcan? event.getSendcan() : event.getCan();
+  for (int i = 0; i < cans.size(); i++) {
+    auto frame = cans[i];
+    auto route_it = routes.find(((uint64_t)frame.getSrc() << 32) | frame.getAddress());
+    if (route_it == routes.end()) continue;
+
+    auto dat = frame.getDat();
+    if (dat.size() > 8) continue; //shouldn't ever happen
+    uint8_t data[8] = {0};
+    memcpy(data, dat.begin(), dat.size());
+
+    for (auto state : route_it->second) {
+      state->parse(sec, frame.getBusTime(), data);
+    }
+  }
+
+  valid.resize(parsers.size());
+  for (int i = 0; i < parsers.size(); i++) {
+    parsers[i]->last_sec = sec;
+    parsers[i]->UpdateValid(sec);
+    valid[i] = parsers[i]->can_valid;
+  }
+  return sec;
+}
+#endif
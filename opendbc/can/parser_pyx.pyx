@@ -4,19 +4,87 @@
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp.unordered_set cimport unordered_set
-from libc.stdint cimport uint32_t, uint64_t, uint16_t
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, uint16_t
+from libc.string cimport memcpy
 from libcpp.map cimport map
 from libcpp cimport bool
 
 from .common cimport CANParser as cpp_CANParser
-from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC
+from .common cimport CANParserGroup as cpp_CANParserGroup
+from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, SignalIndex, SignalHistory, DBC
 
 import os
 import numbers
+import numpy as np
 from collections import defaultdict
+from collections.abc import Mapping
 
 cdef int CAN_INVALID_CNT = 5
 
+
+cdef class SignalView:
+  """Read only dict of the signals of one message, reads straight from the parser's value arrays."""
+  cdef:
+    dict index
+    const double *vals
+    const uint16_t *ts
+    object owner  # keeps the arrays alive
+
+  @staticmethod
+  cdef SignalView create(object owner, dict index, const double *vals, const uint16_t *ts):
+    cdef SignalView v = SignalView.__new__(SignalView)
+    v.owner = owner
+    v.index = index
+    v.vals = vals
+    v.ts = ts
+    return v
+
+  cdef get_idx(self, size_t i):
+    if self.vals != NULL:
+      return self.vals[i]
+    return self.ts[i]
+
+  def __getitem__(self, name):
+    return self.get_idx(self.index[name])
+
+  def get(self, name, default=None):
+    i = self.index.get(name)
+    return default if i is None else self.get_idx(i)
+
+  def __contains__(self, name):
+    return name in self.index
+
+  def __iter__(self):
+    return iter(self.index)
+
+  def __len__(self):
+    return len(self.index)
+
+  def keys(self):
+    return self.index.keys()
+
+  def values(self):
+    return [self.get_idx(i) for i in self.index.values()]
+
+  def items(self):
+    return [(name, self.get_idx(i)) for name, i in self.index.items()]
+
+  def __copy__(self):
+    # a snapshot, e.g. to send back a modified copy of a message
+    return dict(self.items())
+
+  def __richcmp__(self, other, int op):
+    if op == 2:
+      return dict(self.items()) == other
+    elif op == 3:
+      return dict(self.items()) != other
+    return NotImplemented
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+Mapping.register(SignalView)
+
 cdef class CANParser:
   cdef:
     cpp_CANParser *can
@@ -32,6 +100,8 @@ cdef class CANParser:
     dict ts
     bool can_valid
     int can_invalid_cnt
+    object values
+    dict signal_index
 
   def __init__(self, dbc_name, signals, checks=None, bus=0, enforce_checks=True):
     if checks is None:
@@ -54,10 +124,6 @@ cdef class CANParser:
 
       self.msg_name_to_address[name] = msg.address
       self.address_to_msg_name[msg.address] = name
-      self.vl[msg.address] = {}
-      self.vl[name] = {}
-      self.ts[msg.address] = {}
-      self.ts[name] = {}
 
     # Convert message names into addresses
     for i in range(len(signals)):
@@ -101,35 +167,40 @@ cdef class CANParser:
       message_options_v.push_back(mpo)
 
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
+    self.init_views()
     self.update_vl()
 
-  cdef unordered_set[uint32_t] update_vl(self):
-    cdef string sig_name
-    cdef unordered_set[uint32_t] updated_val
-
-    can_values = self.can.query_latest()
-    valid = self.can.can_valid
+  cdef init_views(self):
+    # vl and ts are views on arrays the C++ parser writes into, nothing is copied on update
+    cdef size_t n = self.can.signal_values.size()
+    cdef SignalIndex si
+    self.values = np.asarray(<double[:n]>self.can.signal_values.data()) if n > 0 else np.zeros(0)
+    self.values.flags.writeable = False
+
+    self.signal_index = {}
+    index = defaultdict(dict)
+    for si in self.can.signal_index:
+      sig_name = <unicode>si.name
+      index[si.address][sig_name] = si.idx
+      self.signal_index[(si.address, sig_name)] = si.idx
+
+    for i in range(self.dbc[0].num_msgs):
+      msg = self.dbc[0].msgs[i]
+      name = msg.name.decode('utf8')
+      msg_index = index.get(msg.address, {})
+      self.vl[msg.address] = self.vl[name] = SignalView.create(self, msg_index, self.can.signal_values.data(), NULL)
+      self.ts[msg.address] = self.ts[name] = SignalView.create(self, msg_index, NULL, self.can.signal_ts.data())
 
+  cdef void update_valid(self, bool valid):
     # Update invalid flag
     self.can_invalid_cnt += 1
     if valid:
         self.can_invalid_cnt = 0
     self.can_valid = self.can_invalid_cnt < CAN_INVALID_CNT
 
-    for cv in can_values:
-      # Cast char * directly to unicode
-      name = <unicode>self.address_to_msg_name[cv.address].c_str()
-      cv_name = <unicode>cv.name
-
-      self.vl[cv.address][cv_name] = cv.value
-      self.ts[cv.address][cv_name] = cv.ts
-
-      self.vl[name][cv_name] = cv.value
-      self.ts[name][cv_name] = cv.ts
-
-      updated_val.insert(cv.address)
-
-    return updated_val
+  cdef set update_vl(self):
+    self.update_valid(self.can.can_valid)
+    return set(self.can.query_updated(self.can.last_sec))
 
   def update_string(self, dat, sendcan=False):
     self.can.update_string(dat, sendcan)
@@ -144,6 +215,125 @@ cdef class CANParser:
 
     return updated_vals
 
+  cdef history_to_arrays(self, vector[SignalHistory] &history):
+    cdef size_t i, n
+    cdef double[::1] values_v
+    cdef uint64_t[::1] ts_v
+
+    vl = defaultdict(dict)
+    ts = defaultdict(dict)
+    for i in range(history.size()):
+      n = history[i].values.size()
+      values = np.empty(n, dtype=np.float64)
+      times = np.empty(n, dtype=np.uint64)
+      if n > 0:
+        values_v = values
+        ts_v = times
+        memcpy(&values_v[0], history[i].values.data(), n * sizeof(double))
+        memcpy(&ts_v[0], history[i].ts.data(), n * sizeof(uint64_t))
+
+      address = history[i].address
+      name = <unicode>self.address_to_msg_name[address].c_str()
+      sig_name = <unicode>history[i].name
+      vl[address][sig_name] = vl[name][sig_name] = values
+      ts[address][sig_name] = ts[name][sig_name] = times
+
+    return dict(vl), dict(ts)
+
+  def parse_frames(self, sec, address, src, bus_time, dat, dat_offset):
+    """Decodes many CAN frames at once without going back to Python per frame.
+
+       Takes per frame arrays of time (ns), address, src bus and bus time, plus all payloads
+       back to back in dat with frame i at dat[dat_offset[i]:dat_offset[i+1]], the layout
+       of the can columns written by tools/lib/log_columns.py.
+
+       Returns (vl, ts) keyed like the parser's vl and ts, with an array of every value of
+       each signal and the times they were received, empty arrays for signals that weren't
+       received. Like update_strings this updates the parser's vl, ts and can_valid, and
+       checksum, counter and validity state carries over between calls, use a separate
+       parser from the one used live.
+    """
+    offsets = np.asarray(dat_offset)
+    if offsets.ndim != 1 or (len(offsets) > 0 and (offsets[0] < 0 or np.any(offsets[1:] < offsets[:-1]))):
+      raise ValueError("dat_offset must be non-negative and non-decreasing")
+
+    cdef const uint64_t[::1] sec_v = np.ascontiguousarray(sec, dtype=np.uint64)
+    cdef const uint32_t[::1] address_v = np.ascontiguousarray(address, dtype=np.uint32)
+    cdef const uint8_t[::1] src_v = np.ascontiguousarray(src, dtype=np.uint8)
+    cdef const uint16_t[::1] bus_time_v = np.ascontiguousarray(bus_time, dtype=np.uint16)
+    cdef const uint8_t[::1] dat_v = np.ascontiguousarray(dat, dtype=np.uint8)
+    cdef const uint64_t[::1] dat_offset_v = np.ascontiguousarray(offsets, dtype=np.uint64)
+    cdef size_t n = address_v.shape[0]
+    cdef vector[SignalHistory] history
+    cdef uint8_t empty = 0
+    cdef const uint8_t *dat_ptr = &empty  # dat may be empty if all payloads are
+
+    if not (sec_v.shape[0] == src_v.shape[0] == bus_time_v.shape[0] == n and dat_offset_v.shape[0] == n + 1):
+      raise ValueError("frame arrays must have the same length, and dat_offset one more")
+    if dat_offset_v[n] > <uint64_t>dat_v.shape[0]:
+      raise ValueError("dat_offset points past the end of dat")
+
+    if n == 0:
+      # no frames to read, still returns an empty history of every signal
+      history = self.can.parse_frames(0, NULL, NULL, NULL, NULL, dat_ptr, &dat_offset_v[0])
+      return self.history_to_arrays(history)
+
+    if dat_v.shape[0] > 0:
+      dat_ptr = &dat_v[0]
+    history = self.can.parse_frames(n, &sec_v[0], &address_v[0], &src_v[0], &bus_time_v[0], dat_ptr, &dat_offset_v[0])
+    self.update_vl()
+    return self.history_to_arrays(history)
+
+  def parse_strings(self, strings, sendcan=False):
+    """Like parse_frames, but decodes a list of serialized can events in a single call."""
+    cdef vector[SignalHistory] history = self.can.parse_strings(strings, sendcan)
+    self.update_vl()
+    return self.history_to_arrays(history)
+
+cdef class CANParserGroup:
+  """Updates several parsers from the same can events, each event is deserialized once.
+
+     Same results as calling update_strings on each parser, e.g. a car's cp, cp_cam and cp_body.
+  """
+  cdef:
+    cpp_CANParserGroup *group
+    list parsers
+    vector[bool] valid
+
+  def __init__(self, parsers):
+    cdef vector[cpp_CANParser*] parsers_v
+    cdef CANParser p
+    self.parsers = list(parsers)
+    for p in self.parsers:
+      parsers_v.push_back(p.can)
+    self.group = new cpp_CANParserGroup(parsers_v)
+
+  def __dealloc__(self):
+    del self.group
+
+  def update_strings(self, strings, sendcan=False):
+    """Returns the set of updated addresses of each parser."""
+    cdef CANParser p
+    cdef size_t i
+    cdef bytes dat
+    cdef uint64_t sec, first_sec = 0
+
+    if len(strings) == 0:
+      return [set() for _ in self.parsers]
+
+    for dat in strings:
+      sec = self.group.update_string(dat, len(dat), sendcan, self.valid)
+      if first_sec == 0:
+        first_sec = sec
+      for i in range(self.valid.size()):
+        (<CANParser>self.parsers[i]).update_valid(self.valid[i])
+
+    updated = []
+    for p in self.parsers:
+      updated.append(set(p.can.query_updated(first_sec)))
+    return updated
+
+
 cdef class CANDefine():
   cdef:
     const DBC *dbc
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+import numpy as np
+from opendbc.can import packer_pyx
+from opendbc.can.packer import CANPacker
+from opendbc.can.parser import CANParser
+
+DBC = "honda_civic_touring_2016_can_generated"
+STEER_SIGNALS = ("STEER_TORQUE", "STEER_TORQUE_REQUEST")
+
+
+class TestCANPacker(unittest.TestCase):
+  def setUp(self):
+    self.packer = CANPacker(DBC)
+
+  def test_template_matches_make_can_msg(self):
+    t = self.packer.template("STEERING_CONTROL", STEER_SIGNALS)
+    self.assertEqual(t.address, 0xe4)
+    for i in range(20):
+      values = {"STEER_TORQUE": i * 10 - 100, "STEER_TORQUE_REQUEST": i % 2}
+      self.assertEqual(t.make_can_msg(0, values.values(), i % 4),
+                       self.packer.make_can_msg("STEERING_CONTROL", 0, values, i % 4))
+      self.assertEqual(self.packer.template(0xe4, STEER_SIGNALS).make_can_msg(0, values.values(), i % 4),
+                       self.packer.make_can_msg(0xe4, 0, values, i % 4))
+
+  def test_pack_array(self):
+    t = self.packer.template("STEERING_CONTROL", STEER_SIGNALS)
+    values = np.stack([np.arange(20) * 10 - 100, np.arange(20) % 2], axis=1)
+    packed = t.pack_array(values, np.arange(20) % 4)
+    self.assertEqual(packed.shape, (20, t.size))
+    for i, row in enumerate(values):
+      msg = self.packer.make_can_msg("STEERING_CONTROL", 0, dict(zip(STEER_SIGNALS, row)), i % 4)
+      self.assertEqual(packed[i].tobytes(), msg[2])
+
+    # a 1-D array is one row, unless the template has a single signal
+    np.testing.assert_equal(t.pack_array(values[3], 3), packed[3:4])
+    single = self.packer.template("WHEEL_SPEEDS", ["WHEEL_SPEED_FL"])
+    speeds = np.arange(5) * 1.5
+    packed = single.pack_array(speeds)
+    self.assertEqual(packed.shape, (5, single.size))
+    for i, v in enumerate(speeds):
+      self.assertEqual(packed[i].tobytes(), self.packer.make_can_msg("WHEEL_SPEEDS", 0, {"WHEEL_SPEED_FL": v})[2])
+
+    with self.assertRaises(ValueError):
+      t.pack_array(np.zeros((2, 3)))
+
+  def test_packed_values_parse_back(self):
+    t = self.packer.template("WHEEL_SPEEDS", ["WHEEL_SPEED_FL", "WHEEL_SPEED_RR"])
+    values = np.stack([np.arange(10) * 2., np.arange(10) * 0.5], axis=1)
+    packed = t.pack_array(values)
+
+    cp = CANParser(DBC, [("WHEEL_SPEED_FL", "WHEEL_SPEEDS", 0), ("WHEEL_SPEED_RR", "WHEEL_SPEEDS", 0)], [("WHEEL_SPEEDS", 50)], 0)
+    n = len(packed)
+    vl, _ = cp.parse_frames(np.arange(n) * 20_000_000, [t.address] * n, [0] * n, [0] * n,
+                            packed.ravel(), np.arange(n + 1) * t.size)
+    np.testing.assert_allclose(vl["WHEEL_SPEEDS"]["WHEEL_SPEED_FL"], values[:, 0])
+    np.testing.assert_allclose(vl["WHEEL_SPEEDS"]["WHEEL_SPEED_RR"], values[:, 1])
+
+  def test_make_can_msgs(self):
+    msgs = [("STEERING_CONTROL", 0, {"STEER_TORQUE": 50, "STEER_TORQUE_REQUEST": 1}, 2),
+            ("WHEEL_SPEEDS", 1, {"WHEEL_SPEED_FL": 12.5}, -1),
+            (0xe4, 2, {"STEER_TORQUE_REQUEST": 1}, 0)]
+    expected = [CANPacker(DBC).make_can_msg(*m) for m in msgs]
+    self.assertEqual(self.packer.make_can_msgs(msgs), expected)
+
+  def test_template_cache_eviction(self):
+    combos = [tuple(f"WHEEL_SPEED_{w}" for w in ("FL", "FR", "RL", "RR")[:i]) for i in range(5)]
+    expected = {}
+    with mock.patch.object(packer_pyx, "MAX_TEMPLATES", 2):
+      for _ in range(3):
+        for names in combos:
+          msg = self.packer.make_can_msg("WHEEL_SPEEDS", 0, dict.fromkeys(names, 1.))
+          self.assertEqual(expected.setdefault(names, msg), msg)
+          self.assertLessEqual(len(self.packer.templates), 2)
+
+      # the oldest template goes first, the newest two are kept
+      self.assertEqual(list(self.packer.templates), [("WHEEL_SPEEDS", combos[3]), ("WHEEL_SPEEDS", combos[4])])
+      self.packer.make_can_msg("WHEEL_SPEEDS", 0, dict.fromkeys(combos[1], 1.))
+      self.assertEqual(list(self.packer.templates), [("WHEEL_SPEEDS", combos[4]), ("WHEEL_SPEEDS", combos[1])])
+      # a cached template is reused without evicting
+      self.packer.make_can_msg("WHEEL_SPEEDS", 0, dict.fromkeys(combos[4], 2.))
+      self.assertEqual(list(self.packer.templates), [("WHEEL_SPEEDS", combos[4]), ("WHEEL_SPEEDS", combos[1])])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+import copy
+import unittest
+
+import numpy as np
+from cereal import log
+from opendbc.can.packer import CANPacker
+from opendbc.can.parser import CANParser, CANParserGroup
+
+DBC = "honda_civic_touring_2016_can_generated"
+SIGNALS = [
+  ("STEER_TORQUE", "STEERING_CONTROL", 0),
+  ("STEER_TORQUE_REQUEST", "STEERING_CONTROL", 0),
+  ("WHEEL_SPEED_FL", "WHEEL_SPEEDS", 0),
+  ("WHEEL_SPEED_RR", "WHEEL_SPEEDS", 0),
+]
+CHECKS = [("STEERING_CONTROL", 100), ("WHEEL_SPEEDS", 50)]
+ADDRESSES = {"STEERING_CONTROL": 0xe4, "WHEEL_SPEEDS": 0x1d0}
+
+
+def make_events(n):
+  """Serialized can events at 100 Hz, each with at most one frame per message on bus 0."""
+  packer = CANPacker(DBC)
+  events = []
+  for i in range(n):
+    frames = [packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": i, "STEER_TORQUE_REQUEST": i % 2}, i % 4)]
+    if i % 2 == 0:
+      frames.append(packer.make_can_msg("WHEEL_SPEEDS", 0, {"WHEEL_SPEED_FL": i / 2., "WHEEL_SPEED_RR": i / 4.}, -1))
+    # other buses are ignored
+    frames.append(packer.make_can_msg("WHEEL_SPEEDS", 1, {"WHEEL_SPEED_FL": 99. + i}, -1))
+    if i % 3 == 0:
+      frames.append(packer.make_can_msg("STEERING_CONTROL", 2, {"STEER_TORQUE": -i, "STEER_TORQUE_REQUEST": 1}, i % 4))
+
+    ev = log.Event.new_message()
+    ev.logMonoTime = (i + 1) * 10_000_000
+    can = ev.init('can', len(frames))
+    for c, (address, bus_time, dat, src) in zip(can, frames):
+      c.address, c.busTime, c.dat, c.src = address, bus_time, dat, src
+    events.append(ev.to_bytes())
+  return events
+
+
+def events_to_frames(events):
+  sec, address, src, bus_time, dats = [], [], [], [], []
+  for dat in events:
+    ev = log.Event.from_bytes(dat)
+    for c in ev.can:
+      sec.append(ev.logMonoTime)
+      address.append(c.address)
+      src.append(c.src)
+      bus_time.append(c.busTime)
+      dats.append(c.dat)
+  dat_offset = np.cumsum([0] + [len(d) for d in dats])
+  return sec, address, src, bus_time, np.frombuffer(b"".join(dats), dtype=np.uint8), dat_offset
+
+
+class TestParseFrames(unittest.TestCase):
+  def test_matches_update_strings(self):
+    events = make_events(100)
+
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    expected_vl = {(msg, sig): [] for sig, msg, _ in SIGNALS}
+    expected_ts = {(msg, sig): [] for sig, msg, _ in SIGNALS}
+    for i, dat in enumerate(events):
+      updated = cp.update_strings([dat])
+      for sig, msg, _ in SIGNALS:
+        if ADDRESSES[msg] in updated:
+          expected_vl[(msg, sig)].append(cp.vl[msg][sig])
+          expected_ts[(msg, sig)].append((i + 1) * 10_000_000)
+
+    batch_cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    vl, ts = batch_cp.parse_frames(*events_to_frames(events))
+
+    for sig, msg, _ in SIGNALS:
+      np.testing.assert_equal(vl[msg][sig], expected_vl[(msg, sig)])
+      np.testing.assert_equal(ts[msg][sig], expected_ts[(msg, sig)])
+      self.assertIs(vl[ADDRESSES[msg]][sig], vl[msg][sig])
+      # the parser state ends up the same too
+      self.assertEqual(batch_cp.vl[msg][sig], cp.vl[msg][sig])
+    self.assertEqual(len(vl["WHEEL_SPEEDS"]["WHEEL_SPEED_FL"]), 50)
+    self.assertEqual(batch_cp.can_valid, cp.can_valid)
+
+  def test_empty(self):
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    vl, ts = cp.parse_frames([], [], [], [], np.zeros(0, dtype=np.uint8), [0])
+    for sig, msg, _ in SIGNALS:
+      self.assertEqual(len(vl[msg][sig]), 0)
+      self.assertEqual(len(ts[msg][sig]), 0)
+
+    # same keys as a parse with frames
+    vl_frames, _ = cp.parse_frames(*events_to_frames(make_events(2)))
+    self.assertEqual(set(vl), set(vl_frames))
+
+  def test_bad_offsets(self):
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    dat = np.zeros(16, dtype=np.uint8)
+    for offsets in ([8, 0, 16], [-8, 8, 16], [0, 24, 16], [0, 8, 24], [0, 8]):
+      with self.assertRaises(ValueError):
+        cp.parse_frames([1, 2], [0xe4, 0xe4], [0, 0], [0, 0], dat, offsets)
+
+
+class TestCANParserGroup(unittest.TestCase):
+  @staticmethod
+  def make_parsers():
+    # STEERING_CONTROL is on bus 0 and 2, every event on bus 0 but only every third one on bus 2
+    return [
+      CANParser(DBC, list(SIGNALS), list(CHECKS), 0),
+      CANParser(DBC, [("WHEEL_SPEED_FL", "WHEEL_SPEEDS", 0)], [("WHEEL_SPEEDS", 100)], 1),
+      CANParser(DBC, [("STEER_TORQUE", "STEERING_CONTROL", 0)], [("STEERING_CONTROL", 100)], 2),
+    ]
+
+  def test_matches_separate_parsers(self):
+    events = make_events(200)
+    parsers = self.make_parsers()
+    group_parsers = self.make_parsers()
+    group = CANParserGroup(group_parsers)
+
+    self.assertEqual(group.update_strings([]), [set(), set(), set()])
+    for i in range(0, len(events), 5):
+      chunk = events[i:i + 5]
+      updated = group.update_strings(chunk)
+      self.assertEqual(updated, [p.update_strings(chunk) for p in parsers], i)
+
+      for p, gp in zip(parsers, group_parsers):
+        self.assertEqual(gp.can_valid, p.can_valid, i)
+        for msg in ("STEERING_CONTROL", "WHEEL_SPEEDS", 0xe4, 0x1d0):
+          self.assertEqual(gp.vl[msg], p.vl[msg], (i, msg))
+          self.assertEqual(gp.ts[msg], p.ts[msg], (i, msg))
+
+    # each parser only sees its own bus
+    self.assertAlmostEqual(group_parsers[1].vl["WHEEL_SPEEDS"]["WHEEL_SPEED_FL"], 99. + 199)
+    self.assertEqual(group_parsers[2].vl["STEERING_CONTROL"]["STEER_TORQUE"], -198)
+    self.assertEqual(group_parsers[0].vl["STEERING_CONTROL"]["STEER_TORQUE"], 199)
+
+
+class TestSignalView(unittest.TestCase):
+  def test_query_updated(self):
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    events = make_events(4)
+    # odd events have no WHEEL_SPEEDS frame on bus 0
+    self.assertEqual(cp.update_strings([events[0]]), {0xe4, 0x1d0})
+    self.assertEqual(cp.update_strings([events[1]]), {0xe4})
+    self.assertEqual(cp.update_strings(events[2:]), {0xe4, 0x1d0})
+    self.assertEqual(cp.update_strings([]), set())
+
+    self.assertEqual(cp.vl["STEERING_CONTROL"]["STEER_TORQUE"], 3)
+    self.assertEqual(cp.ts["STEERING_CONTROL"]["STEER_TORQUE"], cp.ts[0xe4]["STEER_TORQUE"])
+
+  def test_copy_is_a_snapshot(self):
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    cp.parse_frames(*events_to_frames(make_events(3)))
+    view = cp.vl["WHEEL_SPEEDS"]
+    snapshot = copy.copy(view)
+    self.assertIs(type(snapshot), dict)
+    self.assertEqual((snapshot["WHEEL_SPEED_FL"], snapshot["WHEEL_SPEED_RR"]), (1., 0.5))
+    self.assertEqual(view, snapshot)
+
+    # the copy can be modified and does not follow the parser
+    snapshot["WHEEL_SPEED_FL"] = 10.
+    cp.parse_frames(*events_to_frames(make_events(5)))
+    self.assertEqual((snapshot["WHEEL_SPEED_FL"], snapshot["WHEEL_SPEED_RR"]), (10., 0.5))
+    self.assertEqual(view["WHEEL_SPEED_FL"], 2.)
+    self.assertEqual(dict(view), copy.copy(view))
+
+  def test_read_only(self):
+    cp = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    view = cp.vl["STEERING_CONTROL"]
+    # the checksum and counter are parsed too
+    self.assertEqual(set(view), {"STEER_TORQUE", "STEER_TORQUE_REQUEST", "COUNTER", "CHECKSUM"})
+    with self.assertRaises(TypeError):
+      view["STEER_TORQUE"] = 1
+    with self.assertRaises(TypeError):
+      del view["STEER_TORQUE"]
+    with self.assertRaises(KeyError):
+      view["NOT_A_SIGNAL"]
+    self.assertIsNone(view.get("NOT_A_SIGNAL"))
+
+    self.assertFalse(cp.values.flags.writeable)
+    with self.assertRaises(ValueError):
+      cp.values[0] = 1.
+    with self.assertRaises(AttributeError):
+      cp.vl = {}
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,104 @@
+import cereal.messaging as messaging
+from common.realtime import sec_since_boot
+
+BIN_WIDTH = 1e-4  # s
+N_BINS = 500  # 0 to 50 ms, slower samples land in an overflow bin
+
+
+class SectionHistogram():
+  """Fixed-size histogram of the durations of one profiled section."""
+  def __init__(self):
+    self.counts = [0] * (N_BINS + 1)
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+
+  def add(self, dt):
+    self.counts[min(int(dt / BIN_WIDTH), N_BINS)] += 1
+    self.count += 1
+    self.total += dt
+    if dt > self.max:
+      self.max = dt
+
+  def percentile(self, q):
+    """Upper edge of the bin holding the q-th percentile, never more than the largest sample."""
+    target = q * self.count
+    cnt = 0
+    for i, c in enumerate(self.counts):
+      cnt += c
+      if cnt >= target and cnt > 0 and i < N_BINS:
+        return min((i + 1) * BIN_WIDTH, self.max)
+    return self.max
+
+
+class SectionProfiler():
+  """Times named sections of a loop into histograms and publishes their stats on service every publish_frames loops.
+
+     Like common.profiler.Profiler, checkpoint() records the time since the previous checkpoint.
+  """
+  def __init__(self, service, budget, publish_frames=100, enabled=True):
+    self.service = service
+    self.budget = budget
+    self.publish_frames = publish_frames
+    self.enabled = enabled
+    self.last_time = sec_since_boot()
+    self.reset()
+
+  def reset(self):
+    self.sections = {}
+    self.total = SectionHistogram()
+    self.frames = 0
+    self.over_budget = 0
+    self.frame_time = 0.
+
+  def checkpoint(self, name, ignore=False):
+    # ignore flag needed when benchmarking threads with ratekeeper, the section is kept out of the frame time
+    if not self.enabled:
+      return
+    t = sec_since_boot()
+    dt = t - self.last_time
+    self.last_time = t
+
+    h = self.sections.get(name)
+    if h is None:
+      h = self.sections[name] = SectionHistogram()
+    h.add(dt)
+    if not ignore:
+      self.frame_time += dt
+
+  def end_frame(self, pm=None):
+    """Closes one loop iteration, and publishes and resets the stats once every publish_frames loops."""
+    if not self.enabled:
+      return
+    self.total.add(self.frame_time)
+    self.over_budget += self.frame_time > self.budget
+    self.frame_time = 0.
+    self.frames += 1
+
+    if pm is not None and self.frames >= self.publish_frames:
+      pm.send(self.service, self.get_msg())
+      self.reset()
+
+  def get_msg(self):
+    hists = list(self.sections.items()) + [("total", self.total)]
+    msg = messaging.new_message(self.service)
+    profile = getattr(msg, self.service)
+    profile.frames = self.frames
+    profile.budgetMs = self.budget * 1e3
+    profile.overBudget = self.over_budget
+    sections = profile.init('sections', len(hists))
+    for s, (name, h) in zip(sections, hists):
+      s.name = name
+      s.count = h.count
+      s.meanMs = h.total / max(h.count, 1) * 1e3
+      s.p50Ms = h.percentile(0.5) * 1e3
+      s.p99Ms = h.percentile(0.99) * 1e3
+      s.maxMs = h.max * 1e3
+    return msg
+
+  def display(self):
+    if not self.enabled or self.frames == 0:
+      return
+    print("%d frames, %d over the %.1f ms budget" % (self.frames, self.over_budget, self.budget * 1e3))
+    for name, h in list(self.sections.items()) + [("total", self.total)]:
+      print("%20s p50 %6.2f ms  p99 %6.2f ms  max %6.2f ms" % (name, h.percentile(0.5) * 1e3, h.percentile(0.99) * 1e3, h.max * 1e3))
@@ -1,8 +1,12 @@
+import hashlib
 import os
 import platform
+import shutil
+import tempfile
 from cffi import FFI
 
 TEMPLATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'templates'))
+CACHE_DIR = os.environ.get("REDNOSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rednose"))
 
 
 def write_code(folder, name, code, header):
@@ -13,6 +17,45 @@ def write_code(folder, name, code, header):
   open(os.path.join(folder, f"{name}.h"), 'w').write(header)
 
 
+def code_hash(*parts):
+  """Hash of everything code is generated from, sympy expressions are hashed through their srepr."""
+  import sympy as sp
+  h = hashlib.sha256(sp.__version__.encode())
+  for part in parts:
+    h.update(b"\0" + sp.srepr(part).encode())
+  return h.hexdigest()
+
+
+def load_cached_code(folder, key, filenames):
+  """Copies the cached files generated for key to folder, returns False if they aren't cached."""
+  cache = os.path.join(CACHE_DIR, key)
+  if not all(os.path.isfile(os.path.join(cache, fn)) for fn in filenames):
+    return False
+
+  os.makedirs(folder, exist_ok=True)
+  for fn in filenames:
+    shutil.copyfile(os.path.join(cache, fn), os.path.join(folder, fn))
+  return True
+
+
+def store_cached_code(folder, key, filenames):
+  """Adds generated files to the cache, a failure only loses the cache entry."""
+  cache = os.path.join(CACHE_DIR, key)
+  if os.path.isdir(cache):
+    return
+
+  tmp = None
+  try:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=CACHE_DIR)
+    for fn in filenames:
+      shutil.copyfile(os.path.join(folder, fn), os.path.join(tmp, fn))
+    os.rename(tmp, cache)  # atomic, loses to concurrent generators of the same code
+  except OSError:
+    if tmp is not None:
+      shutil.rmtree(tmp, ignore_errors=True)
+
+
 def load_code(folder, name, lib_name=None):
   if lib_name is None:
     lib_name = name
@@ -39,6 +39,10 @@ EKFSym::EKFSym(std::string name, Map<MatrixXdr> Q, Map<VectorXd> x_initial, Map<
   this->Q = Q;
 
   this->max_rewind_age = max_rewind_age;
+  this->rewind_t.resize(REWIND_TO_KEEP);
+  this->rewind_x.assign(REWIND_TO_KEEP, VectorXd::Zero(this->dim_x));
+  this->rewind_P.assign(REWIND_TO_KEEP, MatrixXdr::Zero(this->dim_err, this->dim_err));
+  this->rewind_obscache.resize(REWIND_TO_KEEP);
   this->init_state(x_initial, P_initial, NAN);
 }
 
@@ -83,17 +87,6 @@ void EKFSym::set_global(std::string global_var, double val) {
 std::optional<Estimate> EKFSym::predict_and_update_batch(double t, int kind, std::vector<Map<VectorXd>> z_map,
     std::vector<Map<MatrixXdr>> R_map, std::vector<std::vector<double>> extra_args, bool augment)
 {
-  // TODO handle rewinding at this level
-
-  std::deque<Observation> rewound;
-  if (!std::isnan(this->filter_time) && t < this->filter_time) {
-    if (this->rewind_t.empty() || t < this->rewind_t.front() || t < this->rewind_t.back() - this->max_rewind_age) {
-      std::cout << "observation too old at " << t << " with filter at " << this->filter_time << ", ignoring" << std::endl;
-      return std::nullopt;
-    }
-    rewound = this->rewind(t);
-  }
-
   Observation obs;
   obs.t = t;
   obs.kind = kind;
@@ -105,54 +98,117 @@ std::optional<Estimate> EKFSym::predict_and_update_batch(double t, int kind, std
     obs.R.push_back(Ri);
   }
 
+  return this->rewind_and_update(obs, augment);
+}
+
+std::optional<Estimate> EKFSym::predict_and_update_batch(double t, int kind, Map<MatrixXdr> z, Map<MatrixXdr> R,
+    Map<MatrixXdr> extra_args, bool augment)
+{
+  int n = z.rows();
+  int dim_z = z.cols();
+  assert(R.rows() == n && R.cols() == dim_z * dim_z);
+  assert(extra_args.rows() == n);
+
+  Observation obs;
+  obs.t = t;
+  obs.kind = kind;
+  obs.z.reserve(n);
+  obs.R.reserve(n);
+  obs.extra_args.reserve(n);
+  for (int i = 0; i < n; i++) {
+    obs.z.push_back(z.row(i).transpose());
+    obs.R.push_back(Map<MatrixXdr>(R.row(i).data(), dim_z, dim_z));
+    obs.extra_args.emplace_back(extra_args.row(i).data(), extra_args.row(i).data() + extra_args.cols());
+  }
+
+  return this->rewind_and_update(obs, augment);
+}
+
+std::optional<Estimate> EKFSym::rewind_and_update(Observation& obs, bool augment) {
+  // TODO handle rewinding at this level
+
+  std::vector<Observation> rewound;
+  if (!std::isnan(this->filter_time) && obs.t < this->filter_time) {
+    if (this->rewind_count == 0 || obs.t < this->rewind_t[this->rewind_idx(0)] ||
+        obs.t < this->rewind_t[this->rewind_idx(this->rewind_count - 1)] - this->max_rewind_age) {
+      std::cout << "observation too old at " << obs.t << " with filter at " << this->filter_time << ", ignoring" << std::endl;
+      return std::nullopt;
+    }
+    rewound = this->rewind(obs.t);
+  }
+
   std::optional<Estimate> res = std::make_optional(this->predict_and_update_batch(obs, augment));
 
   // optional fast forward
-  while (!rewound.empty()) {
-    this->predict_and_update_batch(rewound.front(), false);
-    rewound.pop_front();
+  for (Observation& r : rewound) {
+    this->predict_and_update_batch(r, false);
   }
 
   return res;
 }
 
 void EKFSym::reset_rewind() {
-  this->rewind_obscache.clear();
-  this->rewind_t.clear();
-  this->rewind_states.clear();
+  // slots are kept allocated and overwritten by later checkpoints
+  this->rewind_start = 0;
+  this->rewind_count = 0;
 }
 
-std::deque<Observation> EKFSym::rewind(double t) {
-  std::deque<Observation> rewound;
+int EKFSym::rewind_idx(int i) {
+  return (this->rewind_start + i) % REWIND_TO_KEEP;
+}
 
-  // rewind observations until t is after previous observation
-  while (this->rewind_t.back() > t) {
-    rewound.push_front(this->rewind_obscache.back());
-    this->rewind_t.pop_back();
-    this->rewind_states.pop_back();
-    this->rewind_obscache.pop_back();
+int EKFSym::rewind_bisect_right(double t) {
+  // number of checkpoints with a time <= t
+  int lo = 0, hi = this->rewind_count;
+  while (lo < hi) {
+    int mid = (lo + hi) / 2;
+    if (t < this->rewind_t[this->rewind_idx(mid)]) {
+      hi = mid;
+    } else {
+      lo = mid + 1;
+    }
   }
+  return lo;
+}
+
+std::vector<Observation> EKFSym::rewind(double t) {
+  // find the last checkpoint before t
+  int n = this->rewind_bisect_right(t);
+  assert(n > 0 && n < this->rewind_count);
+
+  // the observations after it are rewound and returned for fast forwarding
+  std::vector<Observation> rewound;
+  rewound.reserve(this->rewind_count - n);
+  for (int i = n; i < this->rewind_count; i++) {
+    rewound.push_back(std::move(this->rewind_obscache[this->rewind_idx(i)]));
+  }
+  this->rewind_count = n;
 
   // set the state to the time right before that
-  this->filter_time = this->rewind_t.back();
-  this->x = this->rewind_states.back().first;
-  this->P = this->rewind_states.back().second;
+  int idx = this->rewind_idx(n - 1);
+  this->filter_time = this->rewind_t[idx];
+  this->x = this->rewind_x[idx];
+  this->P = this->rewind_P[idx];
 
   return rewound;
 }
 
 void EKFSym::checkpoint(Observation& obs) {
-  // push to rewinder
-  this->rewind_t.push_back(this->filter_time);
-  this->rewind_states.push_back(std::make_pair(this->x, this->P));
-  this->rewind_obscache.push_back(obs);
-
-  // only keep a certain number around
-  if (this->rewind_t.size() > REWIND_TO_KEEP) {
-    this->rewind_t.pop_front();
-    this->rewind_states.pop_front();
-    this->rewind_obscache.pop_front();
+  // push to rewinder, overwriting the oldest checkpoint once full
+  int idx;
+  if (this->rewind_count == REWIND_TO_KEEP) {
+    idx = this->rewind_start;
+    this->rewind_start = (this->rewind_start + 1) % REWIND_TO_KEEP;
+  } else {
+    idx = this->rewind_idx(this->rewind_count);
+    this->rewind_count++;
   }
+
+  // assignment into the preallocated slots doesn't reallocate
+  this->rewind_t[idx] = this->filter_time;
+  this->rewind_x[idx] = this->x;
+  this->rewind_P[idx] = this->P;
+  this->rewind_obscache[idx] = obs;
 }
 
 Estimate EKFSym::predict_and_update_batch(Observation& obs, bool augment) {
@@ -171,6 +227,7 @@ Estimate EKFSym::predict_and_update_batch(Observation& obs, bool augment) {
 
   // update batch
   std::vector<VectorXd> y;
+  y.reserve(obs.z.size());
   for (int i = 0; i < obs.z.size(); i++) {
     assert(obs.z[i].rows() == obs.R[i].rows());
     assert(obs.z[i].rows() == obs.R[i].cols());
@@ -208,7 +265,8 @@ void EKFSym::predict(double t) {
   this->filter_time = t;
 }
 
-VectorXd EKFSym::update(int kind, VectorXd z, MatrixXdr R, std::vector<double> extra_args) {
+VectorXd EKFSym::update(int kind, VectorXd z, MatrixXdr& R, std::vector<double>& extra_args) {
+  // z is a copy, the generated update overwrites it with the residual
   this->ekf->updates.at(kind)(this->x.data(), this->P.data(), z.data(), R.data(), extra_args.data());
   this->normalize_quaternions();
 
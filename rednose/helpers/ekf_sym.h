@@ -61,15 +61,21 @@ public:
   void predict(double t);
   std::optional<Estimate> predict_and_update_batch(double t, int kind, std::vector<Eigen::Map<Eigen::VectorXd>> z,
       std::vector<Eigen::Map<MatrixXdr>> R, std::vector<std::vector<double>> extra_args = {{}}, bool augment = false);
+  // batched variant, row i of z (n x dim_z), R (n x dim_z * dim_z) and extra_args (n x dim_ea) is observation i
+  std::optional<Estimate> predict_and_update_batch(double t, int kind, Eigen::Map<MatrixXdr> z, Eigen::Map<MatrixXdr> R,
+      Eigen::Map<MatrixXdr> extra_args, bool augment = false);
 
   extra_routine_t get_extra_routine(const std::string& routine);
 
 private:
-  std::deque<Observation> rewind(double t);
+  std::vector<Observation> rewind(double t);
   void checkpoint(Observation& obs);
+  int rewind_idx(int i);
+  int rewind_bisect_right(double t);
 
+  std::optional<Estimate> rewind_and_update(Observation& obs, bool augment);
   Estimate predict_and_update_batch(Observation& obs, bool augment);
-  Eigen::VectorXd update(int kind, Eigen::VectorXd z, MatrixXdr R, std::vector<double> extra_args);
+  Eigen::VectorXd update(int kind, Eigen::VectorXd z, MatrixXdr& R, std::vector<double>& extra_args);
 
   // stuct with linked sympy generated functions
   const EKF *ekf = NULL;
@@ -98,11 +104,14 @@ private:
   // process noise
   MatrixXdr Q;
 
-  // rewind stuff
+  // rewind stuff, a ring buffer of the last REWIND_TO_KEEP checkpoints
   double max_rewind_age;
-  std::deque<double> rewind_t;
-  std::deque<std::pair<Eigen::VectorXd, MatrixXdr>> rewind_states;
-  std::deque<Observation> rewind_obscache;
+  std::vector<double> rewind_t;
+  std::vector<Eigen::VectorXd> rewind_x;
+  std::vector<MatrixXdr> rewind_P;
+  std::vector<Observation> rewind_obscache;
+  int rewind_start;
+  int rewind_count;
 
   Eigen::VectorXd augment_times;
 
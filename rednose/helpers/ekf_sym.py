@@ -1,13 +1,14 @@
 import os
+import inspect
 import logging
-from bisect import bisect_right
 
 import numpy as np
 import sympy as sp
 from numpy import dot
 
+from rednose.helpers import sympy_helpers
 from rednose.helpers.sympy_helpers import sympy_into_c
-from rednose.helpers import TEMPLATE_DIR, load_code
+from rednose.helpers import TEMPLATE_DIR, code_hash, load_cached_code, load_code, store_cached_code
 from rednose.helpers.chi2_lookup import chi2_ppf
 
 
@@ -26,6 +27,13 @@ def null(H, eps=1e-12):
   return np.transpose(null_space)
 
 
+def maha_distances(y, S):
+  """Squared mahalanobis distances of innovations y (n, dim) with covariances S (n, dim, dim), through their cholesky factors."""
+  L = np.linalg.cholesky(S)
+  w = np.linalg.solve(L, y[:, :, None])
+  return np.sum(w[:, :, 0]**2, axis=1)
+
+
 def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params=None, msckf_params=None,  # pylint: disable=dangerous-default-value
              maha_test_kinds=[], quaternion_idxs=[], global_vars=None, extra_routines=[]):
   # optional state transition matrix, H modifier
@@ -33,6 +41,15 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
   # is desired. Best described in "Quaternion kinematics
   # for the error-state Kalman filter" by Joan Sola
 
+  # generation takes seconds, reuse the code generated earlier from the same model and generator
+  filenames = [f"{name}.h", f"{name}.cpp"]
+  template = open(os.path.join(TEMPLATE_DIR, "ekf_c.c")).read()
+  key = code_hash(name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_params, msckf_params, maha_test_kinds,
+                  quaternion_idxs, global_vars, extra_routines, template, inspect.getsource(gen_code),
+                  inspect.getsource(sympy_helpers))
+  if load_cached_code(folder, key, filenames):
+    return
+
   if eskf_params:
     err_eqs = eskf_params[0]
     inv_err_eqs = eskf_params[1]
@@ -204,7 +221,7 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
 
   # merge code blocks
   header += "}"
-  code = "\n".join([pre_code, code, open(os.path.join(TEMPLATE_DIR, "ekf_c.c")).read(), post_code])
+  code = "\n".join([pre_code, code, template, post_code])
 
   # write to file
   if not os.path.exists(folder):
@@ -212,6 +229,85 @@ def gen_code(folder, name, f_sym, dt_sym, x_sym, obs_eqs, dim_x, dim_err, eskf_p
 
   open(os.path.join(folder, f"{name}.h"), 'w').write(header)  # header is used for ffi import
   open(os.path.join(folder, f"{name}.cpp"), 'w').write(code)
+  store_cached_code(folder, key, filenames)
+
+
+REWIND_TO_KEEP = 512
+
+
+class RewindBuffer():
+  """Ring buffer of the last size filter checkpoints, preallocated so checkpointing doesn't allocate.
+
+     Checkpoints are pushed in time order, the oldest is overwritten once the buffer is full.
+  """
+  def __init__(self, size, dim_x, dim_err):
+    self.size = size
+    self.t = np.zeros(size)
+    self.x = np.zeros((size, dim_x, 1))
+    self.P = np.zeros((size, dim_err, dim_err))
+    self.obs = [None] * size
+    self.start = 0
+    self.count = 0
+
+  def __len__(self):
+    return self.count
+
+  def _idx(self, i):
+    return (self.start + i) % self.size
+
+  def first_t(self):
+    return self.t[self.start]
+
+  def last_t(self):
+    return self.t[self._idx(self.count - 1)]
+
+  def get_t(self, i):
+    return self.t[self._idx(i)]
+
+  def push(self, t, x, P, obs):
+    if self.count == self.size:
+      i = self.start
+      self.start = (self.start + 1) % self.size
+    else:
+      i = self._idx(self.count)
+      self.count += 1
+    self.t[i] = t
+    self.x[i] = x
+    self.P[i] = P
+    self.obs[i] = obs
+
+  def bisect_right(self, t):
+    """Number of checkpoints with a time <= t."""
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if t < self.t[self._idx(mid)]:
+        hi = mid
+      else:
+        lo = mid + 1
+    return lo
+
+  def restore(self, i, x, P):
+    """Copies checkpoint i into x and P and returns its time."""
+    i = self._idx(i)
+    x[:] = self.x[i]
+    P[:] = self.P[i]
+    return self.t[i]
+
+  def truncate(self, n):
+    """Drops all but the first n checkpoints and returns the dropped observations in order."""
+    dropped = []
+    for j in range(n, self.count):
+      i = self._idx(j)
+      dropped.append(self.obs[i])
+      self.obs[i] = None
+    self.count = n
+    return dropped
+
+  def clear(self):
+    self.obs = [None] * self.size
+    self.start = 0
+    self.count = 0
 
 
 class EKF_sym():
@@ -247,9 +343,7 @@ class EKF_sym():
 
     # rewind stuff
     self.max_rewind_age = max_rewind_age
-    self.rewind_t = []
-    self.rewind_states = []
-    self.rewind_obscache = []
+    self.rewind_buf = RewindBuffer(REWIND_TO_KEEP, self.dim_x, self.dim_err)
     self.init_state(x_initial, P_initial, None)
 
     ffi, lib = load_code(folder, name, "kf")
@@ -350,14 +444,10 @@ class EKF_sym():
     self.P = np.array(covs).astype(np.float64)
     self.filter_time = filter_time
     self.augment_times = [0] * self.N
-    self.rewind_obscache = []
-    self.rewind_t = []
-    self.rewind_states = []
+    self.rewind_buf.clear()
 
   def reset_rewind(self):
-    self.rewind_obscache = []
-    self.rewind_t = []
-    self.rewind_states = []
+    self.rewind_buf.clear()
 
   def augment(self):
     # TODO this is not a generalized way of doing this and implies that the augmented states
@@ -414,37 +504,19 @@ class EKF_sym():
 
   def rewind(self, t):
     # find where we are rewinding to
-    idx = bisect_right(self.rewind_t, t)
-    assert self.rewind_t[idx - 1] <= t
-    assert self.rewind_t[idx] > t    # must be true, or rewind wouldn't be called
+    idx = self.rewind_buf.bisect_right(t)
+    assert idx > 0 and self.rewind_buf.get_t(idx - 1) <= t
+    assert idx < len(self.rewind_buf)    # must be true, or rewind wouldn't be called
 
     # set the state to the time right before that
-    self.filter_time = self.rewind_t[idx - 1]
-    self.x[:] = self.rewind_states[idx - 1][0]
-    self.P[:] = self.rewind_states[idx - 1][1]
-
-    # return the observations we rewound over for fast forwarding
-    ret = self.rewind_obscache[idx:]
+    self.filter_time = self.rewind_buf.restore(idx - 1, self.x, self.P)
 
-    # throw away the old future
-    # TODO: is this making a copy?
-    self.rewind_t = self.rewind_t[:idx]
-    self.rewind_states = self.rewind_states[:idx]
-    self.rewind_obscache = self.rewind_obscache[:idx]
-
-    return ret
+    # throw away the old future and return the observations we rewound over for fast forwarding
+    return self.rewind_buf.truncate(idx)
 
   def checkpoint(self, obs):
-    # push to rewinder
-    self.rewind_t.append(self.filter_time)
-    self.rewind_states.append((np.copy(self.x), np.copy(self.P)))
-    self.rewind_obscache.append(obs)
-
-    # only keep a certain number around
-    REWIND_TO_KEEP = 512
-    self.rewind_t = self.rewind_t[-REWIND_TO_KEEP:]
-    self.rewind_states = self.rewind_states[-REWIND_TO_KEEP:]
-    self.rewind_obscache = self.rewind_obscache[-REWIND_TO_KEEP:]
+    # push to rewinder, only the last REWIND_TO_KEEP are kept around
+    self.rewind_buf.push(self.filter_time, self.x, self.P, obs)
 
   def predict(self, t):
     # initialize time
@@ -463,7 +535,8 @@ class EKF_sym():
 
     # rewind
     if self.filter_time is not None and t < self.filter_time:
-      if len(self.rewind_t) == 0 or t < self.rewind_t[0] or t < self.rewind_t[-1] - self.max_rewind_age:
+      buf = self.rewind_buf
+      if len(buf) == 0 or t < buf.first_t() or t < buf.last_t() - self.max_rewind_age:
         self.logger.error("observation too old at %.3f with filter at %.3f, ignoring" % (t, self.filter_time))
         return None
       rewound = self.rewind(t)
@@ -490,6 +563,9 @@ class EKF_sym():
       z         (vec [n,dim_z]): Measurements
       R  (mat [n,dim_z, dim_z]): Measurement Noise
       extra_args    (list, [n]): Values used in H computations
+    Returns:
+      xk_km1, xk_k, Pk_km1, Pk_k, t, kind, y, z, extra_args with y the list of the n innovations,
+      the same as the C++ EKF_sym
     """
     assert z.shape[0] == R.shape[0]
     assert z.shape[1] == R.shape[1]
@@ -596,8 +672,7 @@ class EKF_sym():
     # currently just runs on msckf observations
     # could run on anything if needed
     if self.msckf and kind in self.maha_test_kinds:
-      a = np.linalg.inv(H.dot(P).dot(H.T) + R)
-      maha_dist = y.T.dot(a.dot(y))
+      maha_dist = maha_distances(y.T, (H.dot(P).dot(H.T) + R)[None])[0]
       if maha_dist > chi2_ppf(0.95, y.shape[0]):
         R = 10e16 * R
 
@@ -621,29 +696,37 @@ class EKF_sym():
     return x_new, P, y.flatten()
 
   def maha_test(self, x, P, kind, z, R, extra_args=[], maha_thresh=0.95):  # pylint: disable=dangerous-default-value
-    # init vars
-    z = z.reshape((-1, 1))
-    h = np.zeros(z.shape, dtype=np.float64)
-    H = np.zeros((z.shape[0], self.dim_x), dtype=np.float64)
+    z = z.reshape((1, -1))
+    return bool(self.maha_test_batch(x, P, kind, z, R.reshape((1, z.shape[1], z.shape[1])), [extra_args], maha_thresh)[0])
 
-    # C functions
-    self.hs[kind](x, extra_args, h)
-    self.Hs[kind](x, extra_args, H)
+  def maha_test_batch(self, x, P, kind, z, R, extra_args=None, maha_thresh=0.95):
+    """Mahalanobis gating of n candidate observations of kind at state x, P.
+
+       z is (n, dim_z) and R (n, dim_z, dim_z), returns a boolean mask of the observations that pass.
+    """
+    z = np.asarray(z, dtype=np.float64)
+    n, dim_z = z.shape
+    if extra_args is None:
+      extra_args = [[]] * n
+
+    # C functions, h and H are only defined per observation
+    h = np.zeros((n, dim_z, 1), dtype=np.float64)
+    H = np.zeros((n, dim_z, self.dim_x), dtype=np.float64)
+    for i, ea in enumerate(extra_args):
+      ea = np.asarray(ea, dtype=np.float64)
+      self.hs[kind](x, ea, h[i])
+      self.Hs[kind](x, ea, H[i])
 
     # y is the "loss"
-    y = z - h
+    y = z - h[:, :, 0]
 
     # if using eskf
     H_mod = np.zeros((x.shape[0], P.shape[0]), dtype=np.float64)
     self.H_mod(x, H_mod)
-    H = H.dot(H_mod)
+    H = np.matmul(H, H_mod)
 
-    a = np.linalg.inv(H.dot(P).dot(H.T) + R)
-    maha_dist = y.T.dot(a.dot(y))
-    if maha_dist > chi2_ppf(maha_thresh, y.shape[0]):
-      return False
-    else:
-      return True
+    S = np.matmul(np.matmul(H, P), H.transpose(0, 2, 1)) + R
+    return maha_distances(y, S) <= chi2_ppf(maha_thresh, dim_z)
 
   def rts_smooth(self, estimates, norm_quats=False):
     '''
@@ -652,36 +735,37 @@ class EKF_sym():
     If the kalman state is augmented with
     old states only the main state is smoothed
     '''
-    xk_n = estimates[-1][0]
-    Pk_n = estimates[-1][2]
-    Fk_1 = np.zeros(Pk_n.shape, dtype=np.float64)
+    xk1_k = np.array([e[0] for e in estimates], dtype=np.float64)
+    xk_k = np.array([e[1] for e in estimates], dtype=np.float64)
+    Pk1_k = np.array([e[2] for e in estimates], dtype=np.float64)
+    Pk_k = np.array([e[3] for e in estimates], dtype=np.float64)
+    dts = np.diff([e[4] for e in estimates])
+    d1 = self.dim_main
+    d2 = self.dim_main_err
 
-    states_smoothed = [xk_n]
-    covs_smoothed = [Pk_n]
+    # the smoother gains only depend on the filtered estimates, so they are all solved for at once
+    Fk_1 = np.zeros((len(dts), self.dim_err, self.dim_err), dtype=np.float64)
+    for k, dt in enumerate(dts):
+      self.F(xk_k[k], dt, Fk_1[k])
+    PFT = np.matmul(Fk_1[:, :d2, :d2], Pk_k[:-1, :d2, :d2].transpose(0, 2, 1))
+    C = np.linalg.solve(Pk1_k[1:, :d2, :d2], PFT).transpose(0, 2, 1)
+
+    # seeded with the last predicted estimate, like the per step smoother this replaced
+    states_smoothed = xk_k.copy()
+    covs_smoothed = Pk_k.copy()
+    states_smoothed[-1] = xk1_k[-1]
+    covs_smoothed[-1] = Pk1_k[-1]
+    delta_x = np.zeros((self.dim_err, 1), dtype=np.float64)
+    x_new = np.zeros((self.dim_x, 1), dtype=np.float64)
     for k in range(len(estimates) - 2, -1, -1):
-      xk1_n = xk_n
+      xk1_n = states_smoothed[k + 1]
       if norm_quats:
         xk1_n[3:7] /= np.linalg.norm(xk1_n[3:7])
-      Pk1_n = Pk_n
-
-      xk1_k, _, Pk1_k, _, t2, _, _, _, _ = estimates[k + 1]
-      _, xk_k, _, Pk_k, t1, _, _, _, _ = estimates[k]
-      dt = t2 - t1
-      self.F(xk_k, dt, Fk_1)
-
-      d1 = self.dim_main
-      d2 = self.dim_main_err
-      Ck = np.linalg.solve(Pk1_k[:d2, :d2], Fk_1[:d2, :d2].dot(Pk_k[:d2, :d2].T)).T
-      xk_n = xk_k
-      delta_x = np.zeros((Pk_n.shape[0], 1), dtype=np.float64)
-      self.inv_err_function(xk1_k, xk1_n, delta_x)
-      delta_x[:d2] = Ck.dot(delta_x[:d2])
-      x_new = np.zeros((xk_n.shape[0], 1), dtype=np.float64)
-      self.err_function(xk_k, delta_x, x_new)
-      xk_n[:d1] = x_new[:d1, 0]
-      Pk_n = Pk_k
-      Pk_n[:d2, :d2] = Pk_k[:d2, :d2] + Ck.dot(Pk1_n[:d2, :d2] - Pk1_k[:d2, :d2]).dot(Ck.T)
-      states_smoothed.append(xk_n)
-      covs_smoothed.append(Pk_n)
-
-    return np.flipud(np.vstack(states_smoothed)), np.stack(covs_smoothed, 0)[::-1]
+
+      self.inv_err_function(xk1_k[k + 1], xk1_n, delta_x)
+      delta_x[:d2] = C[k].dot(delta_x[:d2])
+      self.err_function(xk_k[k], delta_x, x_new)
+      states_smoothed[k, :d1] = x_new[:d1, 0]
+      covs_smoothed[k, :d2, :d2] += C[k].dot(covs_smoothed[k + 1, :d2, :d2] - Pk1_k[k + 1, :d2, :d2]).dot(C[k].T)
+
+    return states_smoothed, covs_smoothed
@@ -7,6 +7,7 @@ cimport cython
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp cimport bool
+from libc.string cimport memcpy
 cimport numpy as np
 
 import numpy as np
@@ -62,6 +63,8 @@ cdef extern from "rednose/helpers/ekf_sym.h" namespace "EKFS":
     void predict(double t)
     optional[Estimate] predict_and_update_batch(double t, int kind, vector[MapVectorXd] z, vector[MapMatrixXdr] z,
         vector[vector[double]] extra_args, bool augment)
+    optional[Estimate] predict_and_update_batch(double t, int kind, MapMatrixXdr z, MapMatrixXdr R,
+        MapMatrixXdr extra_args, bool augment)
 
 # Functions like `numpy_to_matrix` are not possible, cython requires default
 # constructor for return variable types which aren't available with Eigen::Map
@@ -78,6 +81,15 @@ cdef np.ndarray[np.float64_t, ndim=1, mode="c"] vector_to_numpy(VectorXd arr):
   cdef double[:] mem_view = <double[:arr.rows()]>arr.data()
   return np.copy(np.asarray(mem_view, dtype=np.double, order="C"))
 
+@cython.wraparound(False)
+@cython.boundscheck(False)
+cdef np.ndarray[np.float64_t, ndim=2, mode="c"] vectors_to_numpy(vector[VectorXd]& vecs, int cols):
+  cdef np.ndarray[np.float64_t, ndim=2, mode="c"] res = np.empty((vecs.size(), cols), dtype=np.double)
+  cdef size_t i
+  for i in range(vecs.size()):
+    memcpy(&res[i, 0], vecs[i].data(), cols * sizeof(double))
+  return res
+
 cdef class EKF_sym:
   cdef EKFSym* ekf
   def __cinit__(self, str gen_dir, str name, np.ndarray[np.float64_t, ndim=2] Q,
@@ -137,17 +149,58 @@ cdef class EKF_sym:
     self.ekf.predict(t)
 
   def predict_and_update_batch(self, double t, int kind, z, R, extra_args=[[]], bool augment=False):
+    """Observations of one kind are passed to the filter in a single call when they stack into arrays,
+       ragged observations go one by one. Either way y is a list of the n innovations, like EKF_sym in python.
+    """
+    cdef np.ndarray[np.float64_t, ndim=2, mode='c'] z_b
+    cdef np.ndarray[np.float64_t, ndim=3, mode='c'] R_b
+    cdef np.ndarray[np.float64_t, ndim=2, mode='c'] extra_args_b
+    try:
+      z_b = np.ascontiguousarray(z, dtype=np.double)
+      R_b = np.ascontiguousarray(R, dtype=np.double)
+      extra_args_b = np.ascontiguousarray(extra_args, dtype=np.double)
+    except ValueError:
+      return self._predict_and_update_lists(t, kind, z, R, extra_args, augment)
+
+    cdef int n = z_b.shape[0], dim_z = z_b.shape[1]
+    if n == 0 or R_b.shape[0] != n or R_b.shape[1] != dim_z or R_b.shape[2] != dim_z or extra_args_b.shape[0] != n:
+      return self._predict_and_update_lists(t, kind, z, R, extra_args, augment)
+
+    cdef optional[Estimate] res = self.ekf.predict_and_update_batch(
+      t,
+      kind,
+      MapMatrixXdr(<double*> z_b.data, n, dim_z),
+      MapMatrixXdr(<double*> R_b.data, n, dim_z * dim_z),
+      MapMatrixXdr(<double*> extra_args_b.data, n, extra_args_b.shape[1]),
+      augment
+    )
+    if not res.has_value():
+      return None
+
+    return (
+      vector_to_numpy(res.value().xk1),
+      vector_to_numpy(res.value().xk),
+      matrix_to_numpy(res.value().Pk1),
+      matrix_to_numpy(res.value().Pk),
+      res.value().t,
+      res.value().kind,
+      list(vectors_to_numpy(res.value().y, res.value().y[0].rows())),
+      z,  # TODO: take return values?
+      extra_args,
+    )
+
+  def _predict_and_update_lists(self, double t, int kind, z, R, extra_args, bool augment):
     cdef vector[MapVectorXd] z_map
     cdef np.ndarray[np.float64_t, ndim=1, mode='c'] zi_b
-    for zi in z:
-      zi_b = np.ascontiguousarray(zi, dtype=np.double)
-      z_map.push_back(MapVectorXd(<double*> zi_b.data, zi.shape[0]))
+    z_bufs = [np.ascontiguousarray(zi, dtype=np.double) for zi in z]
+    for zi_b in z_bufs:
+      z_map.push_back(MapVectorXd(<double*> zi_b.data, zi_b.shape[0]))
 
     cdef vector[MapMatrixXdr] R_map
     cdef np.ndarray[np.float64_t, ndim=2, mode='c'] Ri_b
-    for Ri in R:
-      Ri_b = np.ascontiguousarray(Ri, dtype=np.double)
-      R_map.push_back(MapMatrixXdr(<double*> Ri_b.data, Ri.shape[0], Ri.shape[1]))
+    R_bufs = [np.ascontiguousarray(Ri, dtype=np.double) for Ri in R]
+    for Ri_b in R_bufs:
+      R_map.push_back(MapMatrixXdr(<double*> Ri_b.data, Ri_b.shape[0], Ri_b.shape[1]))
 
     cdef vector[vector[double]] extra_args_map
     cdef vector[double] args_map
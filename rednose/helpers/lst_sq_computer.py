@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
+import inspect
 import os
 import sys
 
 import numpy as np
 import sympy as sp
 
-from rednose.helpers import TEMPLATE_DIR, load_code, write_code
+from rednose.helpers import sympy_helpers
+from rednose.helpers import TEMPLATE_DIR, code_hash, load_cached_code, load_code, store_cached_code, write_code
 from rednose.helpers.sympy_helpers import quat_rotate, sympy_into_c, rot_matrix, rotations_from_quats
 
 
@@ -47,6 +49,14 @@ class LstSqComputer():
 
   @staticmethod
   def generate_code(generated_dir, K=4):
+    filename = f"{LstSqComputer.name}_{K}"
+    filenames = [f"{filename}.h", f"{filename}.cpp"]
+    template = open(os.path.join(TEMPLATE_DIR, "compute_pos.c")).read()
+    key = code_hash(filename, template, inspect.getsource(generate_residual), inspect.getsource(LstSqComputer.generate_code),
+                    inspect.getsource(sympy_helpers))
+    if load_cached_code(generated_dir, key, filenames):
+      return
+
     sympy_functions = generate_residual(K)
     header, sympy_code = sympy_into_c(sympy_functions)
 
@@ -54,13 +64,13 @@ class LstSqComputer():
     code += "\n#define KDIM %d\n" % K
     code += "extern \"C\" {\n"
     code += sympy_code
-    code += "\n" + open(os.path.join(TEMPLATE_DIR, "compute_pos.c")).read() + "\n"
+    code += "\n" + template + "\n"
     code += "}\n"
 
     header += "\nvoid compute_pos(double *to_c, double *in_poses, double *in_img_positions, double *param, double *pos);\n"
 
-    filename = f"{LstSqComputer.name}_{K}"
     write_code(generated_dir, filename, code, header)
+    store_cached_code(generated_dir, key, filenames)
 
   def __init__(self, generated_dir, K=4, MIN_DEPTH=2, MAX_DEPTH=500):
     self.to_c = rot_matrix(-np.pi / 2, -np.pi / 2, 0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import bz2
+import math
+import numbers
+import sys
+from collections import Counter
+
+from tools.lib.logreader import LogReader
+
+EPSILON = sys.float_info.epsilon
+
+
+def save_log(dest, log_msgs, compress=True):
+  dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
+
+  if compress:
+    dat = bz2.compress(dat)
+
+  with open(dest, "wb") as f:
+    f.write(dat)
+
+
+def remove_ignored_fields(msg, ignore):
+  msg = msg.as_builder()
+  for key in ignore:
+    attr = msg
+    keys = key.split(".")
+    if msg.which() != keys[0] and len(keys) > 1:
+      continue
+
+    for k in keys[:-1]:
+      try:
+        attr = getattr(attr, k)
+      except AttributeError:
+        break
+    else:
+      v = getattr(attr, keys[-1])
+      if isinstance(v, bool):
+        val = False
+      elif isinstance(v, numbers.Number):
+        val = 0
+      else:
+        raise NotImplementedError
+      setattr(attr, keys[-1], val)
+  return msg.as_reader()
+
+
+def diff_dicts(a, b, path=()):
+  """Yields (path, a, b) for every leaf that differs between two nested dicts/lists."""
+  if isinstance(a, dict) and isinstance(b, dict):
+    for k in sorted(a.keys() | b.keys()):
+      yield from diff_dicts(a.get(k), b.get(k), path + (k,))
+  elif isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+    for i, (x, y) in enumerate(zip(a, b)):
+      yield from diff_dicts(x, y, path + (i,))
+  elif a != b:
+    yield path, a, b
+
+
+def within_tolerance(a, b, tolerance):
+  if isinstance(a, bool) or isinstance(b, bool):
+    return False
+  if not isinstance(a, numbers.Number) or not isinstance(b, numbers.Number):
+    return False
+  if not (math.isfinite(a) and math.isfinite(b)):
+    return False
+  return abs(a - b) <= max(tolerance, tolerance * max(abs(a), abs(b)))
+
+
+def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None):
+  """Returns the differences between two logs as (field, value1, value2), numbers within tolerance are equal."""
+  if ignore_fields is None:
+    ignore_fields = []
+  if ignore_msgs is None:
+    ignore_msgs = []
+  tolerance = EPSILON if tolerance is None else tolerance
+
+  log1, log2 = [[m for m in log if m.which() not in ignore_msgs] for log in (log1, log2)]
+
+  if len(log1) != len(log2):
+    cnt1 = Counter(m.which() for m in log1)
+    cnt2 = Counter(m.which() for m in log2)
+    raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
+
+  diff = []
+  for msg1, msg2 in zip(log1, log2):
+    if msg1.which() != msg2.which():
+      raise Exception(f"msgs not aligned between logs: {msg1.which()} VS {msg2.which()}\n\t\t{msg1}\n\t\t{msg2}")
+
+    msg1 = remove_ignored_fields(msg1, ignore_fields)
+    msg2 = remove_ignored_fields(msg2, ignore_fields)
+
+    if msg1.as_builder().to_bytes() != msg2.as_builder().to_bytes():
+      for path, a, b in diff_dicts(msg1.to_dict(verbose=True), msg2.to_dict(verbose=True)):
+        if not within_tolerance(a, b, tolerance):
+          diff.append((".".join(str(p) for p in path), a, b))
+  return diff
+
+
+if __name__ == "__main__":
+  log1 = list(LogReader(sys.argv[1]))
+  log2 = list(LogReader(sys.argv[2]))
+  print(compare_logs(log1, log2, sys.argv[3:]))
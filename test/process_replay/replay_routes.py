@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from collections import Counter
+
+# process_replay is only imported in the workers, after they have been given their own HOME and therefore params
+PROCESS_REPLAY_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("PROCESS_REPLAY_CACHE", os.path.join(PROCESS_REPLAY_DIR, "cache"))
+JOB_TIMEOUT = 30 * 60
+
+
+def init_worker():
+  # every replay clears and writes params, so each worker gets a private params directory
+  home = tempfile.mkdtemp(prefix="process_replay_")
+  os.environ["HOME"] = home
+  multiprocessing.util.Finalize(None, shutil.rmtree, args=(home, True), exitpriority=0)
+
+
+def cached_segment(segment, cache_dir):
+  """Downloads the rlog of a segment once, later jobs on the same segment read the local copy."""
+  from selfdrive.test.process_replay.test_processes import get_segment, segment_id
+  from tools.lib.filereader import FileReader
+
+  fn = get_segment(segment)
+  if os.path.exists(fn):
+    return fn
+
+  path = os.path.join(cache_dir, segment_id(segment) + ".bz2")
+  if not os.path.exists(path):
+    with FileReader(fn) as f:
+      dat = f.read()
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as tmp:
+      tmp.write(dat)
+    os.replace(tmp.name, path)
+  return path
+
+
+def fetch_segment(args):
+  segment, cache_dir = args
+  try:
+    return segment, cached_segment(segment, cache_dir), None
+  except Exception:
+    return segment, None, traceback.format_exc()
+
+
+def run_job(args):
+  """Replays one process on one segment, errors are returned in the result instead of raised."""
+  segment, proc_name, rlog_fn, ref_commit, ignore_fields, ignore_msgs = args
+  result = {"segment": segment, "proc": proc_name, "status": "error"}
+  start_time = time.monotonic()
+  try:
+    from selfdrive.test.process_replay.process_replay import CONFIGS
+    from selfdrive.test.process_replay.test_processes import segment_id, test_process
+    from tools.lib.logreader import LogReader
+
+    cfg = next(cfg for cfg in CONFIGS if cfg.proc_name == proc_name)
+    lr = list(LogReader(rlog_fn))
+    cmp_log_fn = os.path.join(PROCESS_REPLAY_DIR, "%s_%s_%s.bz2" % (segment_id(segment), proc_name, ref_commit))
+    diff, _, stats = test_process(cfg, lr, cmp_log_fn, ignore_fields, ignore_msgs)
+
+    result.update(msgs_in=stats.msgs_in, msgs_out=stats.msgs_out, replay_time=stats.elapsed,
+                  msgs_per_sec=stats.msgs_in / stats.elapsed if stats.elapsed > 0 else None)
+    if isinstance(diff, str):
+      result.update(status="failed", error=diff)
+    else:
+      result.update(status="failed" if len(diff) else "passed", n_diffs=len(diff),
+                    diff_fields=dict(Counter(field for field, _, _ in diff)))
+  except Exception:
+    result["error"] = traceback.format_exc()
+  result["total_time"] = time.monotonic() - start_time
+  return result
+
+
+def summarize(results):
+  """Aggregates job results per process."""
+  summary = {}
+  for r in results:
+    s = summary.setdefault(r["proc"], {"jobs": 0, "passed": 0, "failed": 0, "error": 0, "timeout": 0,
+                                       "msgs_in": 0, "replay_time": 0.})
+    s["jobs"] += 1
+    s[r["status"]] += 1
+    s["msgs_in"] += r.get("msgs_in", 0)
+    s["replay_time"] += r.get("replay_time", 0.)
+
+  for s in summary.values():
+    s["msgs_per_sec"] = s["msgs_in"] / s["replay_time"] if s["replay_time"] > 0 else None
+  return summary
+
+
+def replay_routes(segments, procs, jobs=None, cache_dir=CACHE_DIR, ref_commit=None,
+                  ignore_fields=None, ignore_msgs=None, job_timeout=JOB_TIMEOUT):
+  """Runs every (segment, process) pair on a pool of workers and returns the list of job results."""
+  os.makedirs(cache_dir, exist_ok=True)
+  ignore_fields = [] if ignore_fields is None else ignore_fields
+  ignore_msgs = [] if ignore_msgs is None else ignore_msgs
+
+  # spawned workers so params is loaded after init_worker set HOME, one job per worker
+  # so a crashed or hung replay can't leak into the next one
+  ctx = multiprocessing.get_context("spawn")
+  results = []
+  with ctx.Pool(jobs, initializer=init_worker, maxtasksperchild=1) as pool:
+    rlogs = {}
+    for segment, rlog_fn, error in pool.imap_unordered(fetch_segment, [(s, cache_dir) for s in segments]):
+      if rlog_fn is None:
+        results += [{"segment": segment, "proc": p, "status": "error", "error": error} for p in procs]
+      else:
+        rlogs[segment] = rlog_fn
+
+    pending = []
+    for segment, rlog_fn in rlogs.items():
+      for proc_name in procs:
+        job = (segment, proc_name, rlog_fn, ref_commit, ignore_fields, ignore_msgs)
+        pending.append((segment, proc_name, pool.apply_async(run_job, (job,))))
+
+    deadline = time.monotonic() + job_timeout
+    for segment, proc_name, res in pending:
+      try:
+        results.append(res.get(timeout=max(deadline - time.monotonic(), 0)))
+      except multiprocessing.TimeoutError:
+        results.append({"segment": segment, "proc": proc_name, "status": "timeout"})
+      # jobs run concurrently, so each gets the timeout measured from when its predecessor finished
+      deadline = time.monotonic() + job_timeout
+  return results
+
+
+if __name__ == "__main__":
+  from selfdrive.test.process_replay.process_replay import CONFIGS
+
+  parser = argparse.ArgumentParser(description="Replay processes over many segments in parallel and write a report")
+  parser.add_argument("segments", type=str, nargs="+",
+                      help="Segments (rlog files or route names like dongle|2021-01-01--12-00-00--3) or files listing them")
+  parser.add_argument("--procs", type=str, nargs="*", default=[cfg.proc_name for cfg in CONFIGS],
+                      help="Processes to replay (e.g. controlsd radard)")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes, defaults to the cpu count")
+  parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Where downloaded segments are kept")
+  parser.add_argument("--report", type=str, default=os.path.join(PROCESS_REPLAY_DIR, "report.json"))
+  parser.add_argument("--ignore-fields", type=str, nargs="*", default=[])
+  parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[])
+  parser.add_argument("--timeout", type=float, default=JOB_TIMEOUT, help="Seconds a single job may take")
+  args = parser.parse_args()
+
+  segments = []
+  for s in args.segments:
+    if os.path.isfile(s) and not s.endswith(".bz2"):
+      segments += [line.strip() for line in open(s) if line.strip()]
+    else:
+      segments.append(s)
+
+  ref_commit = open(os.path.join(PROCESS_REPLAY_DIR, "ref_commit")).read().strip()
+
+  start_time = time.monotonic()
+  results = replay_routes(segments, args.procs, args.jobs, args.cache_dir, ref_commit,
+                          args.ignore_fields, args.ignore_msgs, args.timeout)
+  summary = summarize(results)
+
+  report = {
+    "ref_commit": ref_commit,
+    "total_time": time.monotonic() - start_time,
+    "summary": summary,
+    "jobs": sorted(results, key=lambda r: (r["segment"], r["proc"])),
+  }
+  with open(args.report, "w") as f:
+    json.dump(report, f, indent=2)
+
+  print("%-14s %6s %6s %6s %6s %7s %12s" % ("process", "jobs", "passed", "failed", "error", "timeout", "msgs/s"))
+  for proc_name, s in summary.items():
+    rate = "%.1f" % s["msgs_per_sec"] if s["msgs_per_sec"] is not None else "-"
+    print("%-14s %6d %6d %6d %6d %7d %12s" % (proc_name, s["jobs"], s["passed"], s["failed"], s["error"], s["timeout"], rate))
+  print(f"report written to {args.report}")
+
+  sys.exit(int(any(r["status"] != "passed" for r in results)))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from typing import Any
+
+from selfdrive.test.process_replay.compare_logs import compare_logs, save_log
+from selfdrive.test.process_replay.process_replay import CONFIGS, replay_process_with_stats
+from tools.lib.logreader import LogReader
+
+BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
+REF_COMMIT_FN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ref_commit")
+
+
+def get_segment(segment_name):
+  """Returns the rlog of a segment, given as a local file or a route name like dongle|date--time--num."""
+  if os.path.exists(segment_name):
+    return segment_name
+  route_name, segment_num = segment_name.rsplit("--", 1)
+  return BASE_URL + "%s/%s/rlog.bz2" % (route_name.replace("|", "/"), segment_num)
+
+
+def segment_id(segment_name):
+  return os.path.basename(segment_name).split(".")[0].replace("|", "_")
+
+
+def test_process(cfg, lr, cmp_log_fn, ignore_fields=None, ignore_msgs=None):
+  if ignore_fields is None:
+    ignore_fields = []
+  if ignore_msgs is None:
+    ignore_msgs = []
+
+  log_msgs, stats = replay_process_with_stats(cfg, lr)
+
+  # check to make sure openpilot is engaged in the route
+  if cfg.proc_name == "controlsd":
+    for msg in log_msgs:
+      if msg.which() == "controlsState":
+        if msg.controlsState.active:
+          break
+    else:
+      return "Route never enabled", log_msgs, stats
+
+  try:
+    cmp_log_path = cmp_log_fn if os.path.exists(cmp_log_fn) else BASE_URL + os.path.basename(cmp_log_fn)
+    cmp_log_msgs = list(LogReader(cmp_log_path))
+    return compare_logs(cmp_log_msgs, log_msgs, ignore_fields+cfg.ignore, ignore_msgs, cfg.tolerance), log_msgs, stats
+  except Exception as e:
+    return str(e), log_msgs, stats
+
+
+def format_diff(results, ref_commit):
+  diff1, diff2 = "", ""
+  diff2 += "***** tested against commit %s *****\n" % ref_commit
+
+  failed = False
+  for segment, result in list(results.items()):
+    diff1 += "***** results for segment %s *****\n" % segment
+    diff2 += "***** differences for segment %s *****\n" % segment
+
+    for proc, diff in list(result.items()):
+      diff1 += "\t%s\n" % proc
+      diff2 += "*** process: %s ***\n" % proc
+
+      if isinstance(diff, str):
+        diff1 += "\t\t%s\n" % diff
+        failed = True
+      elif len(diff):
+        cnt = {}
+        for field, a, b in diff:
+          diff2 += "\t%s: %s -> %s\n" % (field, a, b)
+          cnt[field] = cnt.get(field, 0) + 1
+
+        diff1 += "\t\t" + "\n\t\t".join(["%s: %d" % (k, v) for k, v in cnt.items()]) + "\n"
+        failed = True
+  return diff1, diff2, failed
+
+
+def format_stats(stats):
+  """Per process throughput of the replay loop, summed over all the tested segments."""
+  totals = {}
+  for s in stats:
+    msgs_in, msgs_out, elapsed = totals.get(s.proc_name, (0, 0, 0.))
+    totals[s.proc_name] = (msgs_in + s.msgs_in, msgs_out + s.msgs_out, elapsed + s.elapsed)
+
+  out = "%-14s %10s %10s %10s %12s\n" % ("process", "msgs in", "msgs out", "time (s)", "msgs/s")
+  for proc_name, (msgs_in, msgs_out, elapsed) in totals.items():
+    rate = msgs_in / elapsed if elapsed > 0 else float("inf")
+    out += "%-14s %10d %10d %10.2f %12.1f\n" % (proc_name, msgs_in, msgs_out, elapsed, rate)
+  return out
+
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description="Regression test to identify changes in a process's output")
+
+  parser.add_argument("segments", type=str, nargs="+",
+                        help="Segments to replay, rlog files or route names (e.g. dongle|2021-01-01--12-00-00--3)")
+  # whitelist has precedence over blacklist in case both are defined
+  parser.add_argument("--whitelist-procs", type=str, nargs="*", default=[],
+                        help="Whitelist given processes from the test (e.g. controlsd)")
+  parser.add_argument("--blacklist-procs", type=str, nargs="*", default=[],
+                        help="Blacklist given processes from the test (e.g. controlsd)")
+  parser.add_argument("--ignore-fields", type=str, nargs="*", default=[],
+                        help="Extra fields or msgs to ignore (e.g. carState.events)")
+  parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[],
+                        help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("--update-refs", action="store_true",
+                        help="Save the replayed logs as the reference logs of the current commit")
+  args = parser.parse_args()
+
+  procs_whitelisted = len(args.whitelist_procs) > 0
+
+  process_replay_dir = os.path.dirname(os.path.abspath(__file__))
+  try:
+    ref_commit = open(REF_COMMIT_FN).read().strip()
+  except FileNotFoundError:
+    print("couldn't find reference commit")
+    sys.exit(1)
+
+  print("***** testing against commit %s *****" % ref_commit)
+
+  results: Any = {}
+  all_stats = []
+  for segment in args.segments:
+    print("***** testing route segment %s *****\n" % segment)
+
+    results[segment] = {}
+
+    rlog_fn = get_segment(segment)
+    lr = list(LogReader(rlog_fn))
+
+    for cfg in CONFIGS:
+      if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
+         (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
+        continue
+
+      cmp_log_fn = os.path.join(process_replay_dir, "%s_%s_%s.bz2" % (segment_id(segment), cfg.proc_name, ref_commit))
+      results[segment][cfg.proc_name], log_msgs, stats = test_process(cfg, lr, cmp_log_fn, args.ignore_fields, args.ignore_msgs)
+      all_stats.append(stats)
+
+      if args.update_refs:
+        save_log(cmp_log_fn, log_msgs)
+
+  diff1, diff2, failed = format_diff(results, ref_commit)
+  with open(os.path.join(process_replay_dir, "diff.txt"), "w") as f:
+    f.write(diff2)
+  print(diff1)
+  print(format_stats(all_stats))
+
+  if failed:
+    print("TEST FAILED")
+    print("\n\nTo push the new reference logs for this commit run:")
+    print("./test_processes.py --update-refs <segments>")
+  else:
+    print("TEST SUCCEEDED")
+
+  sys.exit(int(failed))
@@ -13,3 +13,12 @@ def cache_path_for_file_path(fn, cache_prefix=None):
   else:
     cache_fn = f'{fn_parsed.hostname}_{fn_parsed.path.replace("/", "_")}'
   return os.path.join(dir_, cache_fn)
+
+
+def cache_source_key(fn):
+  """Identifies the version of a file a cache entry was built from, its size and mtime (or remote length)."""
+  if urllib.parse.urlparse(fn).scheme in ("http", "https"):
+    from tools.lib.url_file import URLFile
+    return [URLFile(fn).get_length(), 0]
+  st = os.stat(fn)
+  return [st.st_size, st.st_mtime_ns]
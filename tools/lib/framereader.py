@@ -1,19 +1,18 @@
 # pylint: skip-file
 import json
 import os
-import pickle
 import struct
 import subprocess
 import tempfile
 import threading
-from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from aenum import Enum
-from lru import LRU
 
 import _io
-from tools.lib.cache import cache_path_for_file_path
+from tools.lib.cache import cache_path_for_file_path, cache_source_key
 from tools.lib.exceptions import DataUnreadableError
 from tools.lib.file_helpers import atomic_write_in_dir
 
@@ -26,12 +25,60 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# decoded GOPs kept by each GOPFrameReader, about as many rgb24 frames as the old per frame LRU held.
+# Route readers keep a reader per segment, FRAMEREADER_CACHE_BYTES=<bytes> sets a fixed budget per reader instead.
+GOP_CACHE_FRAMES = 64
+GOP_CACHE_BYTES = int(os.getenv("FRAMEREADER_CACHE_BYTES", "0")) or None
+# number of GOPs decoded concurrently by get_frames, each one runs its own ffmpeg process
+DECODE_WORKERS = int(os.getenv("FRAMEREADER_WORKERS", str(os.cpu_count() or 1)))
+
 
 class GOPReader:
   def get_gop(self, num):
     # returns (start_frame_num, num_frames, frames_to_skip, gop_data)
     raise NotImplementedError
 
+  def get_gop_start(self, num):
+    # returns the number of the first frame of the GOP containing frame num
+    raise NotImplementedError
+
+  def get_gop_end(self, num):
+    # returns the number of the frame after the last frame of the GOP containing frame num
+    raise NotImplementedError
+
+
+class GOPCache:
+  """LRU of decoded GOPs, bounded by the total size of their frames."""
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self._gops = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      frames = self._gops.get(key)
+      if frames is not None:
+        self._gops.move_to_end(key)
+      return frames
+
+  def put(self, key, frames):
+    with self._lock:
+      if key in self._gops:
+        self.nbytes -= self._gops.pop(key).nbytes
+      self._gops[key] = frames
+      self.nbytes += frames.nbytes
+
+      # always keep the most recent GOP, even if it exceeds the budget on its own
+      while self.nbytes > self.max_bytes and len(self._gops) > 1:
+        _, evicted = self._gops.popitem(last=False)
+        self.nbytes -= evicted.nbytes
+
+  def clear(self):
+    with self._lock:
+      self._gops.clear()
+      self.nbytes = 0
+
 
 class DoNothingContextManager:
   def __enter__(self):
@@ -79,11 +126,23 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
-def vidindex(fn, typ):
+_vidindex_built = False
+_vidindex_lock = threading.Lock()
+
+
+def build_vidindex():
+  """Builds the vidindex binary once per process, concurrent callers wait for the first build."""
+  global _vidindex_built
   vidindex_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "vidindex")
-  vidindex = os.path.join(vidindex_dir, "vidindex")
+  with _vidindex_lock:
+    if not _vidindex_built:
+      subprocess.check_call(["make"], cwd=vidindex_dir, stdout=open("/dev/null", "w"))
+      _vidindex_built = True
+  return os.path.join(vidindex_dir, "vidindex")
 
-  subprocess.check_call(["make"], cwd=vidindex_dir, stdout=open("/dev/null", "w"))
+
+def vidindex(fn, typ):
+  vidindex = build_vidindex()
 
   with tempfile.NamedTemporaryFile() as prefix_f, \
        tempfile.NamedTemporaryFile() as index_f:
@@ -104,31 +163,11 @@ def vidindex(fn, typ):
   return index, prefix
 
 
-def cache_fn(func):
-  @wraps(func)
-  def cache_inner(fn, *args, **kwargs):
-    if kwargs.pop('no_cache', None):
-      cache_path = None
-    else:
-      cache_prefix = kwargs.pop('cache_prefix', None)
-      cache_path = cache_path_for_file_path(fn, cache_prefix)
-
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
-
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
-
-    return cache_value
+def gop_starts_for_index(index):
+  # frame numbers of the I frames, the last index entry only marks the end of the file
+  return np.flatnonzero(index[:-1, 0] == HEVC_SLICE_I).astype(np.uint32)
 
-  return cache_inner
 
-
-@cache_fn
 def index_stream(fn, typ):
   assert typ in ("hevc", )
 
@@ -139,46 +178,114 @@ def index_stream(fn, typ):
 
   return {
     'index': index,
+    'gop_starts': gop_starts_for_index(index),
     'global_prefix': prefix,
     'probe': probe
   }
 
 
-def index_videos(camera_paths, cache_prefix=None):
-  """Requires that paths in camera_paths are contiguous and of the same type."""
+# Cached video index layout, all little endian:
+#   magic, version, header length, prefix length
+#   JSON header: probe, source file key and number of index rows and GOPs
+#   global prefix, zero padded to 8 bytes
+#   index: uint32 (frame type, byte offset) per frame plus an end of file row
+#   gop_starts: uint32 frame number of each I frame
+VIDEO_INDEX_MAGIC = b"OPVI"
+VIDEO_INDEX_VERSION = 1
+_VIDEO_INDEX_HEADER = struct.Struct("<4sIII")
+
+
+def write_video_index(path, index_data, source_key):
+  index = np.ascontiguousarray(index_data['index'], dtype=np.uint32)
+  gop_starts = np.ascontiguousarray(index_data['gop_starts'], dtype=np.uint32)
+  prefix = index_data['global_prefix']
+  header = json.dumps({
+    'probe': index_data['probe'],
+    'source': source_key,
+    'frames': index.shape[0],
+    'gops': gop_starts.shape[0],
+  }).encode()
+
+  data_start = _VIDEO_INDEX_HEADER.size + len(header) + len(prefix)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    f.write(_VIDEO_INDEX_HEADER.pack(VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION, len(header), len(prefix)))
+    f.write(header)
+    f.write(prefix)
+    f.write(b"\0" * (-data_start % 8))
+    f.write(index.tobytes())
+    f.write(gop_starts.tobytes())
+
+
+def read_video_index(path, source_key=None):
+  """Memory maps a cached video index, returns None if it is missing, stale or in another format."""
+  try:
+    with open(path, "rb") as f:
+      magic, version, header_len, prefix_len = _VIDEO_INDEX_HEADER.unpack(f.read(_VIDEO_INDEX_HEADER.size))
+      if magic != VIDEO_INDEX_MAGIC or version != VIDEO_INDEX_VERSION:
+        return None
+      header = json.loads(f.read(header_len))
+      prefix = f.read(prefix_len)
+  except (OSError, struct.error, ValueError):
+    return None
+
+  if source_key is not None and header['source'] != source_key:
+    return None
+
+  data_start = _VIDEO_INDEX_HEADER.size + header_len + prefix_len
+  data_start += -data_start % 8
+  n_frames, n_gops = header['frames'], header['gops']
+  if os.path.getsize(path) != data_start + 4 * (2 * n_frames + n_gops):
+    return None
+
+  dat = np.memmap(path, dtype=np.uint32, mode='r', offset=data_start)
+  return {
+    'index': dat[:2 * n_frames].reshape(-1, 2),
+    'gop_starts': dat[2 * n_frames:],
+    'global_prefix': prefix,
+    'probe': header['probe'],
+  }
+
+
+def index_videos(camera_paths, cache_prefix=None, workers=DECODE_WORKERS):
+  """Requires that paths in camera_paths are contiguous and of the same type. Missing segments (None) are skipped."""
+  camera_paths = [fn for fn in camera_paths if fn is not None]
   if len(camera_paths) < 1:
     raise ValueError("must provide at least one video to index")
 
   frame_type = fingerprint_video(camera_paths[0])
-  for fn in camera_paths:
-    index_video(fn, frame_type, cache_prefix)
+  if frame_type == FrameType.h265_stream:
+    # build before starting the pool, so the workers don't all run make in the same directory
+    build_vidindex()
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+    # vidindex and ffprobe run as subprocesses, so threads are enough to index in parallel
+    list(pool.map(lambda fn: index_video(fn, frame_type, cache_prefix), camera_paths))
 
 
 def index_video(fn, frame_type=None, cache_prefix=None):
   cache_path = cache_path_for_file_path(fn, cache_prefix)
+  source_key = cache_source_key(fn)
 
-  if os.path.exists(cache_path):
+  if read_video_index(cache_path, source_key) is not None:
     return
 
   if frame_type is None:
-    frame_type = fingerprint_video(fn[0])
+    frame_type = fingerprint_video(fn)
 
   if frame_type == FrameType.h265_stream:
-    index_stream(fn, "hevc", cache_prefix=cache_prefix)
+    write_video_index(cache_path, index_stream(fn, "hevc"), source_key)
   else:
     raise NotImplementedError("Only h265 supported")
 
 
 def get_video_index(fn, frame_type, cache_prefix=None):
   cache_path = cache_path_for_file_path(fn, cache_prefix)
+  source_key = cache_source_key(fn)
 
-  if not os.path.exists(cache_path):
+  index_data = read_video_index(cache_path, source_key)
+  if index_data is None:
     index_video(fn, frame_type, cache_prefix)
-
-  if not os.path.exists(cache_path):
-    return None
-  with open(cache_path, "rb") as cache_file:
-    return pickle.load(cache_file)
+    index_data = read_video_index(cache_path, source_key)
+  return index_data
 
 
 def read_file_check_size(f, sz, cookie):
@@ -209,7 +316,41 @@ def rgb24toyuv420(rgb):
   return yuv420.clip(0, 255).astype('uint8')
 
 
-def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+def frame_shape(w, h, pix_fmt):
+  if pix_fmt == "rgb24":
+    return (h, w, 3)
+  elif pix_fmt in ("yuv420p", "nv12"):
+    return (h*w*3//2,)
+  elif pix_fmt == "yuv444p":
+    return (3, h, w)
+  else:
+    raise NotImplementedError
+
+
+def frame_buffer(count, w, h, pix_fmt):
+  """Allocates room for count frames, to be reused through the out argument of the readers."""
+  return np.empty((count,) + frame_shape(w, h, pix_fmt), dtype=np.uint8)
+
+
+def check_frame_buffer(out, count, w, h, pix_fmt):
+  shape = frame_shape(w, h, pix_fmt)
+  if out.dtype != np.uint8 or out.shape[1:] != shape or out.shape[0] < count:
+    raise ValueError("out must be a uint8 buffer of at least %d frames of shape %r, got %s %r" % (count, shape, out.dtype, out.shape))
+
+
+def readinto_full(f, buf):
+  """Reads into buf until it is full or the stream ends, returns the number of bytes read."""
+  view = memoryview(buf).cast('B')
+  pos = 0
+  while pos < len(view):
+    n = f.readinto(view[pos:])
+    if not n:
+      break
+    pos += n
+  return pos
+
+
+def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt, out=None):
   # using a tempfile is much faster than proc.communicate for some reason
 
   with tempfile.TemporaryFile() as tmpf:
@@ -233,21 +374,22 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
        "pipe:1"],
       stdin=tmpf, stdout=subprocess.PIPE, stderr=open("/dev/null"))
 
-    # dat = proc.communicate()[0]
-    dat = proc.stdout.read()
+    if out is None:
+      # dat = proc.communicate()[0]
+      dat = proc.stdout.read()
+    else:
+      # decode straight into the caller's buffer, which has to fit the output exactly
+      bytes_read = readinto_full(proc.stdout, out)
+      extra = proc.stdout.read()
     if proc.wait() != 0:
       raise DataUnreadableError("ffmpeg failed")
 
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
-  else:
-    raise NotImplementedError
+  if out is None:
+    return np.frombuffer(dat, dtype=np.uint8).reshape((-1,) + frame_shape(w, h, pix_fmt))
 
-  return ret
+  if bytes_read != out.nbytes or len(extra):
+    raise DataUnreadableError("ffmpeg output size mismatch, got %d bytes for a %d byte buffer" % (bytes_read + len(extra), out.nbytes))
+  return out
 
 
 class BaseFrameReader:
@@ -262,18 +404,21 @@ class BaseFrameReader:
   def close(self):
     pass
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
+    # out: optional array from frame_buffer(count, ...) that the frames are written to,
+    # readers decode whole GOPs that aren't cached directly into it instead of copying them
     raise NotImplementedError
 
 
-def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None):
+def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None, cache_bytes=GOP_CACHE_BYTES):
+  # cache_bytes: budget of the decoded GOP cache, None for GOP_CACHE_FRAMES frames
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
       index_data = get_video_index(fn, frame_type, cache_prefix)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind, cache_bytes=cache_bytes)
   else:
     raise NotImplementedError(frame_type)
 
@@ -303,7 +448,7 @@ class RawFrameReader(BaseFrameReader):
     cimg = np.dstack([img[0::2, 1::2], ((img[0::2, 0::2].astype("uint16") + img[1::2, 1::2].astype("uint16")) >> 1).astype("uint8"), img[1::2, 0::2]])
     return cimg
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
     assert self.frame_count is not None
     assert num+count <= self.frame_count
 
@@ -321,6 +466,11 @@ class RawFrameReader(BaseFrameReader):
       else:
         raise NotImplementedError
 
+    if out is not None:
+      check_frame_buffer(out, count, self.w, self.h, pix_fmt)
+      for i, frame in enumerate(app):
+        out[i] = frame
+      return out
     return app
 
 
@@ -332,12 +482,8 @@ class VideoStreamDecompressor:
     self.h = h
     self.pix_fmt = pix_fmt
 
-    if pix_fmt == "yuv420p":
-      self.out_size = w*h*3//2  # yuv420p
-    elif pix_fmt in ("rgb24", "yuv444p"):
-      self.out_size = w*h*3
-    else:
-      raise NotImplementedError
+    self.frame_shape = frame_shape(w, h, pix_fmt)
+    self.out_size = int(np.prod(self.frame_shape))
 
     self.proc = None
     self.t = threading.Thread(target=self.write_thread)
@@ -354,7 +500,8 @@ class VideoStreamDecompressor:
     finally:
       self.proc.stdin.close()
 
-  def read(self):
+  def read(self, out=None):
+    # out: optional ring of frames from frame_buffer, yielded frames are only valid until the slot is reused
     threads = os.getenv("FFMPEG_THREADS", "0")
     cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
     cmd = [
@@ -379,20 +526,22 @@ class VideoStreamDecompressor:
     try:
       self.t.start()
 
+      i = 0
       while True:
-        dat = self.proc.stdout.read(self.out_size)
-        if len(dat) == 0:
-          break
-        assert len(dat) == self.out_size
-        if self.pix_fmt == "rgb24":
-          ret = np.frombuffer(dat, dtype=np.uint8).reshape((self.h, self.w, 3))
-        elif self.pix_fmt == "yuv420p":
-          ret = np.frombuffer(dat, dtype=np.uint8)
-        elif self.pix_fmt == "yuv444p":
-          ret = np.frombuffer(dat, dtype=np.uint8).reshape((3, self.h, self.w))
+        if out is None:
+          dat = self.proc.stdout.read(self.out_size)
+          if len(dat) == 0:
+            break
+          assert len(dat) == self.out_size
+          yield np.frombuffer(dat, dtype=np.uint8).reshape(self.frame_shape)
         else:
-          assert False
-        yield ret
+          ret = out[i % len(out)]
+          bytes_read = readinto_full(self.proc.stdout, ret)
+          if bytes_read == 0:
+            break
+          assert bytes_read == self.out_size
+          i += 1
+          yield ret
 
       result_code = self.proc.wait()
       assert result_code == 0, result_code
@@ -416,6 +565,9 @@ class StreamGOPReader(GOPReader):
     self.index = index_data['index']
     self.prefix = index_data['global_prefix']
     probe = index_data['probe']
+    self.gop_starts = index_data.get('gop_starts')
+    if self.gop_starts is None:
+      self.gop_starts = gop_starts_for_index(self.index)
 
     self.prefix_frame_data = None
     self.num_prefix_frames = 0
@@ -434,19 +586,21 @@ class StreamGOPReader(GOPReader):
     self.h = probe['streams'][0]['height']
 
   def _lookup_gop(self, num):
-    frame_b = num
-    while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
-      frame_b -= 1
-
-    frame_e = num + 1
-    while frame_e < (len(self.index) - 1) and self.index[frame_e, 0] != HEVC_SLICE_I:
-      frame_e += 1
+    gop = int(np.searchsorted(self.gop_starts, num, side='right')) - 1
+    frame_b = int(self.gop_starts[gop]) if gop >= 0 else 0
+    frame_e = int(self.gop_starts[gop + 1]) if gop + 1 < len(self.gop_starts) else len(self.index) - 1
 
     offset_b = self.index[frame_b, 1]
     offset_e = self.index[frame_e, 1]
 
     return (frame_b, frame_e, offset_b, offset_e)
 
+  def get_gop_start(self, num):
+    return self._lookup_gop(num)[0]
+
+  def get_gop_end(self, num):
+    return self._lookup_gop(num)[1]
+
   def get_gop(self, num):
     frame_b, frame_e, offset_b, offset_e = self._lookup_gop(num)
     assert frame_b <= num < frame_e
@@ -473,12 +627,14 @@ class StreamGOPReader(GOPReader):
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, cache_bytes=GOP_CACHE_BYTES):
     self.open_ = True
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    if cache_bytes is None:
+      cache_bytes = GOP_CACHE_FRAMES * int(np.prod(frame_shape(self.w, self.h, "rgb24")))
+    self.gop_cache = GOPCache(cache_bytes)
 
     if self.readahead:
       self.cache_lock = threading.RLock()
@@ -523,37 +679,93 @@ class GOPFrameReader(BaseFrameReader):
         for k in range(num, min(self.frame_count, num + self.readahead_len)):
           self._get_one(k, pix_fmt)
 
+  def _decode_gop(self, num, pix_fmt):
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+
+    out = frame_buffer(skip_frames + num_frames, self.w, self.h, pix_fmt)
+    ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt, out=out)
+    return frame_b, ret[skip_frames:]
+
+  def _decode_gop_into(self, num, pix_fmt, out):
+    # decodes the whole GOP starting at frame num straight into out, bypassing the GOP cache
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+    assert frame_b == num and len(out) == num_frames
+    if skip_frames:
+      out[:] = self._decode_gop(num, pix_fmt)[1]
+    else:
+      decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt, out=out)
+
   def _get_one(self, num, pix_fmt):
     assert num < self.frame_count
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+    frame_b = self.get_gop_start(num)
+    frames = self.gop_cache.get((frame_b, pix_fmt))
+    if frames is not None:
+      return frames[num - frame_b]
 
     with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+      frames = self.gop_cache.get((frame_b, pix_fmt))
+      if frames is None:
+        frame_b, frames = self._decode_gop(num, pix_fmt)
+        self.gop_cache.put((frame_b, pix_fmt), frames)
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+      return frames[num - frame_b]
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+  def get_frames(self, nums, pix_fmt="yuv420p", workers=DECODE_WORKERS):
+    """Returns the frames with the given numbers, in the same order.
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+       Frames are grouped by GOP so each GOP is decoded at most once, and GOPs missing
+       from the cache are decoded in parallel.
+    """
+    assert self.frame_count is not None
 
-      return self.frame_cache[(num, pix_fmt)]
+    if pix_fmt not in ("yuv420p", "nv12", "rgb24", "yuv444p"):
+      raise ValueError("Unsupported pixel format %r" % pix_fmt)
 
-  def get(self, num, count=1, pix_fmt="yuv420p"):
+    gop_starts = []
+    gops = {}
+    for num in nums:
+      if not 0 <= num < self.frame_count:
+        raise ValueError("{} >= {}".format(num, self.frame_count))
+      frame_b = self.get_gop_start(num)
+      gop_starts.append(frame_b)
+      if frame_b not in gops:
+        gops[frame_b] = self.gop_cache.get((frame_b, pix_fmt))
+
+    missing = [frame_b for frame_b, frames in gops.items() if frames is None]
+    if len(missing):
+      with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+        for frame_b, frames in pool.map(lambda n: self._decode_gop(n, pix_fmt), missing):
+          gops[frame_b] = frames
+          self.gop_cache.put((frame_b, pix_fmt), frames)
+
+    return [gops[frame_b][num - frame_b] for num, frame_b in zip(nums, gop_starts)]
+
+  def get(self, num, count=1, pix_fmt="yuv420p", out=None):
     assert self.frame_count is not None
 
     if num + count > self.frame_count:
       raise ValueError("{} > {}".format(num + count, self.frame_count))
 
-    if pix_fmt not in ("yuv420p", "rgb24", "yuv444p"):
+    if pix_fmt not in ("yuv420p", "nv12", "rgb24", "yuv444p"):
       raise ValueError("Unsupported pixel format %r" % pix_fmt)
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    if out is not None:
+      check_frame_buffer(out, count, self.w, self.h, pix_fmt)
+      # whole GOPs missing from the cache are decoded in place, the rest is copied from the cache
+      i = num
+      while i < num + count:
+        frame_e = self.get_gop_end(i)
+        if out.flags.c_contiguous and self.get_gop_start(i) == i and frame_e <= num + count and \
+           self.gop_cache.get((i, pix_fmt)) is None:
+          self._decode_gop_into(i, pix_fmt, out[i - num:frame_e - num])
+          i = frame_e
+        else:
+          out[i - num] = self._get_one(i, pix_fmt)
+          i += 1
+      ret = out
+    else:
+      ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
 
     if self.readahead:
       self.readahead_last = (num+count, pix_fmt)
@@ -565,22 +777,27 @@ class GOPFrameReader(BaseFrameReader):
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, cache_bytes=GOP_CACHE_BYTES):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
-    GOPFrameReader.__init__(self, readahead, readbehind)
+    GOPFrameReader.__init__(self, readahead, readbehind, cache_bytes)
 
 
-def GOPFrameIterator(gop_reader, pix_fmt):
+def GOPFrameIterator(gop_reader, pix_fmt, out=None):
   dec = VideoStreamDecompressor(gop_reader.fn, gop_reader.vid_fmt, gop_reader.w, gop_reader.h, pix_fmt)
-  for frame in dec.read():
+  for frame in dec.read(out=out):
     yield frame
 
 
-def FrameIterator(fn, pix_fmt, **kwargs):
+def FrameIterator(fn, pix_fmt, out=None, **kwargs):
+  """Iterates all frames of a video. If out is a frame_buffer, frames are decoded into it round robin."""
   fr = FrameReader(fn, **kwargs)
   if isinstance(fr, GOPReader):
-    for v in GOPFrameIterator(fr, pix_fmt):
+    for v in GOPFrameIterator(fr, pix_fmt, out=out):
       yield v
   else:
     for i in range(fr.frame_count):
-      yield fr.get(i, pix_fmt=pix_fmt)[0]
+      if out is None:
+        yield fr.get(i, pix_fmt=pix_fmt)[0]
+      else:
+        slot = out[i % len(out):i % len(out) + 1]
+        yield fr.get(i, pix_fmt=pix_fmt, out=slot)[0]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import io
+import os
+import argparse
+import numpy as np
+
+from tools.lib.file_helpers import mkdirs_exists_ok
+from tools.lib.logreader import LogReader
+
+# lists of CanData are flattened into one row per frame
+CAN_SERVICES = ('can', 'sendcan')
+CHUNK_ROWS = 1 << 16
+
+
+def parse_fields(fields):
+  """Groups 'service.field.subfield' names by service, a bare service name selects all its CAN frames."""
+  by_service = {}
+  for f in fields:
+    service, _, path = f.partition('.')
+    paths = by_service.setdefault(service, [])
+    if service in CAN_SERVICES:
+      if path:
+        raise ValueError(f"{service} is exported as frames, can't select {f}")
+    elif not path:
+      raise ValueError(f"no field given for {service}")
+    else:
+      paths.append(path)
+  return by_service
+
+
+def _get_field(msg, path):
+  for name in path.split('.'):
+    msg = getattr(msg, name)
+  return msg
+
+
+def _column_dtype(value):
+  if isinstance(value, bool):
+    return np.bool_
+  elif isinstance(value, int):
+    return np.int64
+  elif isinstance(value, float):
+    return np.float64
+  raise TypeError(f"unsupported field type {type(value).__name__}, only scalar fields can be exported")
+
+
+def _npy_header(dtype, count):
+  header = io.BytesIO()
+  np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                'fortran_order': False, 'shape': (count,)})
+  return header.getvalue()
+
+
+class ColumnWriter():
+  """Streams one column to a .npy file in chunks of CHUNK_ROWS rows, the header gets the row count on close.
+
+     With concat the rows are bytes that are stored back to back as uint8.
+  """
+  def __init__(self, path, dtype=None, concat=False):
+    self.path = path
+    self.dtype = np.uint8 if concat else dtype
+    self.concat = concat
+    self.rows = []
+    self.count = 0
+    self.header_len = None
+    self.f = open(path, "wb")
+
+  def _write_header(self, count):
+    # the header is padded to a fixed size, rewriting it with the final count doesn't move the data
+    header = _npy_header(self.dtype, count)
+    if self.header_len is not None and len(header) != self.header_len:
+      raise RuntimeError(f"header of {self.path} changed size")
+    self.f.write(header)
+    self.header_len = len(header)
+
+  def append(self, value):
+    self.rows.append(value)
+    if len(self.rows) >= CHUNK_ROWS:
+      self.flush()
+
+  def flush(self):
+    if not self.rows:
+      return
+    if self.concat:
+      arr = np.frombuffer(b"".join(self.rows), dtype=np.uint8)
+    else:
+      if self.dtype is None:
+        self.dtype = _column_dtype(self.rows[0])
+      arr = np.array(self.rows, dtype=self.dtype)
+    if self.header_len is None:
+      self._write_header(0)
+    arr.tofile(self.f)
+    self.count += len(arr)
+    self.rows = []
+
+  def close(self):
+    self.flush()
+    if self.dtype is None:
+      self.dtype = np.float64
+    self.f.seek(0)
+    self._write_header(self.count)
+    self.f.close()
+
+
+def _make_writers(service, paths, out_dir):
+  service_dir = os.path.join(out_dir, service)
+  mkdirs_exists_ok(service_dir)
+
+  def writer(name, **kwargs):
+    return ColumnWriter(os.path.join(service_dir, name + ".npy"), **kwargs)
+
+  writers = {'logMonoTime': writer('logMonoTime', dtype=np.uint64)}
+  if service in CAN_SERVICES:
+    writers['address'] = writer('address', dtype=np.uint32)
+    writers['busTime'] = writer('busTime', dtype=np.uint16)
+    writers['src'] = writer('src', dtype=np.uint8)
+    # variable length payloads are stored back to back, frame i is dat[dat_offset[i]:dat_offset[i+1]]
+    writers['dat_offset'] = writer('dat_offset', dtype=np.uint64)
+    writers['dat'] = writer('dat', concat=True)
+    writers['dat_offset'].append(0)
+  else:
+    for path in paths:
+      writers[path] = writer(path)
+  return writers
+
+
+def export_columns(log_paths, fields, out_dir):
+  """Streams the given fields of a list of logs to out_dir/<service>/<field>.npy and memory maps the result.
+
+     At most CHUNK_ROWS rows per column are held in memory.
+  """
+  by_service = parse_fields(fields)
+  writers = {s: _make_writers(s, paths, out_dir) for s, paths in by_service.items()}
+  dat_len = {s: 0 for s in by_service}
+
+  try:
+    for fn in log_paths:
+      if fn is None:
+        continue
+      for msg in LogReader(fn, services=list(by_service)):
+        service = msg.which()
+        cols = writers[service]
+        if service in CAN_SERVICES:
+          for frame in getattr(msg, service):
+            cols['logMonoTime'].append(msg.logMonoTime)
+            cols['address'].append(frame.address)
+            cols['busTime'].append(frame.busTime)
+            cols['src'].append(frame.src)
+            cols['dat'].append(frame.dat)
+            dat_len[service] += len(frame.dat)
+            cols['dat_offset'].append(dat_len[service])
+        else:
+          cols['logMonoTime'].append(msg.logMonoTime)
+          data = getattr(msg, service)
+          for path in by_service[service]:
+            cols[path].append(_get_field(data, path))
+  finally:
+    for cols in writers.values():
+      for w in cols.values():
+        w.close()
+
+  return load_columns(out_dir, list(by_service))
+
+
+def load_columns(out_dir, services=None):
+  """Memory maps columns written by export_columns."""
+  if services is None:
+    services = sorted(os.listdir(out_dir))
+
+  columns = {}
+  for service in services:
+    service_dir = os.path.join(out_dir, service)
+    columns[service] = {fn[:-len(".npy")]: np.load(os.path.join(service_dir, fn), mmap_mode='r')
+                        for fn in sorted(os.listdir(service_dir)) if fn.endswith(".npy")}
+  return columns
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Export log fields to memory mappable NumPy columns")
+  parser.add_argument("out_dir", help="output directory")
+  parser.add_argument("logs", nargs="+", help="log paths or urls, in order")
+  parser.add_argument("-f", "--field", action="append", required=True, dest="fields",
+                      help="service.field to export, e.g. carState.vEgo, or can for all CAN frames")
+  args = parser.parse_args()
+
+  columns = export_columns(args.logs, args.fields, args.out_dir)
+  for service, cols in columns.items():
+    print(f"{service}: {len(cols['logMonoTime'])} rows, columns {', '.join(cols)}")
@@ -0,0 +1,120 @@
+import os
+import json
+import struct
+import numpy as np
+import capnp
+
+from cereal import log as capnp_log
+from tools.lib.cache import cache_path_for_file_path, cache_source_key
+from tools.lib.file_helpers import atomic_write_in_dir
+
+INDEX_MAGIC = b"OPLI"
+INDEX_VERSION = 1
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('logMonoTime', '<u8'), ('size', '<u4'), ('which', '<u2')])
+UNKNOWN_WHICH = 0xFFFF  # union type not in this schema
+
+
+def index_path_for_log(fn):
+  return cache_path_for_file_path(fn) + ".idx"
+
+
+class LogIndex(object):
+  """Per-event offset, size, logMonoTime and union type of a decompressed log.
+
+     Offsets point into the decompressed log, so events of selected services can be
+     decoded without touching the rest of the file.
+  """
+  def __init__(self, services, records, data_size):
+    self.services = services
+    self.records = records
+    self.data_size = data_size
+
+  @property
+  def offsets(self):
+    return self.records['offset']
+
+  @property
+  def sizes(self):
+    return self.records['size']
+
+  @property
+  def ts(self):
+    return self.records['logMonoTime']
+
+  @classmethod
+  def build(cls, dat):
+    from tools.lib.logreader import event_size
+    services = []
+    service_ids = {}
+    records = []
+    pos = 0
+    for ent in capnp_log.Event.read_multiple_bytes(dat):
+      size = event_size(dat, pos)
+      try:
+        which = ent.which()
+        if which not in service_ids:
+          service_ids[which] = len(services)
+          services.append(which)
+        which_id = service_ids[which]
+      except capnp.lib.capnp.KjException:
+        which_id = UNKNOWN_WHICH
+      records.append((pos, ent.logMonoTime, size, which_id))
+      pos += size
+    return cls(services, np.array(records, dtype=INDEX_DTYPE), len(dat))
+
+  def save(self, path, source_key):
+    header = json.dumps({'services': self.services, 'data_size': self.data_size, 'source': source_key}).encode()
+    header_size = (len(INDEX_MAGIC) + 8 + len(header) + 7) & ~7
+    with atomic_write_in_dir(path, mode="wb") as f:
+      f.write(INDEX_MAGIC + struct.pack("<II", INDEX_VERSION, len(header)) + header)
+      f.write(b"\0" * (header_size - len(INDEX_MAGIC) - 8 - len(header)))
+      f.write(self.records.tobytes())
+
+  @classmethod
+  def load(cls, path, source_key=None):
+    """Memory maps an index, returns None if it is missing, stale or from another version."""
+    try:
+      with open(path, "rb") as f:
+        magic, (version, header_len) = f.read(len(INDEX_MAGIC)), struct.unpack("<II", f.read(8))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+          return None
+        header = json.loads(f.read(header_len))
+    except (OSError, struct.error, ValueError):
+      return None
+
+    if source_key is not None and header['source'] != source_key:
+      return None
+
+    header_size = (len(INDEX_MAGIC) + 8 + header_len + 7) & ~7
+    if (os.path.getsize(path) - header_size) % INDEX_DTYPE.itemsize:
+      return None
+    if os.path.getsize(path) == header_size:
+      records = np.zeros(0, dtype=INDEX_DTYPE)
+    else:
+      records = np.memmap(path, dtype=INDEX_DTYPE, mode='r', offset=header_size)
+    return cls(header['services'], records, header['data_size'])
+
+  def select(self, services):
+    """Returns the positions of the events of the given services, in log order."""
+    ids = [self.services.index(s) for s in services if s in self.services]
+    return np.flatnonzero(np.isin(self.records['which'], ids))
+
+  def search(self, mono_time):
+    """Returns the position of the first event at or after mono_time. Logs are written in logMonoTime order."""
+    return int(np.searchsorted(self.ts, mono_time, side='left'))
+
+
+def get_log_index(fn, dat=None):
+  """Loads the cached index of a log, building it from the decompressed log if needed."""
+  path = index_path_for_log(fn)
+  source_key = cache_source_key(fn)
+  index = LogIndex.load(path, source_key)
+  if index is not None and (dat is None or index.data_size == len(dat)):
+    return index
+
+  if dat is None:
+    from tools.lib.logreader import read_log_bytes
+    dat = read_log_bytes(fn)
+  index = LogIndex.build(dat)
+  index.save(path, source_key)
+  return index
@@ -2,6 +2,11 @@
 import os
 import sys
 import bz2
+import heapq
+import struct
+import multiprocessing
+from bisect import bisect_left
+from collections import deque
 import urllib.parse
 import capnp
 
@@ -10,6 +15,62 @@ try:
 except ImportError:
   from tools.lib.filereader import FileReader
 from cereal import log as capnp_log
+from tools.lib.logindex import get_log_index
+
+NO_TRAVERSAL_LIMIT = 2**64-1
+STREAM_READ_SIZE = 256 * 1024  # compressed bytes read from the file per step
+STREAM_WINDOW_SIZE = 8 * 1024 * 1024  # max decompressed bytes buffered while framing
+
+
+def event_size(buf, offset=0):
+  """Returns the size of the capnp message starting at offset, or None if buf doesn't hold its full header yet."""
+  avail = len(buf) - offset
+  if avail < 4:
+    return None
+  n_segments = struct.unpack_from("<I", buf, offset)[0] + 1
+  header_size = (4 + 4 * n_segments + 7) & ~7
+  if avail < header_size:
+    return None
+  segment_words = sum(struct.unpack_from(f"<{n_segments}I", buf, offset + 4))
+  return header_size + 8 * segment_words
+
+
+def read_log_bytes(fn):
+  """Returns the decompressed contents of a log file."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  with FileReader(fn) as f:
+    dat = f.read()
+
+  if ext == "":
+    # old rlogs weren't bz2 compressed
+    return dat
+  elif ext == ".bz2":
+    return bz2.decompress(dat)
+  else:
+    raise Exception(f"unknown extension {ext}")
+
+
+def filter_union_types(ents):
+  """Skips events whose union type is unknown to this schema."""
+  for ent in ents:
+    try:
+      ent.which()
+      yield ent
+    except capnp.lib.capnp.KjException:
+      pass
+
+
+def _decode_segment(fn):
+  # runs in a RouteLogReader worker, capnp readers can't be pickled so raw events are sent back
+  dat = read_log_bytes(fn)
+  ents = []
+  pos = 0
+  for ent in capnp_log.Event.read_multiple_bytes(dat):
+    size = event_size(dat, pos)
+    ents.append((ent.logMonoTime, pos, size))
+    pos += size
+  ents.sort()
+  return dat, ents
 
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator(object):
@@ -68,44 +129,177 @@ class MultiLogIterator(object):
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
+    lr = self._log_reader(minute)
+    self._idx = lr.time_index(self.start_time + int(ts * 1e9))
+    if self._idx == len(lr._ents):
+      # past the last event of this segment, continue from the next one
+      self._idx -= 1
       self._inc()
     return True
 
 
+class RouteLogReader(object):
+  """Iterates the logs of a route in logMonoTime order, decoding upcoming segments in a process pool.
+
+     Takes a list of log paths such as Route.log_paths() or Route.qlog_paths(), missing
+     segments (None) are skipped. While the caller consumes one segment, the next `prefetch`
+     segments are downloaded and decompressed by the pool. Segments only overlap their
+     neighbours at the boundaries, so two consecutive segments are merged at a time.
+  """
+  def __init__(self, log_paths, prefetch=2, processes=None, only_union_types=False):
+    self._log_paths = [p for p in log_paths if p is not None]
+    self._prefetch = max(prefetch, 1)
+    self._processes = processes if processes is not None else self._prefetch
+    self._only_union_types = only_union_types
+
+  def _events(self):
+    with multiprocessing.Pool(self._processes) as pool:
+      paths = deque(self._log_paths)
+      pending = deque()
+
+      def submit():
+        while len(pending) < self._prefetch and len(paths):
+          pending.append(pool.apply_async(_decode_segment, (paths.popleft(),)))
+
+      def load():
+        submit()
+        seg = pending.popleft().get() if len(pending) else None
+        submit()
+        return seg
+
+      segments = {}
+      heap = []
+      seg_idx = 0
+
+      def activate():
+        nonlocal seg_idx
+        while True:
+          seg = load()
+          if seg is None:
+            return
+          seg_idx += 1
+          if len(seg[1]):
+            segments[seg_idx] = seg
+            heapq.heappush(heap, (seg[1][0][0], seg_idx, 0))
+            return
+
+      activate()
+      activate()
+      while heap:
+        _, i, j = heapq.heappop(heap)
+        dat, ents = segments[i]
+        _, pos, size = ents[j]
+        yield capnp_log.Event.from_bytes(dat[pos:pos + size], traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+
+        if j + 1 < len(ents):
+          heapq.heappush(heap, (ents[j + 1][0], i, j + 1))
+        else:
+          del segments[i]
+          activate()
+
+  def __iter__(self):
+    return filter_union_types(self._events()) if self._only_union_types else self._events()
+
+
 class LogReader(object):
-  def __init__(self, fn, canonicalize=True, only_union_types=False):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, services=None):
+    """If services is given only events of those services are decoded, using the cached log index."""
     data_version = None
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
-
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    else:
-      raise Exception(f"unknown extension {ext}")
+    dat = read_log_bytes(fn)
 
-    self._ents = list(ents)
-    self._ts = [x.logMonoTime for x in self._ents]
+    if services is None:
+      self._ents = list(capnp_log.Event.read_multiple_bytes(dat))
+      self._ts = [x.logMonoTime for x in self._ents]
+    else:
+      index = get_log_index(fn, dat)
+      records = index.records[index.select(services)]
+      self._ents = [capnp_log.Event.from_bytes(dat[r['offset']:r['offset'] + r['size']], traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+                    for r in records]
+      self._ts = records['logMonoTime'].tolist()
     self.data_version = data_version
     self._only_union_types = only_union_types
 
+  def time_index(self, mono_time):
+    """Returns the index of the first event at or after mono_time."""
+    return bisect_left(self._ts, mono_time)
+
   def __iter__(self):
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
+    return filter_union_types(self._ents) if self._only_union_types else iter(self._ents)
+
+
+class StreamLogReader(object):
+  """Iterates a log without holding it in memory.
+
+     The file is read and decompressed incrementally and events are decoded as soon
+     as they are fully framed, so at most window_size decompressed bytes (or a single
+     event, if larger) are buffered at any time.
+  """
+  def __init__(self, fn, only_union_types=False, window_size=STREAM_WINDOW_SIZE, read_size=STREAM_READ_SIZE):
+    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+    if ext not in ("", ".bz2"):
+      raise Exception(f"unknown extension {ext}")
+
+    self._fn = fn
+    self._compressed = ext == ".bz2"
+    self._only_union_types = only_union_types
+    self._window_size = window_size
+    self._read_size = read_size
+
+  def _read_chunks(self, f, max_length):
+    # old rlogs weren't bz2 compressed
+    if not self._compressed:
+      while True:
+        dat = f.read(max(max_length(), self._read_size))
+        if not dat:
+          return
+        yield dat
+
+    decompressor = bz2.BZ2Decompressor()
+    while True:
+      if decompressor.eof:
+        # concatenated bz2 streams
+        unused = decompressor.unused_data
+        decompressor = bz2.BZ2Decompressor()
+        dat = unused or f.read(self._read_size)
+      elif decompressor.needs_input:
+        dat = f.read(self._read_size)
       else:
-        yield ent
+        dat = b""
+
+      if not dat and (decompressor.needs_input or decompressor.eof):
+        return
+      yield decompressor.decompress(dat, max_length=max_length())
+
+  def _events(self):
+    buf = bytearray()
+    pos = 0
+    needed = 0
+
+    def max_length():
+      # keep the buffer within the window, but always allow the pending event to complete
+      return max(self._window_size - (len(buf) - pos), needed - (len(buf) - pos), 1)
+
+    with FileReader(self._fn) as f:
+      for dat in self._read_chunks(f, max_length):
+        buf += dat
+        while True:
+          size = event_size(buf, pos)
+          if size is None or len(buf) - pos < size:
+            needed = size or 0
+            break
+          yield capnp_log.Event.from_bytes(bytes(buf[pos:pos + size]), traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+          pos += size
+          needed = 0
+
+        # drop consumed bytes so the buffer doesn't grow with the file
+        del buf[:pos]
+        pos = 0
+
+    if len(buf):
+      raise Exception(f"truncated log {self._fn}: {len(buf)} trailing bytes")
+
+  def __iter__(self):
+    return filter_union_types(self._events()) if self._only_union_types else self._events()
 
 if __name__ == "__main__":
   import codecs
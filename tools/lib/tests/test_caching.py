@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 import os
+import time
 import shutil
+import tempfile
+import threading
 import unittest
+import http.server
+from unittest import mock
 
 os.environ["COMMA_CACHE"] = "/tmp/__test_cache__"
+from tools.lib import url_file
 from tools.lib.url_file import URLFile, CACHE_DIR
+from tools.lib.url_file_cache import ChunkCache
 
 
 class TestFileDownload(unittest.TestCase):
@@ -65,5 +72,90 @@ class TestFileDownload(unittest.TestCase):
     self.compare_loads(large_file_url)
 
 
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+  data = b""
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.data)))
+    self.end_headers()
+
+  def do_GET(self):
+    start, end = 0, len(self.data) - 1
+    if "Range" in self.headers:
+      start, end = (int(x) for x in self.headers["Range"].split("=")[1].split("-"))
+      self.send_response(206)
+    else:
+      self.send_response(200)
+    self.send_header("Content-Length", str(end - start + 1))
+    self.end_headers()
+    self.wfile.write(self.data[start:end + 1])
+
+  def log_message(self, *args):
+    pass
+
+
+class TestLocalDownload(unittest.TestCase):
+
+  def setUp(self):
+    RangeHandler.data = os.urandom(20 * 1000)
+    self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.url = f"http://127.0.0.1:{self.server.server_address[1]}/file_{time.monotonic_ns()}"
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_multi_chunk_cached_read(self):
+    # more missing chunks than download threads
+    with mock.patch.object(url_file, "CHUNK_SIZE", 1000):
+      for cache in (True, False, True):
+        result = []
+        f = URLFile(self.url, cache=cache)
+        f.seek(500)
+        reader = threading.Thread(target=lambda: result.append(f.read(ll=18000)), daemon=True)
+        reader.start()
+        reader.join(timeout=30)
+        self.assertFalse(reader.is_alive(), "read hung")
+        self.assertEqual(result[0], RangeHandler.data[500:18500])
+        self.assertIs(type(result[0]), bytes)
+
+  def test_read_returns_bytes(self):
+    with mock.patch.object(url_file, "CHUNK_SIZE", 1000):
+      for cache in (False, True):
+        # a single range request, several chunks and the whole file
+        for pos, ll in ((100, 500), (100, 5000), (0, None)):
+          f = URLFile(self.url, cache=cache)
+          f.seek(pos)
+          dat = f.read(ll=ll)
+          self.assertIs(type(dat), bytes, (cache, pos, ll))
+          self.assertEqual(dat, RangeHandler.data[pos:pos + ll if ll is not None else None])
+
+
+class TestChunkCache(unittest.TestCase):
+
+  def test_lru_eviction(self):
+    with tempfile.TemporaryDirectory() as cache_dir:
+      cache = ChunkCache(cache_dir, max_bytes=1000)
+      for i in range(5):
+        cache.put(f"chunk_{i}", b"x" * 300)
+        # keep the first chunk hot
+        self.assertEqual(cache.get("chunk_0"), b"x" * 300)
+
+      self.assertIn("chunk_0", cache)
+      self.assertNotIn("chunk_1", cache)
+      self.assertIsNone(cache.get("chunk_1"))
+
+      stats = cache.stats()
+      self.assertLessEqual(stats['bytes'], 1000)
+      self.assertEqual(stats['hits'], 5)
+      self.assertEqual(stats['misses'], 1)
+      self.assertEqual(stats['evictions'], 2)
+
+      # counters and entries are shared through the index
+      self.assertEqual(ChunkCache(cache_dir).stats()['bytes'], stats['bytes'])
+
+
 if __name__ == "__main__":
     unittest.main()
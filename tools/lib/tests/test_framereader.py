@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import os
+import struct
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from tools.lib import framereader
+from tools.lib.framereader import FrameType, index_video, read_video_index, write_video_index
+
+
+def make_index_data(n_frames=30, gop_size=10):
+  types = np.where(np.arange(n_frames) % gop_size == 0, framereader.HEVC_SLICE_I, framereader.HEVC_SLICE_P)
+  index = np.stack([np.append(types, 0xFFFFFFFF), np.arange(n_frames + 1) * 1000]).T.astype(np.uint32)
+  return {
+    'index': index,
+    'gop_starts': framereader.gop_starts_for_index(index),
+    'global_prefix': b"prefix",
+    'probe': {'streams': [{'width': 4, 'height': 2}]},
+  }
+
+
+class TestVideoIndex(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, "index")
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_round_trip(self):
+    index_data = make_index_data()
+    write_video_index(self.path, index_data, [123, 456])
+
+    loaded = read_video_index(self.path, [123, 456])
+    self.assertIsInstance(loaded['index'], np.memmap)
+    np.testing.assert_equal(loaded['index'], index_data['index'])
+    np.testing.assert_equal(loaded['gop_starts'], [0, 10, 20])
+    self.assertEqual(loaded['global_prefix'], b"prefix")
+    self.assertEqual(loaded['probe'], index_data['probe'])
+
+    # a changed source file invalidates the index
+    self.assertIsNone(read_video_index(self.path, [123, 457]))
+    self.assertIsNone(read_video_index(os.path.join(self.tmp.name, "missing")))
+
+  def test_version_mismatch_rebuilds(self):
+    with mock.patch.object(framereader, "VIDEO_INDEX_VERSION", framereader.VIDEO_INDEX_VERSION + 1):
+      write_video_index(self.path, make_index_data(), [1, 2])
+    self.assertIsNone(read_video_index(self.path, [1, 2]))
+
+    with mock.patch.object(framereader, "cache_path_for_file_path", return_value=self.path), \
+         mock.patch.object(framereader, "cache_source_key", return_value=[1, 2]), \
+         mock.patch.object(framereader, "index_stream", return_value=make_index_data(20)) as index_stream:
+      index_video("video.hevc", FrameType.h265_stream)
+      index_video("video.hevc", FrameType.h265_stream)
+
+    self.assertEqual(index_stream.call_count, 1)
+    with open(self.path, "rb") as f:
+      self.assertEqual(struct.unpack("<4sI", f.read(8)), (framereader.VIDEO_INDEX_MAGIC, framereader.VIDEO_INDEX_VERSION))
+    self.assertEqual(read_video_index(self.path, [1, 2])['index'].shape, (21, 2))
+
+  def test_vidindex_built_once(self):
+    with mock.patch.object(framereader, "_vidindex_built", False), \
+         mock.patch.object(framereader.subprocess, "check_call") as check_call:
+      threads = [threading.Thread(target=framereader.build_vidindex) for _ in range(8)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+    self.assertEqual(check_call.call_count, 1)
+
+
+class FakeGOPFrameReader(framereader.GOPReader, framereader.GOPFrameReader):
+  """GOPs of 10 frames, the encoded data of a GOP is just its number."""
+  vid_fmt = "hevc"
+  w, h = 8, 4
+  frame_count = 30
+
+  def __init__(self):
+    framereader.GOPFrameReader.__init__(self)
+
+  def get_gop_start(self, num):
+    return num - num % 10
+
+  def get_gop_end(self, num):
+    return self.get_gop_start(num) + 10
+
+  def get_gop(self, num):
+    return self.get_gop_start(num), 10, 0, bytes([num // 10])
+
+
+def fake_decompress(rawdat, vid_fmt, w, h, pix_fmt, out=None):
+  # frame i of GOP g is filled with 10 * g + i
+  frames = framereader.frame_buffer(10, w, h, pix_fmt) if out is None else out
+  assert frames.shape[0] == 10
+  frames[:] = (10 * rawdat[0] + np.arange(10, dtype=np.uint8)).reshape((-1,) + (1,) * (frames.ndim - 1))
+  return frames
+
+
+@mock.patch.object(framereader, "decompress_video_data", side_effect=fake_decompress)
+class TestFrameBuffer(unittest.TestCase):
+  def test_decode_into_out(self, decompress):
+    fr = FakeGOPFrameReader()
+    for pix_fmt in ("yuv420p", "nv12", "rgb24"):
+      out = framereader.frame_buffer(20, fr.w, fr.h, pix_fmt)
+      decompress.reset_mock()
+      self.assertIs(fr.get(10, 20, pix_fmt=pix_fmt, out=out), out)
+
+      # both GOPs were decoded in place and not cached
+      self.assertEqual(decompress.call_count, 2)
+      for call in decompress.call_args_list:
+        self.assertTrue(np.shares_memory(call.kwargs['out'], out))
+      self.assertEqual(fr.gop_cache.nbytes, 0)
+      self.assertEqual(out.shape[1:], framereader.frame_shape(fr.w, fr.h, pix_fmt))
+      np.testing.assert_equal(out.reshape(20, -1)[:, 0], np.arange(10, 30))
+    self.assertEqual(out.shape, (20, fr.h, fr.w, 3))
+
+  def test_partial_gops_are_copied(self, decompress):
+    fr = FakeGOPFrameReader()
+    out = framereader.frame_buffer(12, fr.w, fr.h, "nv12")
+    self.assertEqual(out.shape, (12, fr.w * fr.h * 3 // 2))
+    fr.get(5, 12, pix_fmt="nv12", out=out)
+    np.testing.assert_equal(out[:, 0], np.arange(5, 17))
+    # partially requested GOPs go through the cache
+    self.assertEqual(decompress.call_count, 2)
+    self.assertEqual(len(fr.gop_cache._gops), 2)
+    np.testing.assert_equal(fr.get(5, 12, pix_fmt="nv12"), out)
+
+  def test_cache_budget(self, decompress):
+    fr = FakeGOPFrameReader()
+    self.assertEqual(fr.gop_cache.max_bytes, framereader.GOP_CACHE_FRAMES * fr.w * fr.h * 3)
+    # the three 10 frame GOPs fit in GOP_CACHE_FRAMES rgb24 frames
+    for i in range(0, fr.frame_count, 10):
+      fr.get(i, pix_fmt="rgb24")
+    self.assertEqual(len(fr.gop_cache._gops), 3)
+    self.assertLessEqual(fr.gop_cache.nbytes, fr.gop_cache.max_bytes)
+
+    framereader.GOPFrameReader.__init__(fr, cache_bytes=1000)
+    for i in range(0, fr.frame_count, 10):
+      fr.get(i, pix_fmt="rgb24")
+    self.assertEqual(len(fr.gop_cache._gops), 1)
+
+  def test_bad_out(self, decompress):
+    fr = FakeGOPFrameReader()
+    with self.assertRaises(ValueError):
+      fr.get(0, 10, pix_fmt="nv12", out=framereader.frame_buffer(10, fr.w, fr.h, "rgb24"))
+    with self.assertRaises(ValueError):
+      fr.get(0, 10, out=framereader.frame_buffer(10, fr.w, fr.h, "yuv420p").astype(np.float32))
+    with self.assertRaises(ValueError):
+      fr.get(0, 10, out=framereader.frame_buffer(5, fr.w, fr.h, "yuv420p"))
+    decompress.assert_not_called()
+
+
+if __name__ == "__main__":
+  unittest.main()
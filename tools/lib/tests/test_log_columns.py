@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+import bz2
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from cereal import log as capnp_log
+from tools.lib import log_columns
+from tools.lib.log_columns import export_columns, load_columns
+
+
+class TestLogColumns(unittest.TestCase):
+  def test_round_trip(self):
+    dat = b""
+    expected_dat = []
+    for i in range(500):
+      ev = capnp_log.Event.new_message()
+      ev.logMonoTime = i
+      if i % 2 == 0:
+        ev.init('carState')
+        ev.carState.vEgo = i / 10.
+        ev.carState.standstill = i % 4 == 0
+        ev.carState.cruiseState.speed = i / 20.
+      else:
+        ev.init('can', 2)
+        for j, frame in enumerate(ev.can):
+          frame.address = i * 2 + j
+          frame.src = j
+          frame.dat = bytes(range(i % 8 + j))
+          expected_dat.append(frame.dat)
+      dat += ev.to_bytes()
+
+    with tempfile.TemporaryDirectory() as d:
+      fn = os.path.join(d, "rlog.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(dat))
+
+      out_dir = os.path.join(d, "columns")
+      fields = ['carState.vEgo', 'carState.standstill', 'carState.cruiseState.speed', 'can', 'sendcan']
+      with mock.patch.object(log_columns, "CHUNK_ROWS", 64):  # several chunks per column
+        columns = export_columns([fn, None], fields, out_dir)
+      loaded = load_columns(out_dir)
+
+      for cols in (columns, loaded):
+        cs = cols['carState']
+        np.testing.assert_equal(cs['logMonoTime'], np.arange(0, 500, 2))
+        np.testing.assert_allclose(cs['vEgo'], np.arange(0, 500, 2) / 10., rtol=1e-6)
+        np.testing.assert_equal(cs['standstill'], np.arange(0, 500, 2) % 4 == 0)
+        self.assertEqual(cs['standstill'].dtype, np.bool_)
+        np.testing.assert_allclose(cs['cruiseState.speed'], np.arange(0, 500, 2) / 20., rtol=1e-6)
+
+        can = cols['can']
+        self.assertIsInstance(can['address'], np.memmap)
+        self.assertEqual(len(can['logMonoTime']), 500)
+        np.testing.assert_equal(can['address'], np.repeat(np.arange(1, 500, 2) * 2, 2) + np.tile([0, 1], 250))
+        offsets = can['dat_offset']
+        self.assertEqual(len(offsets), 501)
+        self.assertEqual([bytes(can['dat'][offsets[k]:offsets[k + 1]]) for k in range(500)], expected_dat)
+
+        self.assertEqual(len(cols['sendcan']['logMonoTime']), 0)
+        np.testing.assert_equal(cols['sendcan']['dat_offset'], [0])
+
+      self.assertEqual(sorted(os.listdir(os.path.join(out_dir, 'can'))),
+                       ['address.npy', 'busTime.npy', 'dat.npy', 'dat_offset.npy', 'logMonoTime.npy', 'src.npy'])
+
+  def test_column_writer(self):
+    # the final header takes the place of the one written up front
+    for dtype in (np.uint8, np.float64, np.bool_):
+      self.assertEqual(len(log_columns._npy_header(dtype, 0)), len(log_columns._npy_header(dtype, 10**15)))
+
+    with tempfile.TemporaryDirectory() as d:
+      fn = os.path.join(d, "x.npy")
+      with mock.patch.object(log_columns, "CHUNK_ROWS", 7):
+        w = log_columns.ColumnWriter(fn)
+        for i in range(100):
+          w.append(i * 0.5)
+          if i == 50:
+            # the rows are in the file already, behind a placeholder header
+            self.assertEqual(os.path.getsize(fn), len(log_columns._npy_header(np.float64, 0)) + 49 * 8)
+        w.close()
+      np.testing.assert_equal(np.load(fn), np.arange(100) * 0.5)
+      self.assertEqual(os.listdir(d), ["x.npy"])
+
+  def test_bad_fields(self):
+    with self.assertRaises(ValueError):
+      log_columns.parse_fields(['carState'])
+    with self.assertRaises(ValueError):
+      log_columns.parse_fields(['can.address'])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import bz2
 import unittest
 import requests
 import tempfile
@@ -6,7 +7,8 @@ import tempfile
 from collections import defaultdict
 import numpy as np
 from tools.lib.framereader import FrameReader
-from tools.lib.logreader import LogReader
+from tools.lib.logreader import LogReader, StreamLogReader, RouteLogReader
+from cereal import log as capnp_log
 
 
 class TestReaders(unittest.TestCase):
@@ -31,6 +33,68 @@ class TestReaders(unittest.TestCase):
     lr_url = LogReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/raw_log.bz2?raw=true")
     _check_data(lr_url)
 
+  def test_stream_logreader(self):
+    dat = b""
+    for i in range(1000):
+      ev = capnp_log.Event.new_message()
+      ev.logMonoTime = i
+      ev.init('can', i % 5)
+      dat += ev.to_bytes()
+
+    for suffix, compress in ((".bz2", bz2.compress), ("", lambda x: x)):
+      with tempfile.NamedTemporaryFile(suffix=suffix) as fp:
+        fp.write(compress(dat))
+        fp.flush()
+
+        expected = [ev.logMonoTime for ev in LogReader(fp.name)]
+        streamed = [ev.logMonoTime for ev in StreamLogReader(fp.name, window_size=64, read_size=32)]
+        self.assertEqual(expected, list(range(1000)))
+        self.assertEqual(streamed, expected)
+
+  def test_route_logreader(self):
+    with tempfile.TemporaryDirectory() as d:
+      log_paths = []
+      for seg in range(4):
+        dat = b""
+        # segments overlap their neighbours slightly and aren't sorted internally
+        for t in reversed(range(seg * 100, seg * 100 + 110)):
+          ev = capnp_log.Event.new_message()
+          ev.logMonoTime = t
+          ev.init('carState')
+          dat += ev.to_bytes()
+
+        fn = f"{d}/{seg}.bz2"
+        with open(fn, "wb") as f:
+          f.write(bz2.compress(dat))
+        log_paths.append(fn)
+      log_paths.insert(2, None)
+
+      ts = [ev.logMonoTime for ev in RouteLogReader(log_paths, prefetch=2)]
+      self.assertEqual(len(ts), 4 * 110)
+      self.assertEqual(ts, sorted(ts))
+
+  def test_logreader_services(self):
+    dat = b""
+    for i in range(300):
+      ev = capnp_log.Event.new_message()
+      ev.logMonoTime = i
+      if i % 3 == 0:
+        ev.init('carState')
+      else:
+        ev.init(['can', 'carEvents'][i % 3 - 1], 1)
+      dat += ev.to_bytes()
+
+    with tempfile.NamedTemporaryFile(suffix=".bz2") as fp:
+      fp.write(bz2.compress(dat))
+      fp.flush()
+
+      # first read builds the index, second one loads it from the cache
+      for _ in range(2):
+        lr = LogReader(fp.name, services=['can', 'carEvents'])
+        self.assertEqual([ev.logMonoTime for ev in lr], [i for i in range(300) if i % 3 != 0])
+        self.assertTrue(all(ev.which() in ('can', 'carEvents') for ev in lr))
+        self.assertEqual(lr.time_index(150), 100)
+
   @unittest.skip("skip for bandwith reasons")
   def test_framereader(self):
     def _check_data(f):
@@ -52,6 +116,12 @@ class TestReaders(unittest.TestCase):
       assert np.all(frame_first_30[0] == frame_0[0])
       assert np.all(frame_first_30[15] == frame_15[0])
 
+      frames = f.get_frames([15, 0, 1100, 15])
+      assert np.all(frames[0] == frame_15[0])
+      assert np.all(frames[1] == frame_0[0])
+      assert np.all(frames[2] == f.get(1100, 1)[0])
+      assert np.all(frames[3] == frame_15[0])
+
     with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
       r = requests.get("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
       fp.write(r.content)
@@ -2,19 +2,68 @@
 
 import os
 import time
+import atexit
 import tempfile
 import threading
 import urllib.parse
 import pycurl
 from hashlib import sha256
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from tools.lib.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+from tools.lib.url_file_cache import ChunkCache, parse_size
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Number of chunks downloaded in parallel, each download thread keeps its own keep-alive connection
+DOWNLOAD_THREADS = int(os.environ.get("URLFILE_THREADS", "8"))
 
 CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+#  Least recently used chunks are evicted above this size, 0 keeps everything
+CACHE_MAX_BYTES = parse_size(os.environ.get("COMMA_CACHE_MAX_BYTES", "0"))
+
+_tlocal = threading.local()
+_pool = None
+_chunk_cache = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _get_curl():
+  try:
+    return _tlocal.curl
+  except AttributeError:
+    _tlocal.curl = pycurl.Curl()
+    return _tlocal.curl
+
+
+def _get_pool():
+  global _pool
+  with _inflight_lock:
+    if _pool is None:
+      _pool = ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS, thread_name_prefix="urlfile")
+    return _pool
+
+
+def get_chunk_cache():
+  global _chunk_cache
+  with _inflight_lock:
+    if _chunk_cache is None:
+      _chunk_cache = ChunkCache(CACHE_DIR, CACHE_MAX_BYTES)
+      atexit.register(_chunk_cache.flush)
+    return _chunk_cache
+
+
+def _submit_once(key, fn, *args):
+  """Runs fn on the download pool, sharing the future with concurrent requests for the same key."""
+  pool = _get_pool()
+  with _inflight_lock:
+    future = _inflight.get(key)
+    if future is None:
+      future = _inflight[key] = pool.submit(fn, *args)
+      future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return future
 
 
 def hash_256(link):
@@ -23,23 +72,19 @@ def hash_256(link):
 
 
 class URLFile(object):
-  _tlocal = threading.local()
-
-  def __init__(self, url, debug=False, cache=None):
+  def __init__(self, url, debug=False, cache=None, readahead=0):
+    """readahead is a hint of how many bytes past each read to prefetch into the cache."""
     self._url = url
     self._pos = 0
     self._length = None
     self._local_file = None
     self._debug = debug
+    self._readahead = readahead
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
 
-    try:
-      self._curl = self._tlocal.curl
-    except AttributeError:
-      self._curl = self._tlocal.curl = pycurl.Curl()
     mkdirs_exists_ok(CACHE_DIR)
 
   def __enter__(self):
@@ -53,7 +98,7 @@ class URLFile(object):
 
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def get_length_online(self):
-    c = self._curl
+    c = _get_curl()
     c.reset()
     c.setopt(pycurl.NOSIGNAL, 1)
     c.setopt(pycurl.TIMEOUT_MS, 500000)
@@ -81,53 +126,100 @@ class URLFile(object):
         file_length.write(str(self._length))
     return self._length
 
-  def read(self, ll=None):
+  def _chunk_name(self, chunk_idx):
+    # chunk names are kept as "<hash>_<float index>" for compatibility with existing caches
+    return hash_256(self._url) + "_" + str(float(chunk_idx))
+
+  def _read_chunks(self, chunk_idxs):
+    """Yields the data of each chunk, missing chunks are downloaded on the pool in parallel.
+
+       Only waits on the pool from the calling thread, a pool worker waiting on tasks queued behind it would deadlock.
+    """
+    cache = get_chunk_cache()
+    chunks = []
+    for chunk_idx in chunk_idxs:
+      name = self._chunk_name(chunk_idx)
+      data = cache.get(name)
+      chunks.append(data if data is not None else _submit_once(name, self._download_chunk, chunk_idx, name))
+
+    for data in chunks:
+      yield data if isinstance(data, bytes) else data.result()
+
+  def _download_chunk(self, chunk_idx, name):
+    start = chunk_idx * CHUNK_SIZE
+    data = self._download(start, min(start + CHUNK_SIZE, self.get_length()))
+    get_chunk_cache().put(name, data)
+    return data
+
+  def prefetch(self, pos, ll):
+    """Starts downloading the chunks covering [pos, pos + ll) into the cache without waiting for them."""
     if self._force_download:
+      return
+    end = min(pos + ll, self.get_length())
+    cache = get_chunk_cache()
+    for chunk_idx in range(pos // CHUNK_SIZE, (end + CHUNK_SIZE - 1) // CHUNK_SIZE):
+      name = self._chunk_name(chunk_idx)
+      if name not in cache:
+        _submit_once(name, self._download_chunk, chunk_idx, name)
+
+  def read(self, ll=None):
+    """Reads ll bytes from the current position, or up to the end of the file. Always returns bytes."""
+    if self._force_download and ll is not None and ll <= CHUNK_SIZE:
       return self.read_aux(ll=ll)
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+    file_end = min(self._pos + ll, self.get_length()) if ll is not None else self.get_length()
+    if file_end <= file_begin:
+      return b""
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    response = bytearray(file_end - file_begin)
+    view = memoryview(response)
+    if self._force_download:
+      # split large reads into parallel range requests
+      starts = range(file_begin, file_end, CHUNK_SIZE)
+      parts = _get_pool().map(lambda start: (start, self._download(start, min(start + CHUNK_SIZE, file_end))), starts)
+      for start, data in parts:
+        view[start - file_begin:start - file_begin + len(data)] = data
+    else:
+      #  We have to align with chunks we store, fetch all missing chunks of the range in parallel
+      chunk_idxs = range(file_begin // CHUNK_SIZE, (file_end + CHUNK_SIZE - 1) // CHUNK_SIZE)
+      for chunk_idx, data in zip(chunk_idxs, self._read_chunks(chunk_idxs)):
+        position = chunk_idx * CHUNK_SIZE
+        data = data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+        dst = max(0, position - file_begin)
+        view[dst:dst + len(data)] = data
+
+      if self._readahead:
+        self.prefetch(file_end, self._readahead)
+
+    view.release()
+    self._pos = file_end
+    return bytes(response)
 
-  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def read_aux(self, ll=None):
-    download_range = False
-    headers = ["Connection: keep-alive"]
     if self._pos != 0 or ll is not None:
       if ll is None:
-        end = self.get_length() - 1
+        end = self.get_length()
       else:
-        end = min(self._pos + ll, self.get_length()) - 1
+        end = min(self._pos + ll, self.get_length())
       if self._pos >= end:
         return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
-      download_range = True
+      ret = self._download(self._pos, end)
+    else:
+      ret = self._download(0, None)
+    self._pos += len(ret)
+    return ret
+
+  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+  def _download(self, start, end):
+    """Downloads [start, end) of the file, or the whole file if end is None. Safe to call from any thread."""
+    download_range = end is not None
+    headers = ["Connection: keep-alive"]
+    if download_range:
+      headers.append(f"Range: bytes={start}-{end - 1}")
 
     dats = BytesIO()
-    c = self._curl
+    c = _get_curl()
     c.setopt(pycurl.URL, self._url)
     c.setopt(pycurl.WRITEDATA, dats)
     c.setopt(pycurl.NOSIGNAL, 1)
@@ -166,9 +258,7 @@ class URLFile(object):
     if (not download_range) and response_code != 200:  # OK
       raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
 
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+    return dats.getvalue()
 
   def seek(self, pos):
     self._pos = pos
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+from tools.lib.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+
+INDEX_NAME = "cache_index.db"
+STATS = ('hits', 'misses', 'bytes_hit', 'bytes_downloaded', 'evictions', 'bytes_evicted')
+FLUSH_INTERVAL = 5.  # seconds between writes of access times and counters to the index
+EVICT_TARGET = 0.9  # evict down to this fraction of the budget so we don't evict on every write
+
+
+def parse_size(s):
+  """Parses sizes like 500M or 20G."""
+  units = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+  s = str(s).strip().upper()
+  if s and s[-1] in units:
+    return int(float(s[:-1]) * units[s[-1]])
+  return int(s)
+
+
+class ChunkCache(object):
+  """Size bounded LRU store for the files in the URLFile cache directory.
+
+     Sizes and access times live in an sqlite index next to the cached files, so lookups
+     don't stat the filesystem and eviction doesn't have to scan the directory. Several
+     processes can share one cache, files written by others are adopted on first access.
+     A max_bytes of 0 disables eviction.
+  """
+  def __init__(self, cache_dir, max_bytes=0):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self._lock = threading.RLock()
+    self._db = None
+    self._entries = {}
+    self._touched = {}
+    self._stats = dict.fromkeys(STATS, 0)
+    self._total = 0
+    self._last_flush = time.monotonic()
+    self._open()
+
+  def _open(self):
+    mkdirs_exists_ok(self.cache_dir)
+    index_path = os.path.join(self.cache_dir, INDEX_NAME)
+    new_index = not os.path.exists(index_path)
+    self._db = sqlite3.connect(index_path, timeout=30, check_same_thread=False)
+    with self._db:
+      self._db.execute("CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, size INTEGER, atime REAL)")
+      self._db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+      if new_index:
+        # adopt files cached before the index existed
+        for fn in os.listdir(self.cache_dir):
+          path = os.path.join(self.cache_dir, fn)
+          if fn.startswith(INDEX_NAME) or not os.path.isfile(path):
+            continue
+          st = os.stat(path)
+          self._db.execute("INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", (fn, st.st_size, st.st_atime))
+    self._entries = dict(self._db.execute("SELECT name, size FROM entries"))
+    self._total = sum(self._entries.values())
+
+  def _check_index(self):
+    # the cache directory may have been wiped from under us
+    if not os.path.exists(os.path.join(self.cache_dir, INDEX_NAME)):
+      self._db.close()
+      self._open()
+
+  def __contains__(self, name):
+    return name in self._entries or os.path.exists(os.path.join(self.cache_dir, name))
+
+  def get(self, name):
+    """Returns the cached contents of name, or None."""
+    try:
+      with open(os.path.join(self.cache_dir, name), "rb") as f:
+        data = f.read()
+    except FileNotFoundError:
+      data = None
+
+    with self._lock:
+      if data is None:
+        self._stats['misses'] += 1
+        self._total -= self._entries.pop(name, 0)
+        return None
+
+      if name not in self._entries:
+        self._entries[name] = len(data)
+        self._total += len(data)
+      self._touched[name] = (len(data), time.time())
+      self._stats['hits'] += 1
+      self._stats['bytes_hit'] += len(data)
+      self._maybe_flush()
+    return data
+
+  def _write(self, name, data):
+    with atomic_write_in_dir(os.path.join(self.cache_dir, name), mode="wb") as f:
+      f.write(data)
+
+  def put(self, name, data):
+    try:
+      self._write(name, data)
+    except FileNotFoundError:
+      # the cache directory may have been wiped from under us
+      mkdirs_exists_ok(self.cache_dir)
+      self._write(name, data)
+
+    with self._lock:
+      self._total += len(data) - self._entries.get(name, 0)
+      self._entries[name] = len(data)
+      self._touched[name] = (len(data), time.time())
+      self._stats['bytes_downloaded'] += len(data)
+      if self.max_bytes and self._total > self.max_bytes:
+        self.evict()
+      else:
+        self._maybe_flush()
+
+  def _maybe_flush(self):
+    if time.monotonic() - self._last_flush > FLUSH_INTERVAL:
+      self.flush()
+
+  def flush(self):
+    """Writes pending access times and counters to the index."""
+    with self._lock:
+      self._check_index()
+      with self._db:
+        self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                             [(name, size, atime) for name, (size, atime) in self._touched.items()])
+        for k, v in self._stats.items():
+          self._db.execute("INSERT OR IGNORE INTO stats VALUES (?, 0)", (k,))
+          self._db.execute("UPDATE stats SET value = value + ? WHERE name = ?", (v, k))
+      self._touched.clear()
+      self._stats = dict.fromkeys(STATS, 0)
+      self._last_flush = time.monotonic()
+
+  def evict(self, max_bytes=None):
+    """Removes least recently used files until the cache is below the budget."""
+    max_bytes = self.max_bytes if max_bytes is None else max_bytes
+    with self._lock:
+      self.flush()
+      self._entries = dict(self._db.execute("SELECT name, size FROM entries"))
+      self._total = sum(self._entries.values())
+      target = int(max_bytes * EVICT_TARGET)
+      if self._total <= max_bytes:
+        return
+
+      evicted = []
+      for name, size in self._db.execute("SELECT name, size FROM entries ORDER BY atime ASC").fetchall():
+        if self._total <= target:
+          break
+        try:
+          os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+          pass
+        evicted.append((name,))
+        self._total -= size
+        self._entries.pop(name, None)
+        self._stats['evictions'] += 1
+        self._stats['bytes_evicted'] += size
+
+      with self._db:
+        self._db.executemany("DELETE FROM entries WHERE name = ?", evicted)
+      self.flush()
+
+  def clear(self):
+    self.evict(max_bytes=0)
+
+  def stats(self):
+    """Returns the hit/miss/bytes counters accumulated by all users of the cache, plus its current size."""
+    with self._lock:
+      self.flush()
+      ret = dict.fromkeys(STATS, 0)
+      ret.update(self._db.execute("SELECT name, value FROM stats"))
+      ret['entries'] = len(self._entries)
+      ret['bytes'] = self._total
+      ret['max_bytes'] = self.max_bytes
+      return ret
+
+
+if __name__ == "__main__":
+  from tools.lib.url_file import CACHE_DIR, CACHE_MAX_BYTES
+
+  parser = argparse.ArgumentParser(description="Inspect and trim the URLFile download cache")
+  parser.add_argument("command", choices=["stats", "evict", "clear"])
+  parser.add_argument("--max-bytes", default=CACHE_MAX_BYTES, type=parse_size, help="cache budget, e.g. 20G")
+  args = parser.parse_args()
+
+  cache = ChunkCache(CACHE_DIR, args.max_bytes)
+  if args.command == "evict":
+    if not args.max_bytes:
+      sys.exit("no budget given, set --max-bytes or COMMA_CACHE_MAX_BYTES")
+    cache.evict()
+  elif args.command == "clear":
+    cache.clear()
+
+  for k, v in cache.stats().items():
+    print(f"{k:17} {v}")
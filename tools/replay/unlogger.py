@@ -21,7 +21,7 @@ from common.transformations.camera import eon_f_frame_size, tici_f_frame_size
 from tools.lib.kbhit import KBHit
 from tools.lib.logreader import MultiLogIterator
 from tools.lib.route import Route
-from tools.lib.framereader import rgb24toyuv420
+from tools.lib.framereader import frame_buffer, rgb24toyuv420
 from tools.lib.route_framereader import RouteFrameReader
 
 # Commands.
@@ -37,6 +37,7 @@ VIPC_YUV = "yuv"
 class UnloggerWorker(object):
   def __init__(self):
     self._frame_reader = None
+    self._frame_buf = None
     self._cookie = None
     self._readahead = deque()
 
@@ -107,7 +108,10 @@ class UnloggerWorker(object):
         # load the frame readers as needed
         s1 = time.time()
         try:
-          img = self._frame_reader.get(frame_id, pix_fmt="rgb24")
+          # decode into the same buffer every frame, it is serialized before the next one
+          if self._frame_buf is None:
+            self._frame_buf = frame_buffer(1, self._frame_reader.w, self._frame_reader.h, "rgb24")
+          img = self._frame_reader.get(frame_id, pix_fmt="rgb24", out=self._frame_buf)
         except Exception:
           img = None
 
@@ -125,9 +129,7 @@ class UnloggerWorker(object):
             data_socket.send_pyobj((cookie, VIPC_YUV, msg.logMonoTime, route_time, extra), flags=zmq.SNDMORE)
             data_socket.send(img_yuv.flatten().tobytes(), copy=False)
 
-          img = img[:, :, ::-1]  # Convert RGB to BGR, which is what the camera outputs
-          img = img.flatten()
-          bts = img.tobytes()
+          bts = img[:, :, ::-1].tobytes()  # Convert RGB to BGR, which is what the camera outputs
 
           smsg.roadCameraState.image = bts
 
@@ -149,6 +151,7 @@ class UnloggerWorker(object):
       if "roadCameraState" in pub_types or "roadEncodeIdx" in pub_types:
         # reset frames for a route
         self._frame_id_lookup = {}
+        self._frame_buf = None
         self._frame_reader = RouteFrameReader(
           route.camera_paths(), None, self._frame_id_lookup, readahead=True)
 
@@ -8,6 +8,8 @@ from selfdrive.car import crc8_pedal
 
 packer = CANPacker("honda_civic_touring_2016_can_generated")
 rpacker = CANPacker("acura_ilx_2016_nidec")
+gas_sensor = packer.template("GAS_SENSOR", ["COUNTER_PEDAL", "CHECKSUM_PEDAL"])
+radar_tracks = [rpacker.template("TRACK_%d" % i, ["LONG_DIST"]) for i in range(16)]
 
 
 def get_car_can_parser():
@@ -29,51 +31,45 @@ cp = get_car_can_parser()
 
 def can_function(pm, speed, angle, idx, cruise_button, is_engaged):
 
-  msg = []
-
-  # *** powertrain bus ***
-
   speed = speed * 3.6 # convert m/s to kph
-  msg.append(packer.make_can_msg("ENGINE_DATA", 0, {"XMISSION_SPEED": speed}, idx))
-  msg.append(packer.make_can_msg("WHEEL_SPEEDS", 0, {
-    "WHEEL_SPEED_FL": speed,
-    "WHEEL_SPEED_FR": speed,
-    "WHEEL_SPEED_RL": speed,
-    "WHEEL_SPEED_RR": speed
-  }, -1))
-
-  msg.append(packer.make_can_msg("SCM_BUTTONS", 0, {"CRUISE_BUTTONS": cruise_button}, idx))
-
-  values = {"COUNTER_PEDAL": idx & 0xF}
-  checksum = crc8_pedal(packer.make_can_msg("GAS_SENSOR", 0, {"COUNTER_PEDAL": idx & 0xF}, -1)[2][:-1])
-  values["CHECKSUM_PEDAL"] = checksum
-  msg.append(packer.make_can_msg("GAS_SENSOR", 0, values, -1))
-
-  msg.append(packer.make_can_msg("GEARBOX", 0, {"GEAR": 4, "GEAR_SHIFTER": 8}, idx))
-  msg.append(packer.make_can_msg("GAS_PEDAL_2", 0, {}, idx))
-  msg.append(packer.make_can_msg("SEATBELT_STATUS", 0, {"SEATBELT_DRIVER_LATCHED": 1}, idx))
-  msg.append(packer.make_can_msg("STEER_STATUS", 0, {}, idx))
-  msg.append(packer.make_can_msg("STEERING_SENSORS", 0, {"STEER_ANGLE": angle}, idx))
-  msg.append(packer.make_can_msg("VSA_STATUS", 0, {}, idx))
-  msg.append(packer.make_can_msg("STANDSTILL", 0, {"WHEELS_MOVING": 1 if speed >= 1.0 else 0}, idx))
-  msg.append(packer.make_can_msg("STEER_MOTOR_TORQUE", 0, {}, idx))
-  msg.append(packer.make_can_msg("EPB_STATUS", 0, {}, idx))
-  msg.append(packer.make_can_msg("DOORS_STATUS", 0, {}, idx))
-  msg.append(packer.make_can_msg("CRUISE_PARAMS", 0, {}, idx))
-  msg.append(packer.make_can_msg("CRUISE", 0, {}, idx))
-  msg.append(packer.make_can_msg("SCM_FEEDBACK", 0, {"MAIN_ON": 1}, idx))
-  msg.append(packer.make_can_msg("POWERTRAIN_DATA", 0, {"ACC_STATUS": int(is_engaged)}, idx))
-
-  # *** cam bus ***
-  msg.append(packer.make_can_msg("STEERING_CONTROL", 2, {}, idx))
-  msg.append(packer.make_can_msg("ACC_HUD", 2, {}, idx))
-  msg.append(packer.make_can_msg("BRAKE_COMMAND", 2, {}, idx))
+  pedal_checksum = crc8_pedal(gas_sensor.make_can_msg(0, (idx & 0xF, 0), -1)[2][:-1])
+
+  msg = packer.make_can_msgs([
+    # *** powertrain bus ***
+    ("ENGINE_DATA", 0, {"XMISSION_SPEED": speed}, idx),
+    ("WHEEL_SPEEDS", 0, {
+      "WHEEL_SPEED_FL": speed,
+      "WHEEL_SPEED_FR": speed,
+      "WHEEL_SPEED_RL": speed,
+      "WHEEL_SPEED_RR": speed
+    }, -1),
+    ("SCM_BUTTONS", 0, {"CRUISE_BUTTONS": cruise_button}, idx),
+    ("GAS_SENSOR", 0, {"COUNTER_PEDAL": idx & 0xF, "CHECKSUM_PEDAL": pedal_checksum}, -1),
+    ("GEARBOX", 0, {"GEAR": 4, "GEAR_SHIFTER": 8}, idx),
+    ("GAS_PEDAL_2", 0, {}, idx),
+    ("SEATBELT_STATUS", 0, {"SEATBELT_DRIVER_LATCHED": 1}, idx),
+    ("STEER_STATUS", 0, {}, idx),
+    ("STEERING_SENSORS", 0, {"STEER_ANGLE": angle}, idx),
+    ("VSA_STATUS", 0, {}, idx),
+    ("STANDSTILL", 0, {"WHEELS_MOVING": 1 if speed >= 1.0 else 0}, idx),
+    ("STEER_MOTOR_TORQUE", 0, {}, idx),
+    ("EPB_STATUS", 0, {}, idx),
+    ("DOORS_STATUS", 0, {}, idx),
+    ("CRUISE_PARAMS", 0, {}, idx),
+    ("CRUISE", 0, {}, idx),
+    ("SCM_FEEDBACK", 0, {"MAIN_ON": 1}, idx),
+    ("POWERTRAIN_DATA", 0, {"ACC_STATUS": int(is_engaged)}, idx),
+
+    # *** cam bus ***
+    ("STEERING_CONTROL", 2, {}, idx),
+    ("ACC_HUD", 2, {}, idx),
+    ("BRAKE_COMMAND", 2, {}, idx),
+  ])
 
   # *** radar bus ***
   if idx % 5 == 0:
     msg.append(rpacker.make_can_msg("RADAR_DIAGNOSTIC", 1, {"RADAR_STATE": 0x79}, -1))
-    for i in range(16):
-      msg.append(rpacker.make_can_msg("TRACK_%d" % i, 1, {"LONG_DIST": 255.5}, -1))
+    msg.extend(t.make_can_msg(1, (255.5,), -1) for t in radar_tracks)
 
   # fill in the rest for fingerprint
   done = set([x[0] for x in msg])